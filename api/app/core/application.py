@@ -52,4 +52,10 @@ def create_app() -> FastAPI:
     # Include the versioned router
     app.include_router(pgcopydb_router)
     
+    # Start claiming jobs from the shared queue when several replicas share the work
+    @app.on_event("startup")
+    async def start_worker():
+        from app.v1.services.job_service import start_job_worker
+        start_job_worker()
+    
     return app
@@ -62,6 +62,19 @@ def write_to_log(log_file: str, message: str) -> None:
         logger.exception(f"Error writing to log file {log_file}: {str(e)}")
 
 
+def emit_log_line(pid: int, level: str, message: str) -> None:
+    """
+    Print a line in pgcopydb's log format, so the job log, log search and
+    traces read the output of the API's own job scripts like pgcopydb's.
+    
+    Args:
+        pid: Process the line is about
+        level: Log level
+        message: Log message
+    """
+    print(f"{datetime.now().strftime('%H:%M:%S.%f')[:-3]} {pid} {level:<6} {message}", flush=True)
+
+
 def update_job_status(jobs: Dict, job_id: str, status: Dict) -> None:
     """
     Update the status of a job in the jobs dictionary.
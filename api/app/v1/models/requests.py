@@ -1,3 +1,4 @@
+from datetime import datetime
 from typing import List, Optional
 from pydantic import BaseModel, Field, validator
 
@@ -13,10 +14,44 @@ class ConnectionString(BaseModel):
         return v
 
 
+class ThrottleSettings(BaseModel):
+    """Load limits on the source database and bounds for the adaptive throttle."""
+    max_active_connections: Optional[int] = Field(default=None, gt=0, description="Maximum active sessions on the source")
+    max_waiting_sessions: Optional[int] = Field(default=None, gt=0, description="Maximum active sessions waiting on IO or locks on the source")
+    max_replication_lag_bytes: Optional[int] = Field(default=None, gt=0, description="Maximum replication slot lag on the source in bytes")
+    min_workers: int = Field(default=1, ge=1, description="Minimum number of pgcopydb workers kept running")
+    max_workers: Optional[int] = Field(default=None, ge=1, description="Maximum number of pgcopydb workers kept running")
+    min_duty_cycle: float = Field(default=0.25, gt=0, le=1, description="Minimum fraction of time the remaining workers run when the source is still overloaded")
+    sample_interval_seconds: int = Field(default=10, ge=1, description="Seconds between source load samples")
+
+
 class CloneRequest(BaseModel):
     source: str = Field(..., description="Source database connection string")
     target: str = Field(..., description="Target database connection string")
     options: Optional[List[str]] = Field(default=[], description="Additional options for pgcopydb clone")
+    throttle: Optional[ThrottleSettings] = Field(default=None, description="Adapt the job's concurrency to the source load")
+    split_tables: Optional[bool] = Field(default=True, description="Split the largest tables so several COPY workers share them")
+    
+    @validator('source', 'target')
+    def validate_connection_strings(cls, v):
+        if not v.startswith('postgresql://'):
+            raise ValueError('Connection strings must start with postgresql://')
+        return v
+
+
+class ServerCloneRequest(BaseModel):
+    source: str = Field(..., description="Connection string of any database of the source server")
+    target: str = Field(..., description="Connection string of any database of the target server")
+    databases: Optional[List[str]] = Field(default=None, description="Only clone these databases")
+    exclude_databases: Optional[List[str]] = Field(default=None, description="Databases not to clone")
+    max_processes: Optional[int] = Field(default=None, ge=2, description="Cap on the pgcopydb processes of all the databases cloned at once")
+    max_connections: Optional[int] = Field(default=None, ge=4, description="Cap on the connections to either server of all the databases cloned at once")
+    table_jobs: Optional[int] = Field(default=None, ge=1, description="COPY processes of each large database")
+    index_jobs: Optional[int] = Field(default=None, ge=1, description="CREATE INDEX processes of each large database")
+    skip_roles: Optional[bool] = Field(default=False, description="Do not copy the roles")
+    no_role_passwords: Optional[bool] = Field(default=False, description="Copy the roles without their passwords")
+    split_tables: Optional[bool] = Field(default=True, description="Split the largest tables of each database")
+    options: Optional[List[str]] = Field(default=[], description="Additional options for the pgcopydb clone of each database")
     
     @validator('source', 'target')
     def validate_connection_strings(cls, v):
@@ -24,6 +59,14 @@ class CloneRequest(BaseModel):
             raise ValueError('Connection strings must start with postgresql://')
         return v
 
+    @validator('options')
+    def validate_options(cls, v):
+        reserved_options = ['--source', '--target', '--dir', '--table-jobs', '--index-jobs', '--large-objects-jobs']
+        for option in v or []:
+            if option.split('=', 1)[0] in reserved_options:
+                raise ValueError(f'Options must not include {", ".join(reserved_options)}, they are set for each database')
+        return v
+
 
 class DumpRequest(BaseModel):
     source: str = Field(..., description="Source database connection string")
@@ -35,6 +78,9 @@ class DumpRequest(BaseModel):
     snapshot: Optional[str] = Field(default=None, description="Use an exported snapshot")
     skip_extensions: Optional[bool] = Field(default=False, description="Skip restoring extensions")
     filters_file: Optional[str] = Field(default=None, description="File with defined filters")
+    retention_hours: Optional[int] = Field(default=None, gt=0, description="Remove the dump automatically after this many hours")
+    compression: Optional[str] = Field(default=None, description="Compress the dump files: 'gzip' or 'zstd'")
+    compression_level: Optional[int] = Field(default=None, description="Compression level (gzip 1-9, zstd 1-19)")
     
     @validator('source')
     def validate_connection_string(cls, v):
@@ -49,6 +95,45 @@ class DumpRequest(BaseModel):
             raise ValueError(f'Dump type must be one of {", ".join(allowed_types)}')
         return v
 
+    @validator('compression')
+    def validate_compression(cls, v):
+        allowed_algorithms = ['gzip', 'zstd']
+        if v is not None and v not in allowed_algorithms:
+            raise ValueError(f'Compression must be one of {", ".join(allowed_algorithms)}')
+        return v
+
+    @validator('compression_level')
+    def validate_compression_level(cls, v, values):
+        if v is None:
+            return v
+        algorithm = values.get('compression')
+        if not algorithm:
+            raise ValueError('compression_level requires compression')
+        max_level = 9 if algorithm == 'gzip' else 19
+        if not 1 <= v <= max_level:
+            raise ValueError(f'{algorithm} compression level must be between 1 and {max_level}')
+        return v
+
+
+class PostDataSettings(BaseModel):
+    """Scheduling and resources of a post-data job (indexes, constraints, foreign keys)."""
+    index_jobs: Optional[int] = Field(default=None, ge=1, description="Indexes and constraints built concurrently")
+    memory_budget_mb: Optional[int] = Field(default=None, ge=64, description="maintenance_work_mem shared by the concurrent builds, in MB")
+    parallel_maintenance_workers: Optional[int] = Field(default=None, ge=0, description="max_parallel_maintenance_workers of each build")
+    start_at: Optional[datetime] = Field(default=None, description="Do not start before this time")
+
+
+class PostDataRequest(PostDataSettings):
+    target: str = Field(..., description="Target database connection string")
+    dir: str = Field(..., description="Directory where the dump is located")
+    after_job: Optional[str] = Field(default=None, description="Start once this job has completed")
+    
+    @validator('target')
+    def validate_connection_string(cls, v):
+        if not v.startswith('postgresql://'):
+            raise ValueError('Connection string must start with postgresql://')
+        return v
+
 
 class RestoreRequest(BaseModel):
     target: str = Field(..., description="Target database connection string")
@@ -57,6 +142,8 @@ class RestoreRequest(BaseModel):
     exclude_tables: Optional[List[str]] = Field(default=None, description="List of tables to exclude")
     schema_only: Optional[bool] = Field(default=False, description="Restore schema only")
     data_only: Optional[bool] = Field(default=False, description="Restore data only")
+    defer_post_data: Optional[bool] = Field(default=False, description="Restore indexes and constraints in a separate post-data job")
+    post_data: Optional[PostDataSettings] = Field(default=None, description="Settings of the deferred post-data job")
     
     @validator('target')
     def validate_connection_string(cls, v):
@@ -70,6 +157,9 @@ class CopyRequest(BaseModel):
     target: str = Field(..., description="Target database connection string")
     tables: Optional[List[str]] = Field(default=None, description="List of specific tables to copy")
     exclude_tables: Optional[List[str]] = Field(default=None, description="List of tables to exclude")
+    throttle: Optional[ThrottleSettings] = Field(default=None, description="Adapt the job's concurrency to the source load")
+    split_tables: Optional[bool] = Field(default=True, description="Split the largest tables so several COPY workers share them")
+    incremental: Optional[bool] = Field(default=False, description="Only copy the tables that changed since the last successful incremental copy")
     
     @validator('source', 'target')
     def validate_connection_strings(cls, v):
@@ -78,6 +168,40 @@ class CopyRequest(BaseModel):
         return v
 
 
+class PlanRequest(BaseModel):
+    operation: str = Field(..., description="Operation to plan: 'clone', 'copy', or 'restore'")
+    source: Optional[str] = Field(default=None, description="Source database connection string (clone, copy)")
+    target: str = Field(..., description="Target database connection string")
+    dir: Optional[str] = Field(default=None, description="Directory where the dump is located (restore)")
+    options: Optional[List[str]] = Field(default=[], description="Additional options for pgcopydb clone")
+    tables: Optional[List[str]] = Field(default=None, description="List of specific tables to include")
+    exclude_tables: Optional[List[str]] = Field(default=None, description="List of tables to exclude")
+    schema_only: Optional[bool] = Field(default=False, description="Restore schema only")
+    data_only: Optional[bool] = Field(default=False, description="Restore data only")
+    
+    @validator('source', 'target')
+    def validate_connection_strings(cls, v):
+        if v is not None and not v.startswith('postgresql://'):
+            raise ValueError('Connection strings must start with postgresql://')
+        return v
+    
+    @validator('operation')
+    def validate_operation(cls, v):
+        allowed_operations = ['clone', 'copy', 'restore']
+        if v not in allowed_operations:
+            raise ValueError(f'Operation must be one of {", ".join(allowed_operations)}')
+        return v
+    
+    @validator('dir', always=True)
+    def validate_operation_inputs(cls, v, values):
+        operation = values.get('operation')
+        if operation == 'restore' and not v:
+            raise ValueError('dir is required to plan a restore')
+        if operation in ('clone', 'copy') and not values.get('source'):
+            raise ValueError(f'source is required to plan a {operation}')
+        return v
+
+
 class FilterTablesRequest(BaseModel):
     connection_string: str = Field(..., description="Database connection string")
     filter: str = Field(..., description="Filter for tables (like_pattern)")
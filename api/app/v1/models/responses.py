@@ -10,6 +10,15 @@ class JobStatus(BaseModel):
     error: Optional[str] = None
     finished: bool
     log_file: Optional[str] = None
+    worker: Optional[str] = None
+    progress: Optional[Dict[str, Any]] = None
+    throttle: Optional[Dict[str, Any]] = None
+    compression: Optional[Dict[str, Any]] = None
+    incremental: Optional[Dict[str, Any]] = None
+    split_plan: Optional[Dict[str, Any]] = None
+    index_progress: Optional[Dict[str, Any]] = None
+    post_data_job_id: Optional[str] = None
+    databases: Optional[Dict[str, Any]] = None
 
 
 class JobResponse(BaseModel):
@@ -32,6 +41,46 @@ class FilterTablesResponse(BaseModel):
     count: int
 
 
+class PlanResponse(BaseModel):
+    operation: str
+    command: str
+    recommended_command: str
+    inventory: Dict[str, Any]
+    recommended_parallelism: Optional[Dict[str, int]] = None
+    split_plan: Optional[Dict[str, Any]] = None
+    peak_disk_bytes: int
+    estimated_duration_seconds: Optional[int] = None
+    estimate: Dict[str, Any]
+
+
+class HistoryResponse(BaseModel):
+    start_date: str
+    end_date: str
+    partitions: list[str]
+    jobs: int
+    group_by: str
+    groups: list[Dict[str, Any]]
+    slowest_tables: list[Dict[str, Any]]
+
+
+class LogSearchResponse(BaseModel):
+    query: Dict[str, Any]
+    total: int
+    jobs: int
+    records: list[Dict[str, Any]]
+
+
+class StorageResponse(BaseModel):
+    path: str
+    total_bytes: int
+    used_bytes: int
+    free_bytes: int
+    reserved_bytes: int
+    available_bytes: int
+    quota_bytes: Optional[int] = None
+    jobs: list[Dict[str, Any]]
+
+
 class HealthResponse(BaseModel):
     status: str
     pgcopydb_version: str
@@ -1,26 +1,39 @@
 import uuid
 import os
 import socket
-from fastapi import APIRouter, HTTPException, BackgroundTasks, status
-from typing import List
+from datetime import date
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Query, status
+from typing import List, Optional
 
 from app.v1.models.requests import (
     ConnectionString, CloneRequest, DumpRequest, 
-    RestoreRequest, CopyRequest, FilterTablesRequest
+    RestoreRequest, CopyRequest, FilterTablesRequest, PlanRequest,
+    PostDataRequest, ServerCloneRequest
 )
 from app.v1.models.responses import (
     JobStatus, JobResponse, TableListResponse, 
-    FilterTablesResponse, HealthResponse, ApiInfo
+    FilterTablesResponse, HealthResponse, ApiInfo, PlanResponse,
+    HistoryResponse, StorageResponse, LogSearchResponse
 )
 from app.v1.services.job_service import (
-    run_command_background, get_job_status, 
-    init_job, get_job_log, jobs
+    submit_job, get_job_status, get_job_log, finish_job_without_command
 )
 from app.v1.services.pgcopydb_service import (
     check_pgcopydb_version, build_clone_command, 
     build_dump_command, build_restore_command, 
-    build_copy_command, list_tables, filter_tables
+    build_copy_command, list_tables, filter_tables, has_option
 )
+from app.v1.services.planner_service import plan_migration
+from app.v1.services.history_service import query_history
+from app.v1.services.storage_service import (
+    get_job_workdir, get_storage_usage, delete_job_storage
+)
+from app.v1.services.compression_service import get_compression_manifest, get_staging_bytes
+from app.v1.services.fingerprint_service import plan_incremental_copy, summarize_incremental_copy
+from app.v1.services.log_service import search_logs
+from app.v1.services.trace_service import get_trace, build_timeline, to_otlp
+from app.v1.services.postdata_service import build_post_data_command
+from app.v1.services.server_clone_service import build_server_clone_command
 
 # Get pod name for identification
 POD_NAME = os.environ.get("POD_NAME", socket.gethostname())
@@ -37,9 +50,9 @@ async def root():
         "version": "1.0.0",
         "pod": POD_NAME,
         "endpoints": [
-            "/v1/clone", "/v1/dump", "/v1/restore", "/v1/copy", 
-            "/v1/list-tables", "/v1/filter-tables", 
-            "/v1/check-status/{job_id}", "/v1/health"
+            "/v1/clone", "/v1/clone/server", "/v1/dump", "/v1/restore", "/v1/restore/post-data", "/v1/copy", 
+            "/v1/plan", "/v1/list-tables", "/v1/filter-tables", 
+            "/v1/check-status/{job_id}", "/v1/logs/search", "/v1/timeline/{job_id}", "/v1/history", "/v1/storage", "/v1/health"
         ],
         "documentation": {
             "swagger": "/docs",
@@ -71,7 +84,7 @@ async def health_check():
 
 
 @router.post("/clone", response_model=JobStatus, summary="Clone a PostgreSQL database")
-async def clone(request: CloneRequest, background_tasks: BackgroundTasks):
+def clone(request: CloneRequest, background_tasks: BackgroundTasks):
     """
     Clone a source PostgreSQL database to a target.
     
@@ -84,13 +97,75 @@ async def clone(request: CloneRequest, background_tasks: BackgroundTasks):
     """
     try:
         job_id = str(uuid.uuid4())
-        cmd = build_clone_command(request.source, request.target, request.options)
+        # Managed work directory, unless the caller chose one
+        work_dir = None if has_option(request.options, "--dir") else get_job_workdir(job_id)
+        options = list(request.options or [])
+        
+        cmd = build_clone_command(request.source, request.target, options, work_dir=work_dir)
+        
+        # Queue the job for execution
+        job_status = submit_job(job_id, cmd, background_tasks, metadata={
+            "job_type": "clone",
+            "source": request.source,
+            "target": request.target,
+            "work_dir": work_dir,
+            "options": options,
+            "throttle": request.throttle.model_dump() if request.throttle else None,
+            # The job plans the splits once it has measured the source
+            "split_tables": request.split_tables
+        })
+        
+        return {
+            "job_id": job_id,
+            **job_status
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/clone/server", response_model=JobStatus, summary="Clone every database of a PostgreSQL server")
+def clone_server(request: ServerCloneRequest, background_tasks: BackgroundTasks):
+    """
+    Clone every database of a source server to a target server as one job:
+    the roles are copied once, then the databases are cloned as sub-jobs,
+    largest first, as many at a time as the process and connection caps
+    allow. The job status reports the progress of each database.
+    
+    Args:
+        request: Server clone operation parameters
+        background_tasks: FastAPI background tasks manager
+    
+    Returns:
+        Job status information
+    """
+    try:
+        job_id = str(uuid.uuid4())
+        work_dir = get_job_workdir(job_id)
         
-        # Initialize job status
-        job_status = init_job(job_id, cmd)
+        cmd = build_server_clone_command(
+            job_id=job_id,
+            source=request.source,
+            target=request.target,
+            work_dir=work_dir,
+            databases=request.databases,
+            exclude_databases=request.exclude_databases,
+            table_jobs=request.table_jobs,
+            index_jobs=request.index_jobs,
+            max_processes=request.max_processes,
+            max_connections=request.max_connections,
+            skip_roles=request.skip_roles,
+            no_role_passwords=request.no_role_passwords,
+            split_tables=request.split_tables,
+            options=request.options
+        )
         
-        # Execute in background
-        background_tasks.add_task(run_command_background, job_id, cmd)
+        # Queue the job for execution
+        job_status = submit_job(job_id, cmd, background_tasks, metadata={
+            "job_type": "server-clone",
+            "source": request.source,
+            "target": request.target,
+            "work_dir": work_dir
+        })
         
         return {
             "job_id": job_id,
@@ -101,7 +176,7 @@ async def clone(request: CloneRequest, background_tasks: BackgroundTasks):
 
 
 @router.post("/dump", response_model=JobStatus, summary="Dump a PostgreSQL database")
-async def dump(request: DumpRequest, background_tasks: BackgroundTasks):
+def dump(request: DumpRequest, background_tasks: BackgroundTasks):
     """
     Dump a PostgreSQL database schema, data, and/or roles.
     
@@ -127,11 +202,15 @@ async def dump(request: DumpRequest, background_tasks: BackgroundTasks):
             filters_file=request.filters_file
         )
         
-        # Initialize job status
-        job_status = init_job(job_id, cmd)
-        
-        # Execute in background
-        background_tasks.add_task(run_command_background, job_id, cmd)
+        # Queue the job for execution
+        job_status = submit_job(job_id, cmd, background_tasks, metadata={
+            "job_type": "dump",
+            "source": request.source,
+            "dir": request.dir,
+            "retention_hours": request.retention_hours,
+            "compression": request.compression,
+            "compression_level": request.compression_level
+        })
         
         return {
             "job_id": job_id,
@@ -142,7 +221,7 @@ async def dump(request: DumpRequest, background_tasks: BackgroundTasks):
 
 
 @router.post("/restore", response_model=JobStatus, summary="Restore a PostgreSQL database")
-async def restore(request: RestoreRequest, background_tasks: BackgroundTasks):
+def restore(request: RestoreRequest, background_tasks: BackgroundTasks):
     """
     Restore a PostgreSQL database from a dump.
     
@@ -156,31 +235,112 @@ async def restore(request: RestoreRequest, background_tasks: BackgroundTasks):
     try:
         job_id = str(uuid.uuid4())
         
+        # Compressed dumps are read through named pipes in a staging directory,
+        # next to their decompressed archives
+        input_dir = get_job_workdir(job_id) if get_compression_manifest(request.dir) else None
+        
         cmd = build_restore_command(
             target=request.target,
-            directory=request.dir,
+            directory=input_dir or request.dir,
             schema_only=request.schema_only,
             data_only=request.data_only,
             tables=request.tables,
-            exclude_tables=request.exclude_tables
+            exclude_tables=request.exclude_tables,
+            skip_post_data=request.defer_post_data
         )
         
-        # Initialize job status
-        job_status = init_job(job_id, cmd)
+        # Queue the job for execution
+        job_status = submit_job(job_id, cmd, background_tasks, metadata={
+            "job_type": "restore",
+            "target": request.target,
+            "dir": request.dir,
+            "input_dir": input_dir,
+            "work_dir": input_dir,
+            "staging_bytes": get_staging_bytes(request.dir) if input_dir else 0
+        })
         
-        # Execute in background
-        background_tasks.add_task(run_command_background, job_id, cmd)
+        post_data_job_id = None
+        if request.defer_post_data:
+            post_data_job_id = _submit_post_data_job(
+                request.target, request.dir, request.post_data, background_tasks, after_job=job_id
+            )
         
         return {
             "job_id": job_id,
-            **job_status
+            **job_status,
+            "post_data_job_id": post_data_job_id
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def _submit_post_data_job(target: str, directory: str, settings, background_tasks: BackgroundTasks,
+                          after_job: Optional[str] = None) -> str:
+    """
+    Queue a post-data job.
+
+    Args:
+        target: Target database connection string
+        directory: Directory where the dump is located
+        settings: PostDataSettings of the job, or None for the defaults
+        background_tasks: FastAPI background tasks manager
+        after_job: Job that must complete before this one starts
+
+    Returns:
+        ID of the post-data job
+    """
+    job_id = str(uuid.uuid4())
+    start_at = settings.start_at if settings else None
+    work_dir = get_job_workdir(job_id)
+    cmd = build_post_data_command(
+        target=target,
+        directory=directory,
+        work_dir=work_dir,
+        index_jobs=settings.index_jobs if settings else None,
+        memory_budget_mb=settings.memory_budget_mb if settings else None,
+        parallel_maintenance_workers=settings.parallel_maintenance_workers if settings else None
+    )
+    submit_job(job_id, cmd, background_tasks, metadata={
+        "job_type": "post-data",
+        "target": target,
+        "dir": directory,
+        "work_dir": work_dir,
+        # A compressed post-data archive is decompressed into the work directory
+        "staging_bytes": get_staging_bytes(directory, os.path.join("schema", "post.dump")),
+        "after_job": after_job,
+        "not_before": start_at.timestamp() if start_at else None
+    })
+    return job_id
+
+
+@router.post("/restore/post-data", response_model=JobStatus, summary="Restore indexes and constraints")
+def restore_post_data(request: PostDataRequest, background_tasks: BackgroundTasks):
+    """
+    Restore the post-data section of a dump (indexes, constraints, foreign
+    keys, triggers) as its own job, largest tables first and with its own
+    concurrency and memory budget.
+    
+    Args:
+        request: Post-data job parameters and schedule
+        background_tasks: FastAPI background tasks manager
+    
+    Returns:
+        Job status information
+    """
+    try:
+        job_id = _submit_post_data_job(
+            request.target, request.dir, request, background_tasks, after_job=request.after_job
+        )
+        return {
+            "job_id": job_id,
+            **get_job_status(job_id)
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.post("/copy", response_model=JobStatus, summary="Copy tables between databases")
-async def copy_tables(request: CopyRequest, background_tasks: BackgroundTasks):
+def copy_tables(request: CopyRequest, background_tasks: BackgroundTasks):
     """
     Copy specific tables between PostgreSQL databases.
     
@@ -194,27 +354,89 @@ async def copy_tables(request: CopyRequest, background_tasks: BackgroundTasks):
     try:
         job_id = str(uuid.uuid4())
         
+        work_dir = get_job_workdir(job_id)
+        tables = request.tables
+        incremental = None
+        
+        if request.incremental:
+            # Narrow the copy down to the tables whose fingerprint changed
+            incremental = plan_incremental_copy(
+                request.source, request.target, request.tables, request.exclude_tables
+            )
+            tables = incremental["changed_tables"]
+        
+        if incremental and not tables:
+            # Nothing to copy: no process, history or progress for this job
+            job_status = finish_job_without_command(
+                job_id,
+                "No table changed since the last incremental copy",
+                {"incremental": summarize_incremental_copy(incremental)}
+            )
+            return {
+                "job_id": job_id,
+                **job_status
+            }
+        
         cmd = build_copy_command(
             source=request.source,
             target=request.target,
-            tables=request.tables,
-            exclude_tables=request.exclude_tables
+            tables=tables,
+            exclude_tables=request.exclude_tables,
+            work_dir=work_dir
         )
         
-        # Initialize job status
-        job_status = init_job(job_id, cmd)
-        
-        # Execute in background
-        background_tasks.add_task(run_command_background, job_id, cmd)
+        # Queue the job for execution
+        job_status = submit_job(job_id, cmd, background_tasks, metadata={
+            "job_type": "copy",
+            "source": request.source,
+            "target": request.target,
+            "work_dir": work_dir,
+            "tables": tables,
+            "exclude_tables": request.exclude_tables,
+            "throttle": request.throttle.model_dump() if request.throttle else None,
+            "incremental": incremental,
+            # The job plans the splits once it has measured the source
+            "split_tables": request.split_tables
+        })
         
         return {
             "job_id": job_id,
-            **job_status
+            **job_status,
+            "incremental": summarize_incremental_copy(incremental)
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/plan", response_model=PlanResponse, summary="Plan a migration without running it")
+def plan(request: PlanRequest):
+    """
+    Plan a clone, copy or restore: generated command, table and index inventory,
+    recommended parallelism, peak work directory space and estimated duration.
+    pgcopydb is not started.
+    
+    Args:
+        request: Operation parameters, as for clone, copy or restore
+    
+    Returns:
+        Migration plan
+    """
+    try:
+        return plan_migration(
+            operation=request.operation,
+            source=request.source,
+            target=request.target,
+            directory=request.dir,
+            options=request.options,
+            tables=request.tables,
+            exclude_tables=request.exclude_tables,
+            schema_only=request.schema_only,
+            data_only=request.data_only
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.post("/list-tables", response_model=TableListResponse, summary="List database tables")
 async def list_db_tables(request: ConnectionString):
     """
@@ -261,7 +483,7 @@ async def filter_db_tables(request: FilterTablesRequest):
 
 
 @router.get("/check-status/{job_id}", response_model=JobStatus, summary="Check job status")
-async def check_status(job_id: str):
+def check_status(job_id: str):
     """
     Check the status of a job by ID.
     
@@ -284,8 +506,33 @@ async def check_status(job_id: str):
     }
 
 
+@router.get("/logs/search", response_model=LogSearchResponse, summary="Search job logs")
+def search_job_logs(
+    table: Optional[str] = Query(default=None, description="Table name, qualified or bare"),
+    error_code: Optional[str] = Query(default=None, description="SQLSTATE error code, e.g. 23505"),
+    level: Optional[str] = Query(default=None, description="Log level: WARNING, ERROR, FATAL or PANIC"),
+    job_id: Optional[str] = Query(default=None, description="Only search the logs of this job"),
+    phase: Optional[str] = Query(default=None, description="Only return records of this phase, e.g. copy or index"),
+    text: Optional[str] = Query(default=None, description="Only return records whose message contains this text"),
+    limit: int = Query(default=100, ge=1, le=1000, description="Maximum number of records to return")
+):
+    """
+    Search the structured logs of all jobs by table, error code or level,
+    using the log index instead of reading every log file.
+    
+    Returns:
+        Matching log records, newest first
+    """
+    try:
+        return search_logs(table, error_code, level, job_id, phase, text, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.get("/logs/{job_id}", summary="Get job logs")
-async def get_job_logs(job_id: str):
+def get_job_logs(job_id: str):
     """
     Get logs for a specific job.
     
@@ -295,13 +542,13 @@ async def get_job_logs(job_id: str):
     Returns:
         Job logs
     """
-    if job_id not in jobs:
+    job_info = get_job_status(job_id)
+    if not job_info:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Job with ID {job_id} not found"
         )
     
-    job_info = jobs[job_id]
     logs = get_job_log(job_id)
     
     return {
@@ -313,8 +560,37 @@ async def get_job_logs(job_id: str):
     }
 
 
+@router.get("/timeline/{job_id}", summary="Get the trace timeline of a job")
+def get_job_timeline(
+    job_id: str,
+    format: str = Query(default="timeline", description="'timeline', or 'otlp' for OpenTelemetry JSON")
+):
+    """
+    Get the trace spans of a job per phase and per table, to see where a
+    job spends its time.
+    
+    Args:
+        job_id: ID of the job
+        format: Response format
+    
+    Returns:
+        Timeline with phases, slowest tables and bottleneck, or the trace in OTLP/HTTP JSON encoding
+    """
+    if format not in ("timeline", "otlp"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Format must be 'timeline' or 'otlp'")
+    
+    trace = get_trace(job_id)
+    if not trace:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"No trace found for job {job_id}"
+        )
+    
+    return to_otlp(trace) if format == "otlp" else build_timeline(trace)
+
+
 @router.get("/execution-logs", summary="Get all execution logs")
-async def get_execution_logs():
+def get_execution_logs():
     """
     Get logs for all executions.
     
@@ -335,3 +611,83 @@ async def get_execution_logs():
     return {
         "logs": logs
     }
+
+
+@router.get("/history", response_model=HistoryResponse, summary="Query job history")
+def get_history(
+    start_date: Optional[date] = Query(default=None, description="First day to include (YYYY-MM-DD)"),
+    end_date: Optional[date] = Query(default=None, description="Last day to include (YYYY-MM-DD)"),
+    job_type: Optional[str] = Query(default=None, description="Only include jobs of this type"),
+    target_host: Optional[str] = Query(default=None, description="Only include jobs against this target host"),
+    group_by: str = Query(default="target_host", description="Group by 'target_host', 'source_host' or 'job_type'"),
+    percentiles: List[float] = Query(default=[50, 90, 99], description="Percentiles to compute"),
+    limit: int = Query(default=10, ge=1, le=1000, description="Number of slowest tables to return")
+):
+    """
+    Aggregate finished jobs: throughput and duration percentiles per group
+    and the slowest tables.
+    
+    Returns:
+        Job history aggregations
+    """
+    if group_by not in ("target_host", "source_host", "job_type"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="group_by must be one of target_host, source_host, job_type"
+        )
+    if any(not 0 <= pct <= 100 for pct in percentiles):
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="percentiles must be between 0 and 100"
+        )
+    
+    return query_history(
+        start_date=start_date,
+        end_date=end_date,
+        job_type=job_type,
+        target_host=target_host,
+        group_by=group_by,
+        percentiles=percentiles,
+        limit=limit
+    )
+
+
+@router.get("/storage", response_model=StorageResponse, summary="Get storage usage")
+def get_storage():
+    """
+    Get the free space of the storage volume and the space reserved and used
+    by every job's work directory or dump.
+    
+    Returns:
+        Storage usage information
+    """
+    try:
+        return get_storage_usage()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.delete("/storage/{job_id}", summary="Remove the files of a finished job")
+def delete_storage(job_id: str):
+    """
+    Remove the work directory or dump of a finished job now instead of
+    waiting for its retention to expire.
+    
+    Args:
+        job_id: ID of the job
+    
+    Returns:
+        Confirmation of the removal
+    """
+    try:
+        found = delete_job_storage(job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    
+    if not found:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"No storage tracked for job {job_id}"
+        )
+    
+    return {"job_id": job_id, "deleted": True}
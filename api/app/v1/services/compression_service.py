@@ -0,0 +1,254 @@
+import os
+import json
+import gzip
+import shutil
+import logging
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+# Configure logging
+logger = logging.getLogger("pgcopydb-api-compression")
+
+COMPRESSION_EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+DEFAULT_COMPRESSION_LEVELS = {"gzip": 6, "zstd": 3}
+
+# Dump artifacts worth compressing; pgcopydb's own catalogs and state files are left alone
+COMPRESSIBLE_SUFFIXES = (".dump", ".sql")
+
+# Custom-format archives, which pg_restore needs to seek in
+ARCHIVE_EXTENSION = ".dump"
+
+# Written next to the compressed files so restore knows how to read them back
+MANIFEST_FILE = ".compression.json"
+
+CHUNK_SIZE = 1024 * 1024
+
+COMPRESSION_WORKERS = int(os.environ.get("COMPRESSION_WORKERS", str(os.cpu_count() or 1)))
+
+
+def _compress_file(path: str, algorithm: str, level: int) -> Dict:
+    """
+    Compress one file, replacing it with its compressed version.
+
+    Args:
+        path: File to compress
+        algorithm: "gzip" or "zstd"
+        level: Compression level
+
+    Returns:
+        Dictionary with original and compressed sizes
+    """
+    target = path + COMPRESSION_EXTENSIONS[algorithm]
+    tmp_target = f"{target}.tmp"
+    original_bytes = os.path.getsize(path)
+
+    if algorithm == "zstd":
+        result = subprocess.run(
+            ["zstd", "-q", "-f", f"-{level}", path, "-o", tmp_target],
+            capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            raise Exception(f"zstd failed on {path}: {result.stderr}")
+    else:
+        # zlib releases the GIL, so threads compress files in parallel
+        with open(path, 'rb') as src, gzip.open(tmp_target, 'wb', compresslevel=level) as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+    os.replace(tmp_target, target)
+    os.remove(path)
+    return {"path": path, "original_bytes": original_bytes, "compressed_bytes": os.path.getsize(target)}
+
+
+def compress_directory(directory: str, algorithm: str, level: Optional[int] = None) -> Dict:
+    """
+    Compress the dump artifacts of a directory in parallel.
+
+    Args:
+        directory: Dump directory
+        algorithm: "gzip" or "zstd"
+        level: Compression level, defaults to the algorithm's default
+
+    Returns:
+        Dictionary with compression statistics
+    """
+    level = level or DEFAULT_COMPRESSION_LEVELS[algorithm]
+    paths = [
+        os.path.join(root, name)
+        for root, _, names in os.walk(directory)
+        for name in names
+        if name.endswith(COMPRESSIBLE_SUFFIXES)
+    ]
+
+    with ThreadPoolExecutor(max_workers=COMPRESSION_WORKERS) as executor:
+        files = list(executor.map(lambda p: _compress_file(p, algorithm, level), paths))
+
+    manifest = {
+        "algorithm": algorithm,
+        "level": level,
+        "files": [
+            {**f, "path": os.path.relpath(f["path"], directory)} for f in files
+        ],
+    }
+    with open(os.path.join(directory, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    original_bytes = sum(f["original_bytes"] for f in files)
+    compressed_bytes = sum(f["compressed_bytes"] for f in files)
+    return {
+        "algorithm": algorithm,
+        "level": level,
+        "files": len(files),
+        "original_bytes": original_bytes,
+        "compressed_bytes": compressed_bytes,
+        "ratio": round(original_bytes / compressed_bytes, 2) if compressed_bytes else None,
+    }
+
+
+def get_compression_manifest(directory: str) -> Optional[Dict]:
+    """
+    Get the compression manifest of a dump directory.
+
+    Args:
+        directory: Dump directory
+
+    Returns:
+        Manifest or None if the dump is not compressed
+    """
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def decompress_file(source: str, target: str) -> None:
+    """
+    Decompress one file of a compressed dump.
+
+    Args:
+        source: Compressed file, with its algorithm's extension
+        target: Path of the decompressed file
+    """
+    if source.endswith(COMPRESSION_EXTENSIONS["zstd"]):
+        result = subprocess.run(["zstd", "-q", "-d", "-f", source, "-o", target], capture_output=True, text=True)
+        if result.returncode != 0:
+            raise Exception(f"zstd failed on {source}: {result.stderr}")
+    else:
+        with gzip.open(source, 'rb') as src, open(target, 'wb') as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+
+
+def get_staging_bytes(directory: str, path: Optional[str] = None) -> int:
+    """
+    Get the space the archives of a compressed dump take once decompressed
+    for a restore.
+
+    Args:
+        directory: Dump directory
+        path: Only count this archive, relative to the dump directory
+
+    Returns:
+        Decompressed size in bytes, 0 if the dump is not compressed
+    """
+    manifest = get_compression_manifest(directory) or {"files": []}
+    return sum(
+        f["original_bytes"] for f in manifest["files"]
+        if f["path"].endswith(ARCHIVE_EXTENSION) and (path is None or f["path"] == path)
+    )
+
+
+class StreamingDecompressor:
+    """
+    Present a compressed dump directory to pgcopydb restore without writing
+    a decompressed copy.
+
+    The staging directory mirrors the dump: plain files are symlinked, and
+    each compressed file is replaced by a named pipe under its original name.
+    A feeder thread per pipe decompresses into it every time a reader opens
+    it, so the same file can be read more than once. Once a copy has been
+    written the pipe is swapped for a fresh one, so a reader still draining
+    it sees end of file instead of a second copy.
+
+    Custom-format archives (*.dump) are decompressed into the staging
+    directory instead: pgcopydb hands them to pg_restore by path, and
+    pg_restore seeks in them to restore the entries of a --use-list out of
+    order, which it cannot do on a pipe. They are the schema sections of the
+    dump, so the staging directory needs get_staging_bytes of space.
+    """
+
+    def __init__(self, directory: str, staging_dir: str):
+        self.directory = directory
+        self.staging_dir = staging_dir
+        self.manifest = get_compression_manifest(directory)
+        self.stopped = threading.Event()
+        self.fifos: List[str] = []
+        self.threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        extension = COMPRESSION_EXTENSIONS[self.manifest["algorithm"]]
+
+        for root, _, names in os.walk(self.directory):
+            staging_root = os.path.join(self.staging_dir, os.path.relpath(root, self.directory))
+            os.makedirs(staging_root, exist_ok=True)
+            for name in names:
+                source = os.path.join(root, name)
+                if name == MANIFEST_FILE:
+                    continue
+                if name.endswith(ARCHIVE_EXTENSION + extension):
+                    decompress_file(source, os.path.join(staging_root, name[:-len(extension)]))
+                elif name.endswith(extension):
+                    fifo = os.path.join(staging_root, name[:-len(extension)])
+                    os.mkfifo(fifo)
+                    self.fifos.append(fifo)
+                    thread = threading.Thread(target=self._feed, args=(source, fifo), daemon=True)
+                    thread.start()
+                    self.threads.append(thread)
+                else:
+                    os.symlink(source, os.path.join(staging_root, name))
+
+    def _feed(self, source: str, fifo: str) -> None:
+        while not self.stopped.is_set():
+            try:
+                # Blocks until a reader opens the pipe
+                with open(fifo, 'wb') as dst:
+                    if self.stopped.is_set():
+                        return
+                    if self.manifest["algorithm"] == "zstd":
+                        subprocess.run(["zstd", "-q", "-d", "-c", source], stdout=dst, stderr=subprocess.DEVNULL)
+                    else:
+                        with gzip.open(source, 'rb') as src:
+                            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+            except BrokenPipeError:
+                # The reader stopped early, e.g. after reading a header
+                pass
+            except Exception:
+                logger.exception(f"Error streaming {source}")
+                return
+            try:
+                self._renew(fifo)
+            except OSError:
+                logger.exception(f"Error replacing pipe {fifo}")
+                return
+
+    @staticmethod
+    def _renew(fifo: str) -> None:
+        # The reader of the last copy keeps the old pipe open until it has
+        # read to the end; the next reader opens the new one
+        next_fifo = os.path.join(os.path.dirname(fifo), f".{os.path.basename(fifo)}.next")
+        os.mkfifo(next_fifo)
+        os.replace(next_fifo, fifo)
+
+    def stop(self) -> None:
+        self.stopped.set()
+        for fifo in self.fifos:
+            # Release feeders still waiting for a reader
+            try:
+                fd = os.open(fifo, os.O_RDONLY | os.O_NONBLOCK)
+                os.close(fd)
+            except OSError:
+                pass
+        for thread in self.threads:
+            thread.join(timeout=5)
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
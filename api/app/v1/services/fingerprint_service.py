@@ -0,0 +1,157 @@
+import os
+import json
+import fcntl
+import hashlib
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from app.v1.services.pgcopydb_service import run_query, table_selected
+from app.v1.services.storage_service import get_storage_directory
+
+# Configure logging
+logger = logging.getLogger("pgcopydb-api-fingerprint")
+
+# Cheap per-table change markers. The tuple counters only grow while the
+# statistics are kept, relfilenode changes on TRUNCATE, VACUUM FULL and
+# CLUSTER, and stats_reset changes when the counters start over.
+FINGERPRINT_QUERY = """
+    SELECT s.schemaname || '.' || s.relname,
+           s.n_tup_ins, s.n_tup_upd, s.n_tup_del,
+           pg_relation_size(s.relid),
+           c.relfilenode,
+           coalesce((SELECT stats_reset FROM pg_stat_database
+                      WHERE datname = current_database())::text, '')
+      FROM pg_stat_user_tables s
+      JOIN pg_class c ON c.oid = s.relid
+"""
+
+
+def get_fingerprint_directory() -> str:
+    """
+    Get the directory holding the table fingerprints of incremental copies.
+
+    Returns:
+        Path to fingerprint directory
+    """
+    fingerprint_dir = os.path.join(get_storage_directory(), "fingerprints")
+    os.makedirs(fingerprint_dir, exist_ok=True)
+    return fingerprint_dir
+
+
+def _database_key(connection_string: str) -> str:
+    """
+    Identify a database by host, port and name, leaving out the credentials.
+    """
+    url = urlparse(connection_string)
+    return f"{url.hostname}:{url.port or 5432}{url.path or '/'}"
+
+
+def _fingerprint_file(source: str, target: str) -> str:
+    pair = f"{_database_key(source)} -> {_database_key(target)}"
+    return os.path.join(get_fingerprint_directory(), f"{hashlib.sha1(pair.encode()).hexdigest()[:16]}.json")
+
+
+def _read_fingerprints(path: str) -> Dict:
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"tables": {}}
+
+
+def get_table_fingerprints(source: str, tables: Optional[List[str]] = None,
+                           exclude_tables: Optional[List[str]] = None) -> Dict[str, List]:
+    """
+    Get the current fingerprint of every user table of the source database.
+
+    Args:
+        source: Source database connection string
+        tables: List of tables to include
+        exclude_tables: List of tables to exclude
+
+    Returns:
+        Dictionary of fingerprints by qualified table name
+    """
+    return {
+        row[0]: row[1:]
+        for row in run_query(source, FINGERPRINT_QUERY)
+        if table_selected(row[0], tables, exclude_tables)
+    }
+
+
+def plan_incremental_copy(source: str, target: str, tables: Optional[List[str]] = None,
+                          exclude_tables: Optional[List[str]] = None) -> Dict:
+    """
+    Compare the source tables with the fingerprints of the last successful
+    copy between the same databases.
+
+    Args:
+        source: Source database connection string
+        target: Target database connection string
+        tables: List of tables to include
+        exclude_tables: List of tables to exclude
+
+    Returns:
+        Dictionary with the changed and skipped tables, and the fingerprints
+        to save once the copy succeeds
+    """
+    current = get_table_fingerprints(source, tables, exclude_tables)
+    previous = _read_fingerprints(_fingerprint_file(source, target))
+
+    changed = sorted(name for name, fingerprint in current.items()
+                     if previous["tables"].get(name) != fingerprint)
+    skipped = sorted(name for name in current if name not in changed)
+
+    return {
+        "baseline": previous.get("updated_at"),
+        "changed_tables": changed,
+        "skipped_tables": skipped,
+        "fingerprints": current,
+    }
+
+
+def summarize_incremental_copy(incremental: Optional[Dict]) -> Optional[Dict]:
+    """
+    Get the part of an incremental copy plan worth reporting.
+
+    Args:
+        incremental: Plan returned by plan_incremental_copy
+
+    Returns:
+        Plan without the fingerprints, or None for a full copy
+    """
+    if not incremental:
+        return None
+    return {key: value for key, value in incremental.items() if key != "fingerprints"}
+
+
+def save_fingerprints(source: str, target: str, fingerprints: Dict[str, List]) -> None:
+    """
+    Record the fingerprints of the tables of a successful copy, keeping the
+    ones of tables that were not part of it.
+
+    Args:
+        source: Source database connection string
+        target: Target database connection string
+        fingerprints: Fingerprints taken before the copy started
+    """
+    path = _fingerprint_file(source, target)
+    try:
+        with open(f"{path}.lock", 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            stored = _read_fingerprints(path)
+            stored["tables"].update(fingerprints)
+            stored.update({
+                "source": _database_key(source),
+                "target": _database_key(target),
+                "updated_at": datetime.now().isoformat(),
+            })
+
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(stored, f, indent=2)
+            os.replace(tmp_path, path)
+    except Exception as e:
+        logger.exception(f"Error saving table fingerprints: {str(e)}")
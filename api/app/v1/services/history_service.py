@@ -0,0 +1,237 @@
+import os
+import json
+import fcntl
+import logging
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+
+from app.v1.services.pgcopydb_service import get_host
+
+# Configure logging
+logger = logging.getLogger("pgcopydb-api-history")
+
+# Columns of a history partition, one value per finished job
+HISTORY_COLUMNS = (
+    "job_id", "finished_at", "job_type", "status", "exit_code",
+    "source_host", "target_host", "table_count", "bytes",
+    "duration_seconds", "copy_seconds", "index_seconds",
+    "options", "slowest_tables",
+)
+
+# Days of history queried when no date range is given
+DEFAULT_HISTORY_DAYS = 7
+
+
+def get_history_directory() -> str:
+    """
+    Get the directory for the job history partitions.
+
+    Returns:
+        Path to history directory
+    """
+    history_dir = "/app/pgcopydb_files/history" if os.path.exists("/app/pgcopydb_files") else "/tmp/history"
+    os.makedirs(history_dir, exist_ok=True)
+    return history_dir
+
+
+def _partition_file(day: date) -> str:
+    return f"{get_history_directory()}/history-{day.isoformat()}.jsonl"
+
+
+def _read_partition(day: date) -> Dict[str, List]:
+    """
+    Read the history partition of a day.
+
+    A partition starts with a line naming its columns, followed by one line
+    of values per job in that order.
+
+    Args:
+        day: Day of the partition
+
+    Returns:
+        Dictionary of columns, each a list with one value per job
+    """
+    columns: Dict[str, List] = {name: [] for name in HISTORY_COLUMNS}
+
+    try:
+        with open(_partition_file(day), 'r') as f:
+            header = None
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    values = json.loads(line)
+                except json.JSONDecodeError:
+                    # A line cut short by a crash while appending
+                    continue
+                if header is None:
+                    header = values
+                    continue
+                if values == header:
+                    # Written by a replica that raced for the first line of the day
+                    continue
+                row = dict(zip(header, values))
+                for name in HISTORY_COLUMNS:
+                    columns[name].append(row.get(name))
+    except FileNotFoundError:
+        pass
+    return columns
+
+
+def record_job_history(job_id: str, metadata: Dict, status: str, exit_code: Optional[int],
+                       duration_seconds: float, progress: Optional[Dict]) -> None:
+    """
+    Append a compact record of a finished job to today's history partition.
+
+    Args:
+        job_id: ID of the job
+        metadata: Job information
+        status: Final status of the job
+        exit_code: Exit code of the command
+        duration_seconds: Wall-clock duration of the job
+        progress: Final progress information of the job
+    """
+    progress = progress or {}
+    copy_phase = progress.get("copy", {})
+    index_phase = progress.get("index", {})
+    record = {
+        "job_id": job_id,
+        "finished_at": datetime.now().isoformat(),
+        "job_type": metadata.get("job_type"),
+        "status": status,
+        "exit_code": exit_code,
+        "source_host": get_host(metadata["source"]) if metadata.get("source") else None,
+        "target_host": get_host(metadata["target"]) if metadata.get("target") else None,
+        "table_count": copy_phase.get("total"),
+        "bytes": copy_phase.get("total_bytes"),
+        "duration_seconds": round(duration_seconds, 1),
+        "copy_seconds": copy_phase.get("duration_seconds"),
+        "index_seconds": index_phase.get("duration_seconds"),
+        "options": metadata.get("options") or [],
+        "slowest_tables": progress.get("slowest_tables", []),
+    }
+
+    path = _partition_file(date.today())
+    try:
+        # Replicas and the runner process may append to the same partition
+        with open(path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            # The position was taken at open, before another writer may have added the header
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                f.write(json.dumps(list(HISTORY_COLUMNS)) + "\n")
+            f.write(json.dumps([record[name] for name in HISTORY_COLUMNS], separators=(",", ":")) + "\n")
+    except Exception as e:
+        logger.exception(f"Error writing job history for job {job_id}: {str(e)}")
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """
+    Compute a percentile with linear interpolation between closest ranks.
+
+    Args:
+        values: Values to summarize
+        pct: Percentile between 0 and 100
+
+    Returns:
+        Percentile value or None if there are no values
+    """
+    if not 0 <= pct <= 100:
+        raise ValueError(f"Percentile {pct:g} is not between 0 and 100")
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * pct / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def query_history(start_date: Optional[date] = None, end_date: Optional[date] = None,
+                  job_type: Optional[str] = None, target_host: Optional[str] = None,
+                  group_by: str = "target_host", percentiles: Optional[List[float]] = None,
+                  limit: int = 10) -> Dict:
+    """
+    Aggregate the job history over a date range.
+
+    Args:
+        start_date: First day to include, defaults to a week before end_date
+        end_date: Last day to include, defaults to today
+        job_type: Only include jobs of this type
+        target_host: Only include jobs against this target host
+        group_by: Column to group the aggregations by
+        percentiles: Percentiles to compute, defaults to 50, 90 and 99
+        limit: Number of slowest tables to return
+
+    Returns:
+        Dictionary with per-group aggregations and the slowest tables
+    """
+    end_date = end_date or date.today()
+    start_date = start_date or end_date - timedelta(days=DEFAULT_HISTORY_DAYS - 1)
+    percentiles = percentiles or [50, 90, 99]
+
+    groups: Dict[str, Dict[str, List]] = {}
+    slowest_tables = []
+    partitions = []
+    jobs = 0
+
+    day = start_date
+    while day <= end_date:
+        path = _partition_file(day)
+        if not os.path.exists(path):
+            day += timedelta(days=1)
+            continue
+        partitions.append(os.path.basename(path))
+
+        columns = _read_partition(day)
+        day += timedelta(days=1)
+        for row in range(len(columns["job_id"])):
+            if job_type and columns["job_type"][row] != job_type:
+                continue
+            if target_host and columns["target_host"][row] != target_host:
+                continue
+            jobs += 1
+
+            group = groups.setdefault(str(columns[group_by][row]), {
+                "statuses": [], "durations": [], "throughputs": []
+            })
+            group["statuses"].append(columns["status"][row])
+            group["durations"].append(columns["duration_seconds"][row])
+
+            # Throughput over the COPY phase when known, otherwise over the whole job
+            data_bytes = columns["bytes"][row]
+            seconds = columns["copy_seconds"][row] or columns["duration_seconds"][row]
+            if columns["status"][row] == "completed" and data_bytes and seconds:
+                group["throughputs"].append(data_bytes / seconds)
+
+            for table in columns["slowest_tables"][row] or []:
+                slowest_tables.append({
+                    "job_id": columns["job_id"][row],
+                    "target_host": columns["target_host"][row],
+                    **table
+                })
+
+    slowest_tables.sort(key=lambda t: t["seconds"], reverse=True)
+
+    return {
+        "start_date": start_date.isoformat(),
+        "end_date": end_date.isoformat(),
+        "partitions": partitions,
+        "jobs": jobs,
+        "group_by": group_by,
+        "groups": [
+            {
+                "key": key,
+                "jobs": len(group["statuses"]),
+                "failed": sum(1 for s in group["statuses"] if s != "completed"),
+                "throughput_bytes_per_second": {
+                    f"p{pct:g}": percentile(group["throughputs"], pct) for pct in percentiles
+                },
+                "duration_seconds": {
+                    f"p{pct:g}": percentile(group["durations"], pct) for pct in percentiles
+                },
+            }
+            for key, group in sorted(groups.items())
+        ],
+        "slowest_tables": slowest_tables[:limit],
+    }
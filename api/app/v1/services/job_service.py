@@ -1,26 +1,292 @@
 import os
+import time
+import signal
 import logging
+import threading
 import subprocess
 from datetime import datetime
-from typing import Dict
+from typing import Callable, Dict, Optional, Tuple
 
-from app.utils.command import get_log_directory, write_to_log, log_job_execution
+from fastapi import BackgroundTasks
+
+from app.utils.command import get_log_directory, write_to_log, update_job_status, log_job_execution
+from app.v1.services.queue_service import (
+    QUEUE_BACKEND, enqueue_job, get_queued_job, start_queue_worker, is_lease_lost
+)
+from app.v1.services.runner_service import use_runner, ensure_runner, runner_request
+from app.v1.services.pgcopydb_service import get_relation_sizes
+from app.v1.services.progress_service import (
+    start_progress, record_output, get_progress, finish_progress
+)
+from app.v1.services.planner_service import (
+    record_job_throughput, estimate_workdir_bytes, prepare_table_splits
+)
+from app.v1.services.history_service import record_job_history
+from app.v1.services.throttle_service import (
+    JOB_APPLICATION_NAME, start_throttle, get_throttle, stop_throttle
+)
+from app.v1.services.storage_service import (
+    wait_for_storage, release_storage, start_storage_cleanup
+)
+from app.v1.services.compression_service import compress_directory, StreamingDecompressor
+from app.v1.services.fingerprint_service import save_fingerprints, summarize_incremental_copy
+from app.v1.services.log_service import StructuredJobLog
+from app.v1.services.trace_service import start_trace, record_trace, trace_phase, finish_trace
+from app.v1.services.postdata_service import get_index_progress
+from app.v1.services.server_clone_service import get_database_progress
+from app.v1.services.job_store_service import JobStore, OutputTail, load_job_summary
 
 # Configure logging
 logger = logging.getLogger("pgcopydb-api-service")
 
-# Dictionary to store job information
-jobs: Dict[str, Dict] = {}
+# Job records; finished jobs are evicted and then read back from disk
+jobs = JobStore()
+
+# Running processes by job ID, so that jobs can be stopped
+processes: Dict[str, subprocess.Popen] = {}
+
+# Job types whose data volume can be measured on the source before they run
+PROGRESS_JOB_TYPES = ("clone", "copy")
+
+# Job types whose storage needs depend on the objects of the source
+MEASURED_JOB_TYPES = ("clone", "copy", "dump")
+
+# How often a scheduled job checks whether it may start
+SCHEDULE_POLL_SECONDS = int(os.environ.get("JOB_SCHEDULE_POLL_SECONDS", "30"))
+
+# Scheduled jobs held outside the worker pool until they are due: metadata and how to start them
+_scheduled_jobs: Dict[str, Tuple[Dict, Callable[[], None]]] = {}
+_scheduled_lock = threading.Lock()
+_scheduler: Optional[threading.Thread] = None
+
+
+def is_scheduled(metadata: Optional[Dict]) -> bool:
+    return bool(metadata and (metadata.get("not_before") or metadata.get("after_job")))
+
+
+def _is_due(metadata: Dict) -> bool:
+    """
+    Check whether a scheduled job may start.
+    
+    Args:
+        metadata: Job information with the optional "not_before" timestamp and "after_job" ID
+        
+    Returns:
+        True once the start time has come and the job it follows has finished
+    """
+    not_before = metadata.get("not_before")
+    if not_before and time.time() < not_before:
+        return False
+    after_job = metadata.get("after_job")
+    if after_job:
+        previous = get_job_status(after_job)
+        # A job following one that is not found or failed is started, and fails right away
+        if previous and not previous.get("finished"):
+            return False
+    return True
+
+
+def schedule_job(job_id: str, cmd: str, metadata: Dict, start: Callable[[], None]) -> Dict:
+    """
+    Hold a scheduled job until it is due, then start it. Waiting jobs do not
+    take a slot of the pool that runs jobs, which may be the very slot the
+    job they follow needs.
+    
+    Args:
+        job_id: Unique identifier for the job
+        cmd: Command to be executed
+        metadata: Job information with the optional "not_before" timestamp and "after_job" ID
+        start: Function submitting the job for execution
+        
+    Returns:
+        Dictionary with initial job status
+    """
+    global _scheduler
+    
+    job_status = init_job(job_id, cmd, status="scheduled")
+    with _scheduled_lock:
+        _scheduled_jobs[job_id] = (metadata, start)
+        if _scheduler is None:
+            _scheduler = threading.Thread(target=_scheduler_loop, name="job-scheduler", daemon=True)
+            _scheduler.start()
+    return job_status
+
+
+def _scheduler_loop() -> None:
+    """
+    Start the scheduled jobs that are due, checking every SCHEDULE_POLL_SECONDS
+    or at the next start time, whichever comes first.
+    """
+    while True:
+        with _scheduled_lock:
+            scheduled = list(_scheduled_jobs.items())
+        
+        for job_id, (metadata, start) in scheduled:
+            try:
+                if not _is_due(metadata):
+                    continue
+            except Exception:
+                logger.exception(f"Error checking the schedule of job {job_id}")
+                continue
+            with _scheduled_lock:
+                _scheduled_jobs.pop(job_id, None)
+            logger.info(f"Starting scheduled job {job_id}")
+            start()
+        
+        with _scheduled_lock:
+            start_times = [m["not_before"] for m, _ in _scheduled_jobs.values() if m.get("not_before")]
+        wait = min([SCHEDULE_POLL_SECONDS] + [t - time.time() for t in start_times])
+        time.sleep(max(wait, 1))
+
+
+def _wait_for_schedule(job_id: str, metadata: Dict) -> None:
+    """
+    Hold a job until its start time has come and the job it follows has
+    completed. Scheduled jobs are only handed to a worker once they are due
+    (see schedule_job and the shared queue), so this normally returns at
+    once; it still fails a job whose predecessor did not complete.
+    
+    Args:
+        job_id: ID of the job
+        metadata: Job information with the optional "not_before" timestamp and "after_job" ID
+    """
+    not_before = metadata.get("not_before")
+    after_job = metadata.get("after_job")
+    if not not_before and not after_job:
+        return
+    
+    update_job_status(jobs, job_id, {"status": "scheduled"})
+    while True:
+        if not_before and time.time() < not_before:
+            time.sleep(min(SCHEDULE_POLL_SECONDS, not_before - time.time()))
+            continue
+        if after_job:
+            previous = get_job_status(after_job)
+            if not previous:
+                raise Exception(f"Job {after_job} this job follows was not found")
+            if not previous.get("finished"):
+                time.sleep(SCHEDULE_POLL_SECONDS)
+                continue
+            if previous["status"] != "completed":
+                raise Exception(f"Job {after_job} this job follows did not complete")
+        break
+    update_job_status(jobs, job_id, {"status": "running"})
+
+
+def _measure_source(job_id: str, metadata: Dict) -> Optional[Dict]:
+    """
+    Measure the relations a job will move.
+    
+    Args:
+        job_id: ID of the job
+        metadata: Job information with the source and table filters
+        
+    Returns:
+        Dictionary with table and index sizes, or None if they are not known
+    """
+    if metadata.get("job_type") not in MEASURED_JOB_TYPES or not metadata.get("source"):
+        return None
+    
+    try:
+        return get_relation_sizes(
+            metadata["source"],
+            tables=metadata.get("tables"),
+            exclude_tables=metadata.get("exclude_tables")
+        )
+    except Exception as e:
+        logger.warning(f"Could not get relation sizes for job {job_id}: {str(e)}")
+        return None
+
+
+def _plan_table_splits(metadata: Dict, sizes: Optional[Dict]) -> Optional[Dict]:
+    """
+    Plan the table splits of a clone or copy job from the sizes it measured.
+    
+    Args:
+        metadata: Job information with the source, options and "split_tables" flag
+        sizes: Table and index sizes of the source, if known
+        
+    Returns:
+        Split plan, or None if tables are copied whole
+    """
+    if not metadata.get("split_tables") or metadata.get("job_type") not in PROGRESS_JOB_TYPES or not sizes:
+        return None
+    return prepare_table_splits(metadata["source"], metadata.get("options"), sizes=sizes)
+
+
+def _reserve_job_storage(job_id: str, metadata: Dict, sizes: Optional[Dict]) -> None:
+    """
+    Reserve space for the directories a job writes to, waiting while the
+    volume does not have enough free space.
+    
+    Args:
+        job_id: ID of the job
+        metadata: Job information with the work or dump directory, and the
+            "staging_bytes" of archives decompressed into the work directory
+        sizes: Table and index sizes of the source, if known
+    """
+    job_type = metadata.get("job_type")
+    paths = [metadata.get("work_dir"), metadata.get("dir") if job_type == "dump" else None]
+    paths = [p for p in paths if p]
+    if not paths:
+        return
+    
+    object_count = len(sizes["tables"]) + len(sizes["indexes"]) if sizes else 0
+    wait_for_storage(
+        job_id,
+        estimate_workdir_bytes(object_count) + (metadata.get("staging_bytes") or 0),
+        paths,
+        job_type,
+        on_wait=lambda: update_job_status(jobs, job_id, {"status": "waiting_for_space"})
+    )
+    update_job_status(jobs, job_id, {"status": "running"})
+    
+    for path in paths:
+        os.makedirs(path, exist_ok=True)
+
 
-def run_command_background(job_id: str, cmd: str) -> None:
+def run_command_background(job_id: str, cmd: str, metadata: Optional[Dict] = None) -> Dict:
     """
     Execute a command in the background and update job status.
     
     Args:
         job_id: Unique identifier for the job
         cmd: Command to execute
+        metadata: Additional job information
+        
+    Returns:
+        Dictionary with final job status
     """
+    if job_id not in jobs:
+        init_job(job_id, cmd)
+    update_job_status(jobs, job_id, {"status": "running"})
+    metadata = metadata or {}
+    started_at = time.time()
+    decompressor = None
+    structured_log = None
+    result = None
+    start_trace(job_id, metadata.get("job_type"))
+    
     try:
+        _wait_for_schedule(job_id, metadata)
+        sizes = _measure_source(job_id, metadata)
+        
+        # Let several COPY workers share the largest tables
+        split_plan = _plan_table_splits(metadata, sizes)
+        if split_plan:
+            split_options = split_plan["options"]
+            if split_options:
+                cmd = f"{cmd} {' '.join(split_options)}"
+            metadata = {**metadata, "split_plan": split_plan, "options": (metadata.get("options") or []) + split_options}
+            update_job_status(jobs, job_id, {"command": cmd, "split_plan": split_plan})
+        
+        _reserve_job_storage(job_id, metadata, sizes)
+        trace_phase(job_id, "prepare", started_at)
+        
+        if metadata.get("job_type") in PROGRESS_JOB_TYPES and metadata.get("source"):
+            sizes = sizes or {"tables": [], "indexes": []}
+            start_progress(job_id, sizes["tables"], sizes["indexes"], split_plan)
+        
         log_dir = get_log_directory()
         
         # Specific log file for this job
@@ -30,53 +296,137 @@ def run_command_background(job_id: str, cmd: str) -> None:
         start_msg = f"[{datetime.now().isoformat()}] Starting command: {cmd}"
         logger.info(start_msg)
         
-        with open(log_file, 'w') as f:
-            f.write(f"{start_msg}\n")
+        shared_log_file = f"{log_dir}/pgcopydb-executions.log"
+        
+        # Line buffered so that the job log can be followed while the command runs
+        with open(log_file, 'w', buffering=1) as f, open(shared_log_file, 'a') as sf:
+            structured_log = StructuredJobLog(job_id)
+            
+            def log(message: str, level: str = "INFO") -> None:
+                f.write(f"{message}\n")
+                structured_log.write(message, level=level)
             
-            # Modify command to also write output to log files
-            shared_log_file = f"{log_dir}/pgcopydb-executions.log"
-            modified_cmd = f"{cmd} 2>&1 | tee -a {log_file} {shared_log_file}"
+            log(start_msg)
             
-            # Execute the command
+            # Restore compressed dumps by streaming them instead of decompressing to disk
+            if metadata.get("input_dir"):
+                decompressor = StreamingDecompressor(metadata["dir"], metadata["input_dir"])
+                decompressor.start()
+            
+            # Execute the command in its own process group so the whole pipeline can be signalled
             process = subprocess.Popen(
-                modified_cmd,
+                cmd,
                 shell=True,
                 stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
                 text=True,
-                bufsize=1
+                bufsize=1,
+                start_new_session=True,
+                # Sessions not named by pgcopydb itself are still told apart from the source's own load
+                env={**os.environ, "PGAPPNAME": f"{JOB_APPLICATION_NAME} {job_id}"}
             )
+            processes[job_id] = process
+            
+            # Adapt the job's concurrency to the source load when requested
+            if metadata.get("throttle") and metadata.get("source"):
+                start_throttle(job_id, process.pid, metadata["source"], metadata["throttle"], metadata.get("target"))
             
-            stdout, stderr = process.communicate()
+            # Fan the output out to the job log and the shared log
+            output_tail = OutputTail()
+            for line in process.stdout:
+                f.write(line)
+                sf.write(line)
+                structured_log.write(line)
+                record_trace(job_id, line)
+                output_tail.append(line)
+                record_output(job_id, line)
+            
+            process.wait()
+            processes.pop(job_id, None)
+            progress = finish_progress(job_id)
+            throttle = stop_throttle(job_id)
+            # Read before the work directory holding it is released
+            index_progress = get_index_progress(job_id)
+            databases = get_database_progress(job_id)
+            stdout = output_tail.text()
             
             # Log the result
             result_msg = f"[{datetime.now().isoformat()}] Command completed with code: {process.returncode}"
-            f.write(f"{result_msg}\n")
+            log(result_msg, "INFO" if process.returncode == 0 else "ERROR")
             
             if process.returncode != 0:
+                # stderr is merged into stdout, report the last lines as the error
+                stderr = output_tail.text(last_lines=20)
                 error_msg = f"[{datetime.now().isoformat()}] Error in command: {stderr}"
                 logger.error(error_msg)
-                f.write(f"{error_msg}\n")
-                jobs[job_id] = {
+                log(error_msg, "ERROR")
+                result = {
                     "status": "error",
                     "command": cmd,
                     "output": stdout,
                     "error": stderr,
                     "finished": True,
-                    "log_file": log_file
+                    "log_file": log_file,
+                    "progress": progress,
+                    "throttle": throttle,
+                    "incremental": summarize_incremental_copy(metadata.get("incremental")),
+                    "split_plan": metadata.get("split_plan"),
+                    "index_progress": index_progress,
+                    "databases": databases
                 }
             else:
                 success_msg = f"[{datetime.now().isoformat()}] Command completed successfully"
                 logger.info(success_msg)
-                f.write(f"{success_msg}\n")
-                jobs[job_id] = {
+                log(success_msg)
+                record_job_throughput(metadata.get("target"), progress)
+                
+                compression = None
+                if metadata.get("compression"):
+                    log(f"[{datetime.now().isoformat()}] Compressing dump with {metadata['compression']}")
+                    compress_started_at = time.time()
+                    compression = compress_directory(
+                        metadata["dir"], metadata["compression"], metadata.get("compression_level")
+                    )
+                    trace_phase(job_id, "compress", compress_started_at)
+                    log(f"[{datetime.now().isoformat()}] Compressed {compression['files']} files: "
+                        f"{compression['original_bytes']} -> {compression['compressed_bytes']} bytes")
+                
+                result = {
                     "status": "completed",
                     "command": cmd,
                     "output": stdout,
                     "finished": True,
-                    "log_file": log_file
+                    "log_file": log_file,
+                    "progress": progress,
+                    "throttle": throttle,
+                    "compression": compression,
+                    "incremental": summarize_incremental_copy(metadata.get("incremental")),
+                    "split_plan": metadata.get("split_plan"),
+                    "index_progress": index_progress,
+                    "databases": databases
                 }
                 
+                # The next incremental copy compares against the state this one started from
+                if metadata.get("incremental"):
+                    save_fingerprints(metadata["source"], metadata["target"], metadata["incremental"]["fingerprints"])
+            
+            # Another replica runs the job again once this one lost its lease: its
+            # status, reservation, work directory and history record belong to that run
+            lease_lost = is_lease_lost(metadata.get("lease_id"))
+            if lease_lost:
+                jobs.discard(job_id)
+            else:
+                jobs[job_id] = result
+            
+            # Remove the work directory, or keep it for a while if the job failed
+            if not lease_lost:
+                release_storage(
+                    job_id,
+                    process.returncode == 0,
+                    keep_paths=metadata.get("job_type") == "dump",
+                    retention_hours=metadata.get("retention_hours")
+                )
+            
             # Write to shared log file
             log_job_execution(
                 job_id, 
@@ -84,15 +434,113 @@ def run_command_background(job_id: str, cmd: str) -> None:
                 'Completed' if process.returncode == 0 else 'Error', 
                 log_file
             )
+            if not lease_lost:
+                record_job_history(
+                    job_id,
+                    metadata,
+                    result["status"],
+                    process.returncode,
+                    time.time() - started_at,
+                    progress
+                )
+            
+            return result
                 
     except Exception as e:
         logger.exception(f"Exception executing command {cmd}")
-        jobs[job_id] = {
+        progress = finish_progress(job_id)
+        stop_throttle(job_id)
+        lease_lost = is_lease_lost(metadata.get("lease_id"))
+        if not lease_lost:
+            release_storage(
+                job_id,
+                False,
+                keep_paths=metadata.get("job_type") == "dump",
+                retention_hours=metadata.get("retention_hours")
+            )
+        result = {
             "status": "error",
             "command": cmd,
             "error": str(e),
             "finished": True
         }
+        if lease_lost:
+            jobs.discard(job_id)
+        else:
+            jobs[job_id] = result
+            record_job_history(job_id, metadata, "error", None, time.time() - started_at, progress)
+        return result
+    finally:
+        if decompressor:
+            decompressor.stop()
+        if structured_log:
+            structured_log.close()
+        finish_trace(job_id, result["status"] if result else "error")
+
+
+def terminate_job(job_id: str) -> None:
+    """
+    Stop the process of a running job.
+    
+    Args:
+        job_id: ID of the job to stop
+    """
+    if use_runner():
+        runner_request("terminate", job_id=job_id)
+        return
+    
+    process = processes.get(job_id)
+    if process and process.poll() is None:
+        logger.warning(f"Terminating job {job_id}")
+        os.killpg(process.pid, signal.SIGTERM)
+
+
+def submit_job(job_id: str, cmd: str, background_tasks: BackgroundTasks,
+               metadata: Optional[Dict] = None) -> Dict:
+    """
+    Submit a job for execution using the configured queue backend.
+    
+    With the "shared" backend the job is placed on the shared queue and runs on
+    whichever replica claims it; otherwise it runs on this replica, in the
+    supervisor process when the "process" runner mode is enabled.
+    
+    Args:
+        job_id: Unique identifier for the job
+        cmd: Command to execute
+        background_tasks: FastAPI background tasks manager
+        metadata: Additional job information
+        
+    Returns:
+        Dictionary with initial job status
+    """
+    if QUEUE_BACKEND == "shared":
+        return enqueue_job(job_id, cmd, metadata)
+    
+    if use_runner():
+        return runner_request("submit", job_id=job_id, cmd=cmd, metadata=metadata)
+    
+    if is_scheduled(metadata):
+        # Due after the request has ended, so it gets a thread of its own
+        return schedule_job(job_id, cmd, metadata, lambda: threading.Thread(
+            target=run_command_background, args=(job_id, cmd, metadata), name=f"job-{job_id}", daemon=True
+        ).start())
+    
+    job_status = init_job(job_id, cmd)
+    background_tasks.add_task(run_command_background, job_id, cmd, metadata)
+    return job_status
+
+
+def start_job_worker() -> None:
+    """
+    Start the periodic storage cleanup, and start the supervisor process or,
+    when jobs run inline, claim jobs from the shared queue if that backend is enabled.
+    """
+    start_storage_cleanup()
+    
+    if use_runner():
+        ensure_runner()
+    elif QUEUE_BACKEND == "shared":
+        start_queue_worker(run_command_background, terminate_job)
 
 
 def get_job_status(job_id: str) -> Dict:
@@ -105,24 +553,41 @@ def get_job_status(job_id: str) -> Dict:
     Returns:
         Dictionary with job status information
     """
-    if job_id in jobs:
-        return jobs[job_id]
+    if use_runner():
+        return runner_request("status", job_id=job_id)
+    record = jobs.get(job_id)
+    if record:
+        live = {
+            "progress": get_progress(job_id),
+            "throttle": get_throttle(job_id),
+            "index_progress": None if record.finished else get_index_progress(job_id),
+            "databases": None if record.finished else get_database_progress(job_id)
+        }
+        live = {key: value for key, value in live.items() if value}
+        return {**record.to_dict(), **live}
+    # Finished jobs no longer held in memory
+    summary = load_job_summary(job_id)
+    if summary:
+        return summary
+    if QUEUE_BACKEND == "shared":
+        return get_queued_job(job_id)
     return None
 
 
-def init_job(job_id: str, cmd: str) -> Dict:
+def init_job(job_id: str, cmd: str, status: str = "running") -> Dict:
     """
     Initialize a new job.
     
     Args:
         job_id: Unique identifier for the job
         cmd: Command to be executed
+        status: Initial status of the job
         
     Returns:
         Dictionary with initial job status
     """
     job_status = {
-        "status": "running",
+        "status": status,
         "command": cmd,
         "finished": False
     }
@@ -131,6 +596,33 @@ def init_job(job_id: str, cmd: str) -> Dict:
     return job_status
 
 
+def finish_job_without_command(job_id: str, output: str, fields: Optional[Dict] = None) -> Dict:
+    """
+    Record a job that has nothing to do as completed, without queueing it or
+    starting a process. It leaves no history, progress or storage behind.
+
+    Args:
+        job_id: Unique identifier for the job
+        output: Message explaining why nothing was run
+        fields: Additional job status information
+
+    Returns:
+        Dictionary with final job status
+    """
+    job_status = {
+        "status": "completed",
+        "command": "",
+        "output": output,
+        "finished": True,
+        **(fields or {})
+    }
+
+    # Saved as a summary too, which other replicas and the job runner read back
+    jobs[job_id] = job_status
+    logger.info(f"Job {job_id} completed without running a command: {output}")
+    return job_status
+
+
 def get_job_log(job_id: str) -> str:
     """
     Get the log content for a job.
@@ -141,11 +633,12 @@ def get_job_log(job_id: str) -> str:
     Returns:
         Log content as string or error message
     """
-    if job_id not in jobs:
+    job_info = get_job_status(job_id)
+    if not job_info:
         return "Job not found"
     
-    job_info = jobs[job_id]
-    log_file = job_info.get("log_file")
+    # Jobs run by another replica write to the shared log directory
+    log_file = job_info.get("log_file") or f"{get_log_directory()}/job-{job_id}.log"
     
     if not log_file or not os.path.exists(log_file):
         return "No logs found for this job"
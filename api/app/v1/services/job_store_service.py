@@ -0,0 +1,229 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict, deque
+from typing import Deque, Dict, Iterable, Optional
+
+from app.utils.command import get_log_directory
+
+# Configure logging
+logger = logging.getLogger("pgcopydb-api-jobs")
+
+# Finished jobs stay in memory until they have not been looked at for this long,
+# or until there are more of them than MAX_FINISHED_JOBS; older ones are read from disk
+FINISHED_JOB_TTL_SECONDS = int(os.environ.get("FINISHED_JOB_TTL_SECONDS", "3600"))
+MAX_FINISHED_JOBS = int(os.environ.get("MAX_FINISHED_JOBS", "200"))
+
+# Job status carries only the end of the output, both while held in memory and
+# when read back from disk; the full log is at /logs/{job_id}
+JOB_OUTPUT_TAIL_BYTES = int(os.environ.get("JOB_OUTPUT_TAIL_BYTES", str(64 * 1024)))
+
+
+class JobRecord:
+    """
+    Status of a job. Slotted, so the thousands of records a long-lived
+    replica builds up do not each carry an attribute dictionary. Fields
+    without a slot of their own are kept in ``extra``, created on first use.
+    """
+
+    __slots__ = (
+        "status", "command", "output", "error", "finished", "log_file", "worker",
+        "progress", "throttle", "compression", "incremental", "split_plan", "index_progress",
+        "databases", "extra",
+    )
+
+    def __init__(self, fields: Dict):
+        for name in self.__slots__:
+            setattr(self, name, None)
+        self.update(fields)
+
+    def __getitem__(self, name: str):
+        if name in self.__slots__:
+            return getattr(self, name)
+        if self.extra is None or name not in self.extra:
+            raise KeyError(name)
+        return self.extra[name]
+
+    def __setitem__(self, name: str, value) -> None:
+        if name in self.__slots__:
+            setattr(self, name, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[name] = value
+
+    def get(self, name: str, default=None):
+        try:
+            value = self[name]
+        except KeyError:
+            return default
+        return default if value is None else value
+
+    def update(self, fields: Dict) -> None:
+        for name, value in fields.items():
+            self[name] = value
+
+    def to_dict(self, exclude: Iterable[str] = ()) -> Dict:
+        fields = {name: getattr(self, name) for name in self.__slots__ if name != "extra"}
+        fields.update(self.extra or {})
+        return {
+            name: value
+            for name, value in fields.items()
+            if name not in exclude and value is not None
+        }
+
+
+def get_job_summary_file(job_id: str) -> str:
+    return f"{get_log_directory()}/job-{job_id}.summary.json"
+
+
+def save_job_summary(job_id: str, record: JobRecord) -> None:
+    """
+    Write the status of a finished job next to its log. The output is left
+    out, the log already holds it.
+
+    Args:
+        job_id: ID of the job
+        record: Final status of the job
+    """
+    path = get_job_summary_file(job_id)
+    try:
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(record.to_dict(exclude=("output",)), f)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logger.exception(f"Error saving summary of job {job_id}: {str(e)}")
+
+
+class OutputTail:
+    """
+    The last lines of a job's output, up to max_bytes, collected while the
+    job runs so memory does not grow with the size of its log.
+    """
+
+    def __init__(self, max_bytes: int = JOB_OUTPUT_TAIL_BYTES):
+        self.max_bytes = max_bytes
+        self.lines: Deque[str] = deque()
+        self.size = 0
+
+    def append(self, line: str) -> None:
+        self.lines.append(line)
+        self.size += len(line)
+        # The last line is kept even when it is larger than max_bytes on its own
+        while self.size > self.max_bytes and len(self.lines) > 1:
+            self.size -= len(self.lines.popleft())
+
+    def text(self, last_lines: Optional[int] = None) -> str:
+        lines = list(self.lines)
+        return "".join(lines[-last_lines:] if last_lines else lines)
+
+
+def _read_log_tail(log_file: str, max_bytes: int = JOB_OUTPUT_TAIL_BYTES) -> str:
+    """
+    Read the last lines of a log, up to max_bytes, without reading the rest.
+    """
+    with open(log_file, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(size - max_bytes, 0))
+        tail = f.read()
+    if size > max_bytes:
+        # Drop the partial first line
+        tail = tail.split(b"\n", 1)[-1]
+    return tail.decode(errors="replace")
+
+
+def load_job_summary(job_id: str) -> Optional[Dict]:
+    """
+    Get the status of a finished job from its summary and the end of its
+    log on disk.
+
+    Args:
+        job_id: ID of the job
+
+    Returns:
+        Dictionary with job status information or None if there is no summary
+    """
+    try:
+        with open(get_job_summary_file(job_id), 'r') as f:
+            summary = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+    log_file = summary.get("log_file")
+    if log_file and os.path.exists(log_file):
+        try:
+            summary["output"] = _read_log_tail(log_file)
+        except OSError as e:
+            logger.warning(f"Could not read log of job {job_id}: {str(e)}")
+    return summary
+
+
+class JobStore:
+    """
+    Job records by job ID. Running jobs are always kept; finished jobs are
+    saved to disk when they finish and evicted least recently used first,
+    once idle for FINISHED_JOB_TTL_SECONDS or beyond MAX_FINISHED_JOBS.
+    """
+
+    def __init__(self, ttl_seconds: int = FINISHED_JOB_TTL_SECONDS, max_finished: int = MAX_FINISHED_JOBS):
+        self.ttl_seconds = ttl_seconds
+        self.max_finished = max_finished
+        self.records: Dict[str, JobRecord] = {}
+        # Finished job IDs by last access time, least recently used first
+        self.finished: "OrderedDict[str, float]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, job_id: str) -> bool:
+        with self.lock:
+            self._evict()
+            return job_id in self.records
+
+    def __getitem__(self, job_id: str) -> JobRecord:
+        with self.lock:
+            record = self.records[job_id]
+            if job_id in self.finished:
+                self.finished[job_id] = time.time()
+                self.finished.move_to_end(job_id)
+            return record
+
+    def __setitem__(self, job_id: str, fields: Dict) -> None:
+        record = JobRecord(fields)
+        if record.finished:
+            save_job_summary(job_id, record)
+        with self.lock:
+            self.records[job_id] = record
+            self.finished.pop(job_id, None)
+            if record.finished:
+                self.finished[job_id] = time.time()
+            self._evict()
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def discard(self, job_id: str) -> None:
+        """
+        Forget a job without saving its summary, e.g. when another replica
+        now runs it and reports its status.
+        """
+        with self.lock:
+            self.records.pop(job_id, None)
+            self.finished.pop(job_id, None)
+
+    def get(self, job_id: str) -> Optional[JobRecord]:
+        try:
+            return self[job_id]
+        except KeyError:
+            return None
+
+    def _evict(self) -> None:
+        expire_before = time.time() - self.ttl_seconds
+        while self.finished:
+            job_id, accessed_at = next(iter(self.finished.items()))
+            if accessed_at >= expire_before and len(self.finished) <= self.max_finished:
+                break
+            del self.finished[job_id]
+            self.records.pop(job_id, None)
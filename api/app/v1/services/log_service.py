@@ -0,0 +1,407 @@
+import os
+import re
+import json
+import zlib
+import fcntl
+import time
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from app.utils.command import get_log_directory
+from app.v1.services.progress_service import (
+    LOG_LINE_RE, COPY_RE, CREATE_INDEXES_RE, CREATE_INDEX_RE, VACUUM_RE, normalize_name
+)
+
+# Configure logging
+logger = logging.getLogger("pgcopydb-api-logs")
+
+# "STEP 4: starting 4 table-data COPY processes"
+STEP_RE = re.compile(r'^STEP \d+:\s*(?P<step>.*)$')
+ALTER_TABLE_RE = re.compile(r'^ALTER TABLE (?:ONLY )?(?P<table>[^\s;]+)')
+
+# SQLSTATE codes, either spelled out or in libpq's verbose "ERROR:  23505: ..." form
+ERROR_CODE_RES = (
+    re.compile(r'SQLSTATE[\s:=]+(?P<code>[0-9A-Z]{5})\b'),
+    re.compile(r'(?:ERROR|FATAL|PANIC):\s+(?P<code>[0-9A-Z]{5}):'),
+)
+
+# pgcopydb steps by phase, checked in order against the step description
+STEP_PHASES = (
+    ("pre-data", "pre-data"),
+    ("post-data", "post-data"),
+    ("fetch", "catalog"),
+    ("dump", "schema-dump"),
+    ("copy", "copy"),
+    ("index", "index"),
+    ("constraint", "constraints"),
+    ("vacuum", "vacuum"),
+    ("sequence", "sequences"),
+    ("large object", "large-objects"),
+)
+
+# Only these levels are indexed, INFO and below would make the index as large as the logs
+INDEXED_LEVELS = ("WARNING", "ERROR", "FATAL", "PANIC")
+
+# pgcopydb logs warnings as WARN, they are recorded and searched as WARNING
+LEVEL_ALIASES = {"WARN": "WARNING"}
+
+# Postings kept per job and term; a job failing the same way on every row does not need more
+MAX_POSTINGS_PER_TERM = 1000
+
+# Running jobs write their postings to the index this often
+LOG_INDEX_FLUSH_SECONDS = int(os.environ.get("LOG_INDEX_FLUSH_SECONDS", "30"))
+
+# Files the index is split into by term; changing it orphans the postings already written
+LOG_INDEX_SHARDS = int(os.environ.get("LOG_INDEX_SHARDS", "64"))
+
+
+def get_structured_log_file(job_id: str) -> str:
+    return f"{get_log_directory()}/job-{job_id}.jsonl"
+
+
+def get_log_index_file(shard: int) -> str:
+    return f"{get_log_directory()}/log-index/{shard:02d}.jsonl"
+
+
+def _term_shard(term: str) -> int:
+    """
+    Get the index shard of a term. Tables are sharded by their bare name, so
+    a bare name finds the table in any schema by reading a single shard.
+    """
+    kind, _, value = term.partition(":")
+    if kind == "table":
+        value = value.rsplit(".", 1)[-1]
+    return zlib.crc32(f"{kind}:{value}".encode()) % LOG_INDEX_SHARDS
+
+
+def detect_phase(message: str, current: Optional[str]) -> Optional[str]:
+    """
+    Get the pgcopydb phase a log message belongs to.
+
+    pgcopydb runs COPY, index builds and vacuum concurrently, so messages of
+    those tasks are attributed by their own content; other messages belong
+    to the last step announced.
+
+    Args:
+        message: Log message without timestamp, PID and level
+        current: Phase of the last step announced
+
+    Returns:
+        Phase name or None if unknown
+    """
+    if COPY_RE.match(message):
+        return "copy"
+    if CREATE_INDEX_RE.match(message) or CREATE_INDEXES_RE.match(message):
+        return "index"
+    if VACUUM_RE.match(message):
+        return "vacuum"
+    if ALTER_TABLE_RE.match(message):
+        return "constraints"
+
+    step_match = STEP_RE.match(message)
+    if step_match:
+        step = step_match.group("step").lower()
+        for keyword, phase in STEP_PHASES:
+            if keyword in step:
+                return phase
+    return current
+
+
+def detect_table(message: str) -> Optional[str]:
+    """
+    Get the table a log message is about.
+
+    Args:
+        message: Log message without timestamp, PID and level
+
+    Returns:
+        Unquoted qualified table name or None
+    """
+    for regex in (COPY_RE, CREATE_INDEX_RE, CREATE_INDEXES_RE, VACUUM_RE, ALTER_TABLE_RE):
+        match = regex.match(message)
+        if match:
+            return normalize_name(match.group("table"))
+    return None
+
+
+def detect_error_code(message: str) -> Optional[str]:
+    for regex in ERROR_CODE_RES:
+        match = regex.search(message)
+        if match:
+            return match.group("code")
+    return None
+
+
+class StructuredJobLog:
+    """
+    Write the output of a job as JSON records next to its text log and
+    collect the postings of its table names, error codes and warning or
+    error levels in the shared log index.
+    """
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.file = open(get_structured_log_file(job_id), 'w', buffering=1)
+        self.phase: Optional[str] = None
+        # Last table named by each pgcopydb process
+        self.tables: Dict[int, str] = {}
+        # Postings per term, and those not yet written to the index
+        self.counts: Dict[str, int] = {}
+        self.pending: Dict[str, List[int]] = {}
+        self.flushed_at = time.time()
+
+    def write(self, line: str, level: Optional[str] = None, phase: Optional[str] = None) -> Dict:
+        """
+        Write one line of output as a structured record.
+
+        Args:
+            line: Output line, either from pgcopydb or from the service
+            level: Level of service messages
+            phase: Phase of service messages
+
+        Returns:
+            Written record
+        """
+        line = line.rstrip("\n")
+        # Service messages repeat the command and its output, only output lines are classified
+        from_service = level is not None
+        match = LOG_LINE_RE.match(line)
+        if match:
+            message = match.group("message").strip()
+            pid = int(match.group("pid"))
+            level = LEVEL_ALIASES.get(match.group("level"), match.group("level"))
+            self.phase = detect_phase(message, self.phase)
+            table = detect_table(message)
+            if table:
+                self.tables[pid] = table
+            elif level in INDEXED_LEVELS:
+                # Errors follow the line where the same process named its table
+                table = self.tables.get(pid)
+            phase = phase or self.phase
+        else:
+            message, pid, table = line, None, None
+            phase = phase or self.phase
+
+        record = {
+            "timestamp": datetime.now().isoformat(),
+            "job_id": self.job_id,
+            "level": level or "INFO",
+            "phase": phase,
+            "table": table,
+            "message": message,
+            "error_code": None if from_service else detect_error_code(message),
+            "pid": pid,
+        }
+
+        offset = self.file.tell()
+        self.file.write(json.dumps(record) + "\n")
+
+        for term in _record_terms(record):
+            if self.counts.get(term, 0) < MAX_POSTINGS_PER_TERM:
+                self.counts[term] = self.counts.get(term, 0) + 1
+                self.pending.setdefault(term, []).append(offset)
+
+        if time.time() - self.flushed_at >= LOG_INDEX_FLUSH_SECONDS:
+            self.flush()
+        return record
+
+    def flush(self) -> None:
+        """
+        Write the postings collected since the last flush to the log index.
+        """
+        self.flushed_at = time.time()
+        if self.pending:
+            pending, self.pending = self.pending, {}
+            append_log_postings(self.job_id, pending)
+
+    def close(self) -> None:
+        self.flush()
+        self.file.close()
+
+
+def _record_terms(record: Dict) -> List[str]:
+    terms = []
+    if record["table"]:
+        terms.append(f"table:{record['table']}")
+    if record["error_code"]:
+        terms.append(f"error:{record['error_code']}")
+    if record["level"] in INDEXED_LEVELS:
+        terms.append(f"level:{record['level']}")
+    return terms
+
+
+def append_log_postings(job_id: str, postings: Dict[str, List[int]]) -> None:
+    """
+    Append postings of a job to the log index.
+
+    The index maps each term to the byte offsets of the matching records in
+    the structured logs, so searches only read the records they return. It
+    is split into LOG_INDEX_SHARDS files by term, and a search only reads
+    the shards of its terms. Each line of a shard holds the offsets of one
+    term in one job; a job appends a line per term on every flush.
+
+    Args:
+        job_id: ID of the job
+        postings: New offsets of the job's records by term
+    """
+    by_shard: Dict[int, List[str]] = {}
+    for term, offsets in postings.items():
+        line = json.dumps({"term": term, "job_id": job_id, "offsets": offsets}, separators=(",", ":"))
+        by_shard.setdefault(_term_shard(term), []).append(line + "\n")
+
+    try:
+        os.makedirs(os.path.dirname(get_log_index_file(0)), exist_ok=True)
+        for shard, lines in by_shard.items():
+            with open(get_log_index_file(shard), 'a') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                f.write("".join(lines))
+    except Exception as e:
+        logger.exception(f"Error updating log index for job {job_id}: {str(e)}")
+
+
+def _read_shard(shard: int) -> List[Dict]:
+    """
+    Get the entries of an index shard. Entries of jobs whose structured log
+    has been removed are removed from the shard as well.
+    """
+    path = get_log_index_file(shard)
+    try:
+        with open(path, 'r+') as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            entries = []
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except json.JSONDecodeError:
+                    # Partial line of a writer that died mid-write
+                    continue
+
+            jobs = {entry["job_id"] for entry in entries}
+            removed = {job for job in jobs if not os.path.exists(get_structured_log_file(job))}
+            if removed:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                # Another search may have pruned the shard or jobs appended to it meanwhile
+                f.seek(0)
+                entries = [json.loads(line) for line in f if line.strip()]
+                entries = [entry for entry in entries if entry["job_id"] not in removed]
+                f.seek(0)
+                f.write("".join(json.dumps(entry, separators=(",", ":")) + "\n" for entry in entries))
+                f.truncate()
+            return entries
+    except FileNotFoundError:
+        return []
+
+
+def _load_index(terms: List[str], job_id: Optional[str] = None) -> Dict[str, Dict[str, List[int]]]:
+    """
+    Get the postings stored in the shards of the given terms, of every job
+    or of a single job, by term and job ID.
+    """
+    index: Dict[str, Dict[str, List[int]]] = {}
+    for shard in sorted({_term_shard(term) for term in terms}):
+        for entry in _read_shard(shard):
+            if job_id and entry["job_id"] != job_id:
+                continue
+            index.setdefault(entry["term"], {}).setdefault(entry["job_id"], []).extend(entry["offsets"])
+    return index
+
+
+def _lookup(index: Dict[str, Dict[str, List[int]]], term: str) -> Set[Tuple[str, int]]:
+    """
+    Get the (job ID, offset) postings of a term. Bare table names match the
+    table in any schema.
+    """
+    if term.startswith("table:") and "." not in term:
+        suffix = "." + term[len("table:"):]
+        keys = [key for key in index if key.startswith("table:") and key.endswith(suffix)]
+    else:
+        keys = [term]
+    return {
+        (job_id, offset)
+        for key in keys
+        for job_id, offsets in index.get(key, {}).items()
+        for offset in offsets
+    }
+
+
+def _read_records(job_id: str, offsets: List[int]) -> List[Dict]:
+    records = []
+    try:
+        with open(get_structured_log_file(job_id), 'r') as f:
+            for offset in sorted(offsets):
+                f.seek(offset)
+                records.append(json.loads(f.readline()))
+    except (FileNotFoundError, json.JSONDecodeError):
+        logger.warning(f"Structured log of job {job_id} is missing or damaged")
+    return records
+
+
+def search_logs(table: Optional[str] = None, error_code: Optional[str] = None,
+                level: Optional[str] = None, job_id: Optional[str] = None,
+                phase: Optional[str] = None, text: Optional[str] = None,
+                limit: int = 100) -> Dict:
+    """
+    Search the structured logs of all jobs.
+
+    Table, error code and level are answered from the log index; the other
+    criteria filter the matching records. Without an indexed criterion the
+    search is limited to the log of a single job.
+
+    Args:
+        table: Table name, qualified or bare
+        error_code: SQLSTATE error code
+        level: Log level, one of INDEXED_LEVELS
+        job_id: Only search the logs of this job
+        phase: Only return records of this phase
+        text: Only return records whose message contains this text
+        limit: Maximum number of records to return
+
+    Returns:
+        Dictionary with the matching records
+    """
+    terms = []
+    if table:
+        terms.append(f"table:{normalize_name(table)}")
+    if error_code:
+        terms.append(f"error:{error_code.upper()}")
+    if level:
+        level_name = LEVEL_ALIASES.get(level.upper(), level.upper())
+        if level_name not in INDEXED_LEVELS:
+            raise ValueError(f"Level must be one of {', '.join(INDEXED_LEVELS)}")
+        terms.append(f"level:{level_name}")
+
+    if terms:
+        index = _load_index(terms, job_id)
+        postings = _lookup(index, terms[0])
+        for term in terms[1:]:
+            postings &= _lookup(index, term)
+        by_job: Dict[str, List[int]] = {}
+        for posting_job, offset in postings:
+            by_job.setdefault(posting_job, []).append(offset)
+        records = [r for posting_job, offsets in by_job.items() for r in _read_records(posting_job, offsets)]
+    elif job_id:
+        try:
+            with open(get_structured_log_file(job_id), 'r') as f:
+                records = [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            records = []
+    else:
+        raise ValueError("Search by table, error_code, level or job_id")
+
+    if phase:
+        records = [r for r in records if r["phase"] == phase]
+    if text:
+        records = [r for r in records if text.lower() in r["message"].lower()]
+
+    records.sort(key=lambda r: r["timestamp"], reverse=True)
+
+    return {
+        "query": {
+            "table": table, "error_code": error_code, "level": level,
+            "job_id": job_id, "phase": phase, "text": text,
+        },
+        "total": len(records),
+        "jobs": len({r["job_id"] for r in records}),
+        "records": records[:limit],
+    }
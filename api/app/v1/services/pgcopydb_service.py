@@ -2,6 +2,7 @@ import uuid
 import subprocess
 import logging
 from typing import Dict, List, Optional
+from urllib.parse import urlparse, quote
 
 # Configure logging
 logger = logging.getLogger("pgcopydb-api-operations")
@@ -23,7 +24,22 @@ def check_pgcopydb_version() -> str:
         raise e
 
 
-def build_clone_command(source: str, target: str, options: Optional[List[str]] = None) -> str:
+def has_option(options: Optional[List[str]], name: str) -> bool:
+    """
+    Check whether a pgcopydb option is given, either as "--name value" or "--name=value".
+    
+    Args:
+        options: Command options
+        name: Option name, with its leading dashes
+        
+    Returns:
+        True if the option is present
+    """
+    return any(option == name or option.startswith(f"{name}=") for option in options or [])
+
+
+def build_clone_command(source: str, target: str, options: Optional[List[str]] = None,
+                        work_dir: Optional[str] = None) -> str:
     """
     Build command string for pgcopydb clone operation.
     
@@ -31,14 +47,36 @@ def build_clone_command(source: str, target: str, options: Optional[List[str]] =
         source: Source database connection string
         target: Target database connection string
         options: Additional command options
+        work_dir: Work directory, unless one is given in the options
         
     Returns:
         Formatted command string
     """
-    options_str = " ".join(options) if options else ""
+    options = list(options or [])
+    if work_dir and not has_option(options, "--dir"):
+        options += ["--dir", f'"{work_dir}"']
+    options_str = " ".join(options)
     return f'pgcopydb clone --source "{source}" --target "{target}" {options_str}'
 
 
+def build_copy_roles_command(source: str, target: str, no_role_passwords: bool = False) -> str:
+    """
+    Build command string for pgcopydb copy roles operation.
+    
+    Args:
+        source: Source database connection string
+        target: Target database connection string
+        no_role_passwords: Whether to leave out role passwords
+        
+    Returns:
+        Formatted command string
+    """
+    cmd = f'pgcopydb copy roles --source "{source}" --target "{target}"'
+    if no_role_passwords:
+        cmd += " --no-role-passwords"
+    return cmd
+
+
 def build_dump_command(source: str, directory: str, dump_type: str = "full", 
                        tables: Optional[List[str]] = None,
                        exclude_tables: Optional[List[str]] = None,
@@ -115,7 +153,8 @@ def build_restore_command(target: str, directory: str,
                           schema_only: bool = False,
                           data_only: bool = False,
                           tables: Optional[List[str]] = None,
-                          exclude_tables: Optional[List[str]] = None) -> str:
+                          exclude_tables: Optional[List[str]] = None,
+                          skip_post_data: bool = False) -> str:
     """
     Build command string for pgcopydb restore operation.
     
@@ -126,11 +165,13 @@ def build_restore_command(target: str, directory: str,
         data_only: Whether to restore data only
         tables: List of tables to restore
         exclude_tables: List of tables to exclude
+        skip_post_data: Only restore the pre-data section, indexes and constraints are left to a post-data job
         
     Returns:
         Formatted command string
     """
-    cmd = f'pgcopydb restore --target "{target}" --input-dir "{directory}"'
+    restore = "restore pre-data" if skip_post_data else "restore"
+    cmd = f'pgcopydb {restore} --target "{target}" --input-dir "{directory}"'
     
     if schema_only:
         cmd += " --schema-only"
@@ -148,7 +189,9 @@ def build_restore_command(target: str, directory: str,
 
 def build_copy_command(source: str, target: str,
                        tables: Optional[List[str]] = None,
-                       exclude_tables: Optional[List[str]] = None) -> str:
+                       exclude_tables: Optional[List[str]] = None,
+                       work_dir: Optional[str] = None,
+                       options: Optional[List[str]] = None) -> str:
     """
     Build command string for pgcopydb copy operation.
     
@@ -157,12 +200,19 @@ def build_copy_command(source: str, target: str,
         target: Target database connection string
         tables: List of tables to copy
         exclude_tables: List of tables to exclude
+        work_dir: Work directory
+        options: Additional command options
         
     Returns:
         Formatted command string
     """
     cmd = f'pgcopydb copy-db --source "{source}" --target "{target}"'
     
+    if work_dir:
+        cmd += f' --dir "{work_dir}"'
+    if options:
+        cmd += " " + " ".join(options)
+    
     if tables:
         tables_str = " ".join([f"--table {t}" for t in tables])
         cmd += f" {tables_str}"
@@ -212,3 +262,116 @@ def filter_tables(connection_string: str, filter_pattern: str) -> List[str]:
         raise Exception(result.stderr)
     
     return [line.strip() for line in result.stdout.splitlines() if line.strip()]
+
+
+def run_query(connection_string: str, query: str) -> List[List[str]]:
+    """
+    Run a catalog query with psql and return the rows.
+    
+    Args:
+        connection_string: Database connection string
+        query: SQL query to run
+        
+    Returns:
+        List of rows, each a list of column values as strings
+    """
+    cmd = ["psql", connection_string, "-X", "-A", "-t", "-F", "\t", "-v", "ON_ERROR_STOP=1", "-c", query]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+    
+    if result.returncode != 0:
+        logger.error(f"Error running query: {result.stderr}")
+        raise Exception(result.stderr)
+    
+    return [line.split("\t") for line in result.stdout.splitlines() if line.strip()]
+
+
+def get_host(connection_string: str) -> str:
+    """
+    Get the host name of a connection string.
+    
+    Args:
+        connection_string: Database connection string
+        
+    Returns:
+        Host name, or "unknown" if it cannot be parsed
+    """
+    try:
+        return urlparse(connection_string).hostname or "unknown"
+    except ValueError:
+        return "unknown"
+
+
+def table_selected(name: str, tables: Optional[List[str]], exclude_tables: Optional[List[str]]) -> bool:
+    """
+    Check a qualified table name against include and exclude lists, which may
+    contain either qualified or bare table names.
+    """
+    bare_name = name.split(".", 1)[-1]
+    if tables and name not in tables and bare_name not in tables:
+        return False
+    if exclude_tables and (name in exclude_tables or bare_name in exclude_tables):
+        return False
+    return True
+
+
+def with_database(connection_string: str, database: str) -> str:
+    """
+    Point a connection string at another database of the same server.
+    
+    Args:
+        connection_string: Database connection string
+        database: Database name
+        
+    Returns:
+        Connection string with the database replaced
+    """
+    return urlparse(connection_string)._replace(path="/" + quote(database, safe="")).geturl()
+
+
+def get_relation_sizes(connection_string: str,
+                       tables: Optional[List[str]] = None,
+                       exclude_tables: Optional[List[str]] = None) -> Dict[str, List[Dict]]:
+    """
+    Get the on-disk size of the tables and indexes of a database.
+    
+    Args:
+        connection_string: Database connection string
+        tables: List of tables to include
+        exclude_tables: List of tables to exclude
+        
+    Returns:
+        Dictionary with "tables" and "indexes" lists, sizes in bytes
+    """
+    table_rows = run_query(connection_string, """
+        SELECT n.nspname || '.' || c.relname, pg_table_size(c.oid), c.reltuples::bigint
+          FROM pg_class c
+          JOIN pg_namespace n ON n.oid = c.relnamespace
+         WHERE c.relkind = 'r'
+           AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+           AND n.nspname NOT LIKE 'pg_toast%'
+         ORDER BY pg_table_size(c.oid) DESC
+    """)
+    index_rows = run_query(connection_string, """
+        SELECT tn.nspname || '.' || t.relname, i.relname, pg_relation_size(i.oid)
+          FROM pg_index x
+          JOIN pg_class i ON i.oid = x.indexrelid
+          JOIN pg_class t ON t.oid = x.indrelid
+          JOIN pg_namespace tn ON tn.oid = t.relnamespace
+         WHERE t.relkind = 'r'
+           AND tn.nspname NOT IN ('pg_catalog', 'information_schema')
+           AND tn.nspname NOT LIKE 'pg_toast%'
+         ORDER BY pg_relation_size(i.oid) DESC
+    """)
+    
+    return {
+        "tables": [
+            {"name": name, "bytes": int(size), "rows": max(int(rows), 0)}
+            for name, size, rows in table_rows
+            if table_selected(name, tables, exclude_tables)
+        ],
+        "indexes": [
+            {"table": table, "name": name, "bytes": int(size)}
+            for table, name, size in index_rows
+            if table_selected(table, tables, exclude_tables)
+        ]
+    }
@@ -0,0 +1,517 @@
+import os
+import json
+import heapq
+import logging
+import subprocess
+import threading
+from math import ceil
+from typing import Dict, List, Optional
+
+from app.utils.command import get_log_directory
+from app.v1.services.pgcopydb_service import (
+    build_clone_command, build_copy_command, build_restore_command,
+    get_relation_sizes, get_host, run_query
+)
+
+# Configure logging
+logger = logging.getLogger("pgcopydb-api-planner")
+
+# Upper bound for the recommended number of table and index jobs
+PLANNER_MAX_JOBS = int(os.environ.get("PLANNER_MAX_JOBS", "8"))
+
+# Per-worker throughput assumed until jobs against a target host have been observed
+DEFAULT_COPY_BYTES_PER_SECOND = int(os.environ.get("PLANNER_DEFAULT_COPY_BYTES_PER_SECOND", str(30 * 1024 * 1024)))
+DEFAULT_INDEX_BYTES_PER_SECOND = int(os.environ.get("PLANNER_DEFAULT_INDEX_BYTES_PER_SECOND", str(60 * 1024 * 1024)))
+
+# Weight of the latest job in the calibrated throughput
+CALIBRATION_ALPHA = 0.3
+
+# pgcopydb streams table data from source to target; its work directory only
+# holds the schema dumps and the catalog of the objects being copied
+WORKDIR_BASE_BYTES = 64 * 1024 * 1024
+WORKDIR_BYTES_PER_OBJECT = 16 * 1024
+
+# Number of COPY workers pgcopydb starts when --table-jobs is not given
+PGCOPYDB_DEFAULT_TABLE_JOBS = 4
+
+# Tables smaller than this are never split, and no part is made smaller than the second
+SPLIT_MIN_TABLE_BYTES = int(os.environ.get("SPLIT_MIN_TABLE_BYTES", str(1024 ** 3)))
+SPLIT_MIN_PART_BYTES = int(os.environ.get("SPLIT_MIN_PART_BYTES", str(256 * 1024 ** 2)))
+
+# Key ranges whose busiest part holds more than this multiple of an even share are reported as skewed
+SPLIT_SKEW_WARNING = 2.0
+
+# Single integer column keys pgcopydb can split on, with their statistics
+SPLIT_KEY_QUERY = """
+    SELECT DISTINCT ON (c.oid) n.nspname || '.' || c.relname, a.attname, coalesce(s.histogram_bounds::text, '')
+      FROM pg_index x
+      JOIN pg_class c ON c.oid = x.indrelid
+      JOIN pg_namespace n ON n.oid = c.relnamespace
+      JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum = x.indkey[0]
+      LEFT JOIN pg_stats s ON s.schemaname = n.nspname AND s.tablename = c.relname AND s.attname = a.attname
+     WHERE x.indnatts = 1
+       AND (x.indisprimary OR (x.indisunique AND a.attnotnull))
+       AND a.atttypid IN ('int2'::regtype, 'int4'::regtype, 'int8'::regtype)
+       AND n.nspname || '.' || c.relname IN ({names})
+     ORDER BY c.oid, x.indisprimary DESC
+"""
+
+_model_lock = threading.Lock()
+
+
+def get_model_file() -> str:
+    """
+    Get the path of the calibrated throughput model.
+
+    Returns:
+        Path to the model file
+    """
+    return f"{get_log_directory()}/throughput-model.json"
+
+
+def load_throughput_model() -> Dict[str, Dict]:
+    """
+    Load the throughput observed on past jobs, by target host.
+
+    Returns:
+        Dictionary of throughput figures by target host
+    """
+    try:
+        with open(get_model_file(), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def record_job_throughput(target: Optional[str], progress: Optional[Dict]) -> None:
+    """
+    Calibrate the throughput model with the progress of a finished job.
+
+    Args:
+        target: Target database connection string
+        progress: Final progress information of the job
+    """
+    if not target or not progress:
+        return
+
+    host = get_host(target)
+    observed = {
+        "copy_bytes_per_second": progress["copy"]["throughput_bytes_per_second"],
+        "index_bytes_per_second": progress["index"]["throughput_bytes_per_second"],
+    }
+
+    with _model_lock:
+        model = load_throughput_model()
+        entry = model.setdefault(host, {"samples": 0})
+        for key, value in observed.items():
+            if not value:
+                continue
+            previous = entry.get(key)
+            entry[key] = round(value if previous is None else previous + CALIBRATION_ALPHA * (value - previous))
+        entry["samples"] += 1
+
+        try:
+            tmp_file = f"{get_model_file()}.tmp"
+            with open(tmp_file, 'w') as f:
+                json.dump(model, f, indent=2)
+            os.replace(tmp_file, get_model_file())
+        except Exception as e:
+            logger.exception(f"Error writing throughput model: {str(e)}")
+
+
+def estimate_workdir_bytes(object_count: int) -> int:
+    """
+    Estimate the space pgcopydb needs in its work directory.
+
+    Args:
+        object_count: Number of tables and indexes involved
+
+    Returns:
+        Estimated size in bytes
+    """
+    return WORKDIR_BASE_BYTES + WORKDIR_BYTES_PER_OBJECT * object_count
+
+
+def schedule_makespan(sizes: List[int], workers: int, rate: float) -> float:
+    """
+    Estimate the time needed to process items on parallel workers, assigning
+    the largest remaining item to the first free worker.
+
+    Args:
+        sizes: Item sizes in bytes
+        workers: Number of parallel workers
+        rate: Per-worker throughput in bytes per second
+
+    Returns:
+        Estimated duration in seconds
+    """
+    if not sizes or rate <= 0:
+        return 0.0
+
+    finish_times = [0.0] * max(workers, 1)
+    for size in sorted(sizes, reverse=True):
+        earliest = heapq.heappop(finish_times)
+        heapq.heappush(finish_times, earliest + size / rate)
+    return max(finish_times)
+
+
+def recommend_jobs(sizes: List[int]) -> int:
+    """
+    Recommend a number of parallel jobs: beyond the point where the largest
+    item alone determines the duration, more workers only add load.
+
+    Args:
+        sizes: Item sizes in bytes
+
+    Returns:
+        Recommended number of jobs
+    """
+    if not sizes or max(sizes) == 0:
+        return 1
+    return max(1, min(ceil(sum(sizes) / max(sizes)), len(sizes), PLANNER_MAX_JOBS))
+
+
+def _option_value(options: Optional[List[str]], name: str) -> Optional[str]:
+    """
+    Get the value of a pgcopydb option given either as "--name value" or "--name=value".
+    """
+    options = options or []
+    for position, option in enumerate(options):
+        if option == name and position + 1 < len(options):
+            return options[position + 1]
+        if option.startswith(f"{name}="):
+            return option.split("=", 1)[1]
+    return None
+
+
+def _busiest_part_fraction(bounds: List[int], parts: int) -> float:
+    """
+    Estimate the share of rows in the busiest of equal-width key ranges.
+
+    pgcopydb splits a table into ranges of equal width between the minimum
+    and maximum key; with gaps or skew in the keys some ranges hold more rows.
+    Every histogram bucket holds the same number of rows, spread evenly
+    over its own range.
+
+    Args:
+        bounds: Histogram bounds of the key column
+        parts: Number of key ranges
+
+    Returns:
+        Fraction of the rows in the busiest range, 1 / parts when even
+    """
+    if len(bounds) < 2 or bounds[-1] <= bounds[0]:
+        return 1.0 / parts
+
+    low, high = bounds[0], bounds[-1]
+    width = (high - low) / parts
+    bucket_rows = 1.0 / (len(bounds) - 1)
+    fractions = [0.0] * parts
+
+    for start, end in zip(bounds, bounds[1:]):
+        if end <= start:
+            # Equal bounds: the bucket is a single heavily repeated value
+            fractions[min(int((start - low) / width), parts - 1)] += bucket_rows
+            continue
+        for part in range(parts):
+            overlap = min(end, low + (part + 1) * width) - max(start, low + part * width)
+            if overlap > 0:
+                fractions[part] += bucket_rows * overlap / (end - start)
+    return max(fractions)
+
+
+def _split_keys(source: str, names: List[str]) -> Dict[str, Dict]:
+    """
+    Get the integer key and its histogram for each table that has one.
+
+    Args:
+        source: Source database connection string
+        names: Qualified table names
+
+    Returns:
+        Dictionary with the key column and histogram bounds by table
+    """
+    quoted = ", ".join("'" + name.replace("'", "''") + "'" for name in names)
+    keys = {}
+    for name, column, histogram in run_query(source, SPLIT_KEY_QUERY.format(names=quoted)):
+        bounds = [int(b) for b in histogram.strip("{}").split(",") if b.strip().lstrip("-").isdigit()]
+        keys[name] = {"column": column, "bounds": bounds}
+    return keys
+
+
+def plan_table_splits(source: str, tables: List[Dict], table_jobs: int) -> Dict:
+    """
+    Choose how pgcopydb should split the largest tables so that no single
+    COPY worker carries one of them alone.
+
+    A table is an outlier when it is larger than an even share of the data
+    per worker, since no schedule can then finish before that one table.
+    pgcopydb takes a single split threshold, so it is set above every table
+    that should be left alone and low enough for the largest outlier to be
+    cut into one part per worker.
+
+    Args:
+        source: Source database connection string
+        tables: Tables with their sizes, as returned by get_relation_sizes
+        table_jobs: Number of COPY workers
+
+    Returns:
+        Dictionary with the split options and the plan of every split table
+    """
+    table_jobs = max(table_jobs, 1)
+    total_bytes = sum(t["bytes"] for t in tables)
+    share = total_bytes / table_jobs
+    outliers = [t for t in tables if t["bytes"] > share and t["bytes"] >= SPLIT_MIN_TABLE_BYTES]
+
+    plan = {
+        "table_jobs": table_jobs,
+        "split_tables_larger_than_bytes": None,
+        "split_max_parts": None,
+        "options": [],
+        "tables": [],
+        "unsplit_tables": len(tables),
+    }
+    if not outliers or table_jobs == 1:
+        return plan
+
+    largest_kept = max((t["bytes"] for t in tables if t not in outliers), default=0)
+    largest = max(t["bytes"] for t in outliers)
+    threshold = max(ceil(largest / table_jobs), largest_kept + 1, SPLIT_MIN_PART_BYTES)
+    # pgcopydb reads the threshold as a pretty-printed size
+    threshold_mb = ceil(threshold / 1024 ** 2)
+    threshold = threshold_mb * 1024 ** 2
+
+    keys = _split_keys(source, [t["name"] for t in outliers])
+
+    for table in outliers:
+        if table["bytes"] <= threshold:
+            continue
+        parts = min(ceil(table["bytes"] / threshold), table_jobs)
+        key = keys.get(table["name"])
+        if key:
+            # Range split on the key: parts are only as even as the key distribution
+            busiest = _busiest_part_fraction(key["bounds"], parts)
+            method, column = "key_range", key["column"]
+        else:
+            # Without an integer key pgcopydb splits on CTID ranges, which follow the physical size
+            busiest = 1.0 / parts
+            method, column = "ctid", None
+
+        entry = {
+            "name": table["name"],
+            "bytes": table["bytes"],
+            "parts": parts,
+            "method": method,
+            "key": column,
+            "largest_part_bytes": round(table["bytes"] * busiest),
+        }
+        if busiest * parts >= SPLIT_SKEW_WARNING:
+            entry["warning"] = (f"keys of {column} are skewed: the largest part holds "
+                                f"{busiest:.0%} of the rows instead of {1 / parts:.0%}")
+        plan["tables"].append(entry)
+
+    if not plan["tables"]:
+        return plan
+
+    plan.update({
+        "split_tables_larger_than_bytes": threshold,
+        "split_max_parts": table_jobs,
+        "options": ["--split-tables-larger-than", f"{threshold_mb}MB", "--split-max-parts", str(table_jobs)],
+        "unsplit_tables": len(tables) - len(plan["tables"]),
+    })
+    return plan
+
+
+def prepare_table_splits(source: str, options: Optional[List[str]] = None,
+                         tables: Optional[List[str]] = None,
+                         exclude_tables: Optional[List[str]] = None,
+                         sizes: Optional[Dict] = None) -> Optional[Dict]:
+    """
+    Plan the table splits of a clone or copy job.
+
+    Args:
+        source: Source database connection string
+        options: pgcopydb options of the job
+        tables: List of tables to include
+        exclude_tables: List of tables to exclude
+        sizes: Table sizes of the source, if the job has already measured them
+
+    Returns:
+        Split plan, or None if the caller chose the split options or the
+        source statistics could not be read
+    """
+    if _option_value(options, "--split-tables-larger-than"):
+        return None
+    table_jobs = int(_option_value(options, "--table-jobs") or PGCOPYDB_DEFAULT_TABLE_JOBS)
+    try:
+        sizes = sizes or get_relation_sizes(source, tables=tables, exclude_tables=exclude_tables)
+        return plan_table_splits(source, sizes["tables"], table_jobs)
+    except Exception as e:
+        logger.warning(f"Could not plan table splits, copying tables whole: {str(e)}")
+        return None
+
+
+def _part_sizes(tables: List[Dict], split_plan: Dict) -> List[int]:
+    """
+    Get the sizes of the units of work of the COPY workers once the split
+    tables are cut into parts.
+    """
+    splits = {t["name"]: t for t in split_plan["tables"]}
+    sizes = []
+    for table in tables:
+        split = splits.get(table["name"])
+        if not split:
+            sizes.append(table["bytes"])
+            continue
+        rest = (split["bytes"] - split["largest_part_bytes"]) / max(split["parts"] - 1, 1)
+        sizes += [split["largest_part_bytes"]] + [round(rest)] * (split["parts"] - 1)
+    return sizes
+
+
+def _dump_inventory(directory: str) -> Dict:
+    """
+    Describe a dump directory: its files and the objects in its archive.
+
+    Args:
+        directory: Dump directory
+
+    Returns:
+        Dictionary with dump files and object counts
+    """
+    files = []
+    for root, _, names in os.walk(directory):
+        for name in names:
+            path = os.path.join(root, name)
+            files.append({"path": os.path.relpath(path, directory), "bytes": os.path.getsize(path)})
+
+    counts: Dict[str, int] = {}
+    for archive in ("pre.dump", "post.dump"):
+        path = os.path.join(directory, "schema", archive)
+        if not os.path.exists(path):
+            continue
+        result = subprocess.run(["pg_restore", "--list", path], capture_output=True, text=True)
+        for line in result.stdout.splitlines():
+            # TOC entries look like "215; 1259 16390 TABLE public orders postgres"
+            if line.startswith(";") or ";" not in line:
+                continue
+            parts = line.split(";", 1)[1].split()
+            if len(parts) >= 3:
+                counts[parts[2]] = counts.get(parts[2], 0) + 1
+
+    return {"files": files, "total_bytes": sum(f["bytes"] for f in files), "objects": counts}
+
+
+def plan_migration(operation: str, source: Optional[str] = None, target: Optional[str] = None,
+                   directory: Optional[str] = None, options: Optional[List[str]] = None,
+                   tables: Optional[List[str]] = None, exclude_tables: Optional[List[str]] = None,
+                   schema_only: bool = False, data_only: bool = False) -> Dict:
+    """
+    Plan a clone, copy or restore without running pgcopydb.
+
+    Args:
+        operation: "clone", "copy" or "restore"
+        source: Source database connection string
+        target: Target database connection string
+        directory: Dump directory for restore
+        options: Additional clone options
+        tables: List of tables to include
+        exclude_tables: List of tables to exclude
+        schema_only: Whether a restore is schema only
+        data_only: Whether a restore is data only
+
+    Returns:
+        Dictionary with the command, inventory, recommendations and estimates
+    """
+    if operation == "restore":
+        cmd = build_restore_command(
+            target=target, directory=directory, schema_only=schema_only, data_only=data_only,
+            tables=tables, exclude_tables=exclude_tables
+        )
+        dump = _dump_inventory(directory) if os.path.isdir(directory) else None
+        return {
+            "operation": operation,
+            "command": cmd,
+            "recommended_command": cmd,
+            "inventory": {"dump": dump},
+            "recommended_parallelism": None,
+            "peak_disk_bytes": estimate_workdir_bytes(0),
+            "estimated_duration_seconds": None,
+            "estimate": {"note": "restore replays schema sections; data volume is not known from the dump"}
+        }
+
+    if operation == "clone":
+        cmd = build_clone_command(source, target, options)
+    else:
+        cmd = build_copy_command(source, target, tables=tables, exclude_tables=exclude_tables)
+
+    sizes = get_relation_sizes(source, tables=tables, exclude_tables=exclude_tables)
+    table_sizes = [t["bytes"] for t in sizes["tables"]]
+    index_sizes = [i["bytes"] for i in sizes["indexes"]]
+
+    # Size the pool on the parts the tables would be split into with as many workers as useful
+    part_sizes = table_sizes
+    requested_jobs = _option_value(options, "--table-jobs")
+    if not requested_jobs and not _option_value(options, "--split-tables-larger-than"):
+        part_sizes = _part_sizes(sizes["tables"], plan_table_splits(source, sizes["tables"], PLANNER_MAX_JOBS))
+
+    table_jobs = int(requested_jobs) if requested_jobs else recommend_jobs(part_sizes)
+    index_jobs = recommend_jobs(index_sizes)
+
+    recommended_options = list(options or [])
+    if _option_value(recommended_options, "--table-jobs") is None:
+        recommended_options += ["--table-jobs", str(table_jobs)]
+    if _option_value(recommended_options, "--index-jobs") is None:
+        recommended_options += ["--index-jobs", str(index_jobs)]
+
+    # A job plans its splits when it starts, for the workers of its own command;
+    # report the plan it will apply to the recommended command
+    split_plan = prepare_table_splits(source, recommended_options, sizes=sizes)
+    part_sizes = _part_sizes(sizes["tables"], split_plan) if split_plan else table_sizes
+
+    if operation == "clone":
+        recommended_cmd = build_clone_command(source, target, recommended_options)
+    else:
+        recommended_cmd = build_copy_command(
+            source, target, tables=tables, exclude_tables=exclude_tables,
+            options=recommended_options
+        )
+
+    model = load_throughput_model().get(get_host(target), {})
+    copy_rate = model.get("copy_bytes_per_second") or DEFAULT_COPY_BYTES_PER_SECOND
+    index_rate = model.get("index_bytes_per_second") or DEFAULT_INDEX_BYTES_PER_SECOND
+
+    copy_seconds = schedule_makespan(part_sizes, table_jobs, copy_rate)
+    index_seconds = schedule_makespan(index_sizes, index_jobs, index_rate)
+
+    # Index builds overlap with COPY, except for those that wait on the end of the
+    # COPY phase; the largest table starts first but is the one most likely to
+    # finish last, so its indexes are taken as that tail
+    largest_table = sizes["tables"][0]["name"] if sizes["tables"] else None
+    tail_seconds = sum(i["bytes"] for i in sizes["indexes"] if i["table"] == largest_table) / index_rate
+    duration = max(copy_seconds + tail_seconds, index_seconds)
+
+    return {
+        "operation": operation,
+        "command": cmd,
+        "recommended_command": recommended_cmd,
+        "inventory": {
+            "table_count": len(sizes["tables"]),
+            "index_count": len(sizes["indexes"]),
+            "total_table_bytes": sum(table_sizes),
+            "total_index_bytes": sum(index_sizes),
+            "tables": sizes["tables"],
+            "indexes": sizes["indexes"],
+        },
+        "recommended_parallelism": {"table_jobs": table_jobs, "index_jobs": index_jobs},
+        "split_plan": split_plan,
+        "peak_disk_bytes": estimate_workdir_bytes(len(table_sizes) + len(index_sizes)),
+        "estimated_duration_seconds": round(duration),
+        "estimate": {
+            "copy_seconds": round(copy_seconds),
+            "index_seconds": round(index_seconds),
+            "copy_bytes_per_second": copy_rate,
+            "index_bytes_per_second": index_rate,
+            "calibrated": bool(model.get("samples")),
+            "samples": model.get("samples", 0),
+        }
+    }
@@ -0,0 +1,361 @@
+import os
+import re
+import json
+import time
+import argparse
+import logging
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from app.utils.command import emit_log_line
+from app.v1.services.pgcopydb_service import run_query, get_relation_sizes
+from app.v1.services.progress_service import CREATE_INDEX_RE, normalize_name
+from app.v1.services.log_service import ALTER_TABLE_RE
+from app.v1.services.compression_service import COMPRESSION_EXTENSIONS, decompress_file
+from app.v1.services.storage_service import get_job_workdir
+from app.v1.services.runner_service import API_ROOT
+from app.v1.services.throttle_service import JOB_APPLICATION_NAME
+
+# Configure logging
+logger = logging.getLogger("pgcopydb-api-postdata")
+
+# Defaults of post-data jobs: parallel builds and the maintenance_work_mem shared by them
+DEFAULT_INDEX_JOBS = int(os.environ.get("POST_DATA_INDEX_JOBS", "4"))
+DEFAULT_MEMORY_BUDGET_MB = int(os.environ.get("POST_DATA_MEMORY_BUDGET_MB", "4096"))
+MIN_MAINTENANCE_WORK_MEM_MB = 64
+
+# How often running index builds are sampled from pg_stat_progress_create_index
+PROGRESS_POLL_SECONDS = int(os.environ.get("POST_DATA_PROGRESS_POLL_SECONDS", "10"))
+
+PROGRESS_FILE = "index-progress.json"
+
+# TOC entry of pg_restore --list: "215; 1259 16390 INDEX public orders_idx postgres"
+TOC_RE = re.compile(r'^(?P<dump_id>\d+);\s+\d+\s+\d+\s+(?P<entry>.+)$')
+
+# Object types of the post-data section, multi-word ones first
+POST_DATA_TYPES = sorted((
+    "INDEX", "INDEX ATTACH", "CONSTRAINT", "FK CONSTRAINT", "CHECK CONSTRAINT",
+    "TRIGGER", "EVENT TRIGGER", "RULE", "POLICY", "PUBLICATION", "PUBLICATION TABLE",
+    "PUBLICATION TABLES IN SCHEMA", "SUBSCRIPTION", "STATISTICS", "COMMENT", "ACL", "DEFAULT ACL",
+), key=len, reverse=True)
+
+# Builds run in waves: indexes and the constraints backed by them, then the
+# foreign keys that need them, then everything else in archive order
+INDEX_TYPES = ("INDEX", "CONSTRAINT")
+FOREIGN_KEY_TYPES = ("FK CONSTRAINT",)
+
+# Builds are matched by the application_name of their session: index_relid is
+# 0 until the end of builds that are not CONCURRENTLY, which includes those of
+# PRIMARY KEY and UNIQUE constraints
+INDEX_PROGRESS_QUERY = """
+    SELECT a.application_name, p.phase, p.blocks_done, p.blocks_total, p.tuples_done, p.tuples_total
+      FROM pg_stat_progress_create_index p
+      JOIN pg_stat_activity a ON a.pid = p.pid
+     WHERE left(a.application_name, length('{prefix}')) = '{prefix}'
+"""
+
+
+def build_post_data_command(target: str, directory: str, work_dir: str,
+                            index_jobs: Optional[int] = None,
+                            memory_budget_mb: Optional[int] = None,
+                            parallel_maintenance_workers: Optional[int] = None) -> str:
+    """
+    Build command string for a post-data job.
+
+    Args:
+        target: Target database connection string
+        directory: Directory where the dump is located
+        work_dir: Work directory of the job
+        index_jobs: Number of index builds run at the same time
+        memory_budget_mb: maintenance_work_mem shared by the parallel builds
+        parallel_maintenance_workers: max_parallel_maintenance_workers of each build
+
+    Returns:
+        Formatted command string
+    """
+    cmd = (f'python "{os.path.join(API_ROOT, "postdata.py")}" --target "{target}" '
+           f'--dir "{directory}" --work-dir "{work_dir}"')
+    if index_jobs:
+        cmd += f" --index-jobs {index_jobs}"
+    if memory_budget_mb:
+        cmd += f" --memory-budget-mb {memory_budget_mb}"
+    if parallel_maintenance_workers is not None:
+        cmd += f" --parallel-maintenance-workers {parallel_maintenance_workers}"
+    return cmd
+
+
+def get_index_progress(job_id: str) -> Optional[Dict]:
+    """
+    Get the per-index progress written by a running post-data job.
+
+    Args:
+        job_id: ID of the job
+
+    Returns:
+        Progress information or None if the job has none
+    """
+    try:
+        with open(os.path.join(get_job_workdir(job_id), PROGRESS_FILE), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _find_post_data_archive(directory: str, work_dir: str) -> str:
+    """
+    Get the post-data archive of a dump, decompressing it into the work
+    directory if the dump is compressed.
+    """
+    archive = os.path.join(directory, "schema", "post.dump")
+    if os.path.exists(archive):
+        return archive
+    for extension in COMPRESSION_EXTENSIONS.values():
+        if os.path.exists(archive + extension):
+            target = os.path.join(work_dir, "post.dump")
+            decompress_file(archive + extension, target)
+            return target
+    raise Exception(f"No post-data archive found in {directory}")
+
+
+def list_post_data(archive: str) -> List[Dict]:
+    """
+    List the objects of a post-data archive.
+
+    Args:
+        archive: Path to post.dump
+
+    Returns:
+        Archive entries in archive order
+    """
+    result = subprocess.run(["pg_restore", "--list", archive], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise Exception(f"pg_restore --list failed: {result.stderr}")
+
+    items = []
+    for line in result.stdout.splitlines():
+        match = TOC_RE.match(line)
+        if not match:
+            continue
+        entry = match.group("entry")
+        object_type = next((t for t in POST_DATA_TYPES if entry.startswith(t + " ")), entry.split(" ", 1)[0])
+        items.append({
+            "dump_id": match.group("dump_id"),
+            "type": object_type,
+            "name": entry[len(object_type):].strip().rsplit(" ", 1)[0],
+            "toc_line": line,
+        })
+    return items
+
+
+class PostDataRestore:
+    """
+    Restore the post-data section of a dump with its own concurrency and
+    memory budget, building the indexes of the largest tables first.
+    """
+
+    def __init__(self, target: str, directory: str, work_dir: str, index_jobs: int,
+                 memory_budget_mb: int, parallel_maintenance_workers: Optional[int]):
+        self.target = target
+        self.directory = directory
+        self.work_dir = work_dir
+        self.index_jobs = max(index_jobs, 1)
+        self.maintenance_work_mem_mb = max(memory_budget_mb // self.index_jobs, MIN_MAINTENANCE_WORK_MEM_MB)
+        self.parallel_maintenance_workers = parallel_maintenance_workers
+        self.lock = threading.Lock()
+        self.items: List[Dict] = []
+        self.started_at = time.time()
+        self.finished = False
+        # Sessions of each build are named after the job, which runs with PGAPPNAME set to it
+        self.application_name = os.environ.get("PGAPPNAME", JOB_APPLICATION_NAME)
+
+    def _build_application_name(self, item: Dict) -> str:
+        return f"{self.application_name}/{item['dump_id']}"
+
+    def _env(self, item: Dict) -> Dict[str, str]:
+        options = f"-c maintenance_work_mem={self.maintenance_work_mem_mb}MB"
+        if self.parallel_maintenance_workers is not None:
+            options += f" -c max_parallel_maintenance_workers={self.parallel_maintenance_workers}"
+        return {**os.environ, "PGOPTIONS": options, "PGAPPNAME": self._build_application_name(item)}
+
+    def _prepare(self, archive: str, item: Dict) -> None:
+        """
+        Extract the SQL of one archive entry and find the table it belongs to.
+        """
+        list_file = os.path.join(self.work_dir, "sql", f"{item['dump_id']}.list")
+        item["sql_file"] = os.path.join(self.work_dir, "sql", f"{item['dump_id']}.sql")
+        with open(list_file, 'w') as f:
+            f.write(item.pop("toc_line") + "\n")
+
+        result = subprocess.run(
+            ["pg_restore", "--use-list", list_file, "--file", item["sql_file"], archive],
+            capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            raise Exception(f"pg_restore failed on entry {item['dump_id']}: {result.stderr}")
+
+        with open(item["sql_file"], 'r') as f:
+            for line in f:
+                match = CREATE_INDEX_RE.match(line) or ALTER_TABLE_RE.match(line)
+                if match:
+                    item["table"] = normalize_name(match.group("table"))
+                    break
+
+    def save_progress(self) -> None:
+        with self.lock:
+            sized = [i for i in self.items if i["type"] in INDEX_TYPES + FOREIGN_KEY_TYPES]
+            total_bytes = sum(i["bytes"] for i in sized)
+            completed_bytes = sum(i["bytes"] for i in sized if i["state"] == "completed")
+            progress = {
+                "elapsed_seconds": round(time.time() - self.started_at),
+                "finished": self.finished,
+                "index_jobs": self.index_jobs,
+                "maintenance_work_mem_mb": self.maintenance_work_mem_mb,
+                "total": len(self.items),
+                "completed": sum(1 for i in self.items if i["state"] == "completed"),
+                "running": sum(1 for i in self.items if i["state"] == "running"),
+                "failed": sum(1 for i in self.items if i["state"] == "failed"),
+                "total_bytes": total_bytes,
+                "completed_bytes": completed_bytes,
+                "percent": round(100.0 * completed_bytes / total_bytes, 1) if total_bytes else None,
+                "indexes": [
+                    {key: value for key, value in item.items() if key not in ("sql_file", "dump_id")}
+                    for item in self.items
+                ],
+            }
+
+        path = os.path.join(self.work_dir, PROGRESS_FILE)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(progress, f)
+        os.replace(tmp_path, path)
+
+    def _sample_progress(self, stop_event: threading.Event) -> None:
+        """
+        Follow the running builds in pg_stat_progress_create_index.
+        """
+        while not stop_event.wait(PROGRESS_POLL_SECONDS):
+            try:
+                prefix = self.application_name.replace("'", "''") + "/"
+                rows = run_query(self.target, INDEX_PROGRESS_QUERY.format(prefix=prefix))
+            except Exception as e:
+                logger.warning(f"Could not sample index build progress: {str(e)}")
+                rows = []
+
+            building = {}
+            for application_name, phase, blocks_done, blocks_total, tuples_done, tuples_total in rows:
+                done, total = (blocks_done, blocks_total) if int(blocks_total) else (tuples_done, tuples_total)
+                building[application_name] = {
+                    "phase": phase,
+                    "percent": round(100.0 * int(done) / int(total), 1) if int(total) else None,
+                }
+
+            with self.lock:
+                for item in self.items:
+                    if item["state"] == "running":
+                        item.update(building.get(self._build_application_name(item), {}))
+            self.save_progress()
+
+    def _build(self, item: Dict) -> None:
+        process = subprocess.Popen(
+            ["psql", "-X", "-q", "-v", "ON_ERROR_STOP=1", "-d", self.target, "-f", item["sql_file"]],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=self._env(item)
+        )
+        index_name = item["name"].rsplit(" ", 1)[-1]
+        if item["type"] == "INDEX":
+            emit_log_line(process.pid, "INFO", f"CREATE INDEX {index_name} ON {item.get('table')}")
+        elif item.get("table"):
+            emit_log_line(process.pid, "INFO", f"ALTER TABLE {item['table']} ADD {item['type']} {index_name}")
+        else:
+            emit_log_line(process.pid, "INFO", f"Restoring {item['type']} {item['name']}")
+
+        with self.lock:
+            item.update({"state": "running", "started_at": datetime.now().isoformat()})
+            started = time.time()
+
+        output, _ = process.communicate()
+
+        with self.lock:
+            item.update({
+                "state": "completed" if process.returncode == 0 else "failed",
+                "finished_at": datetime.now().isoformat(),
+                "duration_seconds": round(time.time() - started, 1),
+                "percent": 100.0 if process.returncode == 0 else item.get("percent"),
+            })
+            if process.returncode != 0:
+                item["error"] = output.strip()
+        if process.returncode != 0:
+            for line in output.strip().splitlines():
+                emit_log_line(process.pid, "ERROR", line)
+        self.save_progress()
+
+    def _run_wave(self, items: List[Dict], jobs: int) -> None:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            list(executor.map(self._build, items))
+
+    def run(self) -> int:
+        """
+        Restore the post-data section.
+
+        Returns:
+            Exit code: 0 when every object was restored
+        """
+        os.makedirs(os.path.join(self.work_dir, "sql"), exist_ok=True)
+        archive = _find_post_data_archive(self.directory, self.work_dir)
+
+        items = list_post_data(archive)
+        for item in items:
+            self._prepare(archive, item)
+
+        # Index builds cost roughly in proportion to the table they scan
+        table_bytes = {t["name"]: t["bytes"] for t in get_relation_sizes(self.target)["tables"]}
+        for item in items:
+            item.update({"bytes": table_bytes.get(item.get("table"), 0), "state": "pending"})
+
+        indexes = sorted((i for i in items if i["type"] in INDEX_TYPES), key=lambda i: i["bytes"], reverse=True)
+        foreign_keys = sorted((i for i in items if i["type"] in FOREIGN_KEY_TYPES),
+                              key=lambda i: i["bytes"], reverse=True)
+        others = [i for i in items if i["type"] not in INDEX_TYPES + FOREIGN_KEY_TYPES]
+        self.items = indexes + foreign_keys + others
+        self.save_progress()
+
+        stop_event = threading.Event()
+        threading.Thread(target=self._sample_progress, args=(stop_event,), daemon=True).start()
+
+        try:
+            emit_log_line(os.getpid(), "INFO", f"STEP 1: create {len(indexes)} indexes with {self.index_jobs} jobs "
+                          f"and maintenance_work_mem {self.maintenance_work_mem_mb}MB each")
+            self._run_wave(indexes, self.index_jobs)
+            emit_log_line(os.getpid(), "INFO", f"STEP 2: add {len(foreign_keys)} foreign key constraints")
+            self._run_wave(foreign_keys, self.index_jobs)
+            emit_log_line(os.getpid(), "INFO", f"STEP 3: restore the remaining {len(others)} post-data objects")
+            self._run_wave(others, 1)
+        finally:
+            stop_event.set()
+            self.finished = True
+            self.save_progress()
+
+        failed = [i for i in self.items if i["state"] == "failed"]
+        if failed:
+            emit_log_line(os.getpid(), "ERROR", f"{len(failed)} of {len(self.items)} post-data objects failed")
+            return 1
+        emit_log_line(os.getpid(), "INFO", f"Restored {len(self.items)} post-data objects")
+        return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Restore the post-data section of a pgcopydb dump")
+    parser.add_argument("--target", required=True)
+    parser.add_argument("--dir", required=True)
+    parser.add_argument("--work-dir", required=True)
+    parser.add_argument("--index-jobs", type=int, default=DEFAULT_INDEX_JOBS)
+    parser.add_argument("--memory-budget-mb", type=int, default=DEFAULT_MEMORY_BUDGET_MB)
+    parser.add_argument("--parallel-maintenance-workers", type=int, default=None)
+    args = parser.parse_args()
+
+    return PostDataRestore(
+        args.target, args.dir, args.work_dir, args.index_jobs,
+        args.memory_budget_mb, args.parallel_maintenance_workers
+    ).run()
@@ -0,0 +1,409 @@
+import re
+import time
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# Configure logging
+logger = logging.getLogger("pgcopydb-api-progress")
+
+# pgcopydb log line: "13:49:55.180 54652 INFO   COPY "public"."pgbench_accounts""
+LOG_LINE_RE = re.compile(r"^\s*\d{2}:\d{2}:\d{2}(?:\.\d+)?\s+(?P<pid>\d+)\s+(?P<level>[A-Z]+)\s+(?P<message>.*)$")
+# Parts of split tables name their key or CTID range: COPY "public"."orders" WHERE id BETWEEN 1 AND 1000
+COPY_RE = re.compile(r'^COPY\s+(?P<table>"[^"]+"\."[^"]+"|[\w$.]+)(?:\s+(?P<part>WHERE\s.+))?')
+CREATE_INDEXES_RE = re.compile(r'^Creating \d+ indexes for table (?P<table>\S+)')
+CREATE_INDEX_RE = re.compile(
+    r'^CREATE (?:UNIQUE )?INDEX (?:CONCURRENTLY )?(?:IF NOT EXISTS )?(?P<index>\S+) ON (?:ONLY )?(?P<table>\S+)'
+)
+VACUUM_RE = re.compile(r'^VACUUM (?:ANALYZE )?(?P<table>[^\s;]+)')
+
+# Tables smaller than this are dominated by per-table overhead and do not feed the throughput average
+MIN_SAMPLE_BYTES = 1024 * 1024
+
+# Weight of the latest sample in the throughput moving average
+EMA_ALPHA = 0.3
+
+# Number of pending tables reported individually, largest first
+MAX_PENDING_TABLES = 20
+
+# Number of slowest tables reported once the job has finished
+MAX_SLOWEST_TABLES = 20
+
+COPY = "copy"
+INDEX = "index"
+
+# Active trackers by job ID
+trackers: Dict[str, "ProgressTracker"] = {}
+
+
+def normalize_name(name: str) -> str:
+    """
+    Turn a possibly quoted name such as "public"."orders" into public.orders.
+
+    Args:
+        name: Name as printed by pgcopydb
+
+    Returns:
+        Unquoted name
+    """
+    return name.rstrip(";").replace('"', "")
+
+
+class ThroughputEstimator:
+    """Exponentially weighted mean and variance of a throughput in bytes per second."""
+
+    def __init__(self, alpha: float = EMA_ALPHA):
+        self.alpha = alpha
+        self.mean: Optional[float] = None
+        self.variance = 0.0
+        self.samples = 0
+
+    def add(self, value: float) -> None:
+        self.samples += 1
+        if self.mean is None:
+            self.mean = value
+            return
+        diff = value - self.mean
+        increment = self.alpha * diff
+        self.mean += increment
+        self.variance = (1 - self.alpha) * (self.variance + diff * increment)
+
+    @property
+    def stddev(self) -> float:
+        return self.variance ** 0.5
+
+
+class ProgressTracker:
+    """
+    Follow the pgcopydb output stream of a job and estimate its remaining time.
+
+    Each pgcopydb worker process logs the table or index it starts working on,
+    so a task is considered finished when the same worker moves on to its next
+    task, when a later phase starts for the same table, or when the job ends.
+
+    The parts of a split table are tasks of their own, keyed by their range,
+    and each one is credited its share of the table. The table is copied once
+    all the parts of the split plan are; without a plan the number of parts is
+    unknown and the table is only credited once a later phase starts for it.
+    """
+
+    def __init__(self, tables: List[Dict], indexes: List[Dict], split_plan: Optional[Dict] = None):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.items: Dict[str, Dict[str, Dict]] = {
+            COPY: {t["name"]: {"bytes": t["bytes"], "state": "pending"} for t in tables},
+            INDEX: {f"{i['table']}.{i['name']}": {"bytes": i["bytes"], "table": i["table"], "state": "pending"}
+                    for i in indexes},
+        }
+        for split in (split_plan or {}).get("tables", []):
+            if split["name"] in self.items[COPY]:
+                self.items[COPY][split["name"]]["parts"] = split["parts"]
+        self.rates = {COPY: ThroughputEstimator(), INDEX: ThroughputEstimator()}
+        # Task currently handled by each pgcopydb worker process: kind, key and part
+        self.worker_tasks: Dict[str, Tuple[str, str, Optional[str]]] = {}
+
+    def record_line(self, line: str) -> None:
+        """
+        Update progress from one line of pgcopydb output.
+
+        Args:
+            line: Output line
+        """
+        match = LOG_LINE_RE.match(line)
+        if not match:
+            return
+
+        pid = match.group("pid")
+        message = match.group("message").strip()
+        now = time.time()
+
+        with self.lock:
+            copy_match = COPY_RE.match(message)
+            if copy_match:
+                self._start(COPY, normalize_name(copy_match.group("table")), pid, now, part=copy_match.group("part"))
+                return
+
+            index_match = CREATE_INDEX_RE.match(message)
+            if index_match:
+                table = normalize_name(index_match.group("table"))
+                self._finish(COPY, table, now)
+                self._start(INDEX, f"{table}.{normalize_name(index_match.group('index'))}", pid, now, table=table)
+                return
+
+            # Index builds and vacuum of a table only start once its data is copied
+            table_match = CREATE_INDEXES_RE.match(message) or VACUUM_RE.match(message)
+            if table_match:
+                self._finish(COPY, normalize_name(table_match.group("table")), now)
+
+            # Any other activity of an index worker means its previous build is done
+            task = self.worker_tasks.get(pid)
+            if task and task[0] == INDEX and message.startswith(("ALTER TABLE", "Creating", "VACUUM")):
+                self._finish(INDEX, task[1], now)
+                del self.worker_tasks[pid]
+
+    def _start(self, kind: str, key: str, pid: str, now: float, table: Optional[str] = None,
+               part: Optional[str] = None) -> None:
+        previous = self.worker_tasks.get(pid)
+        if previous:
+            self._finish(previous[0], previous[1], now, previous[2])
+
+        item = self.items[kind].setdefault(key, {"bytes": 0, "state": "pending", "table": table})
+        if item["state"] == "pending":
+            item["state"] = "running"
+            item["started_at"] = now
+        if part:
+            part_bytes = item["bytes"] // item["parts"] if item.get("parts") else 0
+            task = item.setdefault("part_tasks", {}).setdefault(part, {"bytes": part_bytes, "state": "pending"})
+            if task["state"] == "pending":
+                task["state"] = "running"
+                task["started_at"] = now
+        self.worker_tasks[pid] = (kind, key, part)
+
+    def _finish(self, kind: str, key: str, now: float, part: Optional[str] = None) -> None:
+        """
+        Mark a task as completed: a part of a split table, or a whole table or
+        index together with its parts still running.
+        """
+        item = self.items[kind].get(key)
+        if not item or item["state"] != "running":
+            return
+
+        part_tasks = item.get("part_tasks", {})
+        if part:
+            task = part_tasks.get(part)
+            if task and task["state"] == "running":
+                self._complete(kind, task, now)
+            done = sum(1 for t in part_tasks.values() if t["state"] == "completed")
+            if not item.get("parts") or done < item["parts"]:
+                return
+        else:
+            for task in part_tasks.values():
+                if task["state"] == "running":
+                    self._complete(kind, task, now)
+
+        if part_tasks:
+            # Throughput was sampled on each part
+            item["state"] = "completed"
+            item["finished_at"] = now
+        else:
+            self._complete(kind, item, now)
+
+    def _complete(self, kind: str, item: Dict, now: float) -> None:
+        item["state"] = "completed"
+        item["finished_at"] = now
+        duration = now - item["started_at"]
+        if item["bytes"] >= MIN_SAMPLE_BYTES and duration > 0:
+            self.rates[kind].add(item["bytes"] / duration)
+
+    def _tasks(self, kind: str) -> List[Dict]:
+        """
+        Get the tasks of a phase: the parts of split tables and every other item.
+        """
+        tasks = []
+        for item in self.items[kind].values():
+            tasks.extend(item["part_tasks"].values() if item.get("part_tasks") else [item])
+        return tasks
+
+    @staticmethod
+    def _completed_bytes(item: Dict) -> int:
+        if item["state"] == "completed":
+            return item["bytes"]
+        return sum(t["bytes"] for t in item.get("part_tasks", {}).values() if t["state"] == "completed")
+
+    def finish(self) -> None:
+        """
+        Mark every task still running as completed when the job ends.
+        """
+        now = time.time()
+        with self.lock:
+            for kind, items in self.items.items():
+                for key in list(items):
+                    self._finish(kind, key, now)
+            self.worker_tasks.clear()
+            self.finished_at = now
+
+    def _phase_summary(self, kind: str, now: float) -> Dict:
+        items = self.items[kind].values()
+        rate = self.rates[kind]
+        running = [i for i in items if i["state"] == "running"]
+        running_tasks = [t for t in self._tasks(kind) if t["state"] == "running"]
+        total_bytes = sum(i["bytes"] for i in items)
+        completed_bytes = sum(self._completed_bytes(i) for i in items)
+
+        started = [i["started_at"] for i in items if "started_at" in i]
+        finished = [i["finished_at"] for i in items if "finished_at" in i]
+
+        summary = {
+            "duration_seconds": round(max(finished + [now if running else 0]) - min(started)) if started else None,
+            "total": len(self.items[kind]),
+            "completed": sum(1 for i in items if i["state"] == "completed"),
+            "running": len(running),
+            "total_bytes": total_bytes,
+            "completed_bytes": completed_bytes,
+            "throughput_bytes_per_second": round(rate.mean) if rate.mean else None,
+            "eta_seconds": None,
+            "eta_low_seconds": None,
+            "eta_high_seconds": None,
+        }
+        if not rate.mean:
+            return summary
+
+        # Assume running tasks have progressed at the average per-worker throughput
+        in_flight = sum(min(t["bytes"], (now - t["started_at"]) * rate.mean) for t in running_tasks)
+        remaining = max(total_bytes - completed_bytes - in_flight, 0)
+        workers = max(len(running_tasks), 1)
+
+        # Confidence band of one standard deviation around the moving average,
+        # never assuming less than a quarter of the average throughput
+        fast = rate.mean + rate.stddev
+        slow = max(rate.mean - rate.stddev, rate.mean / 4)
+        summary["eta_seconds"] = round(remaining / (workers * rate.mean))
+        summary["eta_low_seconds"] = round(remaining / (workers * fast))
+        summary["eta_high_seconds"] = round(remaining / (workers * slow))
+        return summary
+
+    def summary(self) -> Dict:
+        """
+        Get the progress of the job with per-phase and overall estimates.
+
+        Returns:
+            Dictionary with progress information
+        """
+        with self.lock:
+            now = self.finished_at or time.time()
+            copy_phase = self._phase_summary(COPY, now)
+            index_phase = self._phase_summary(INDEX, now)
+            copy_rate = self.rates[COPY].mean
+
+            tables = []
+            pending = []
+            for name, item in self.items[COPY].items():
+                entry = {"name": name, "bytes": item["bytes"], "state": item["state"]}
+                part_tasks = item.get("part_tasks")
+                if part_tasks:
+                    entry["parts"] = item.get("parts")
+                    entry["completed_parts"] = sum(1 for t in part_tasks.values() if t["state"] == "completed")
+                    entry["completed_bytes"] = self._completed_bytes(item)
+                if item["state"] == "running":
+                    entry["elapsed_seconds"] = round(now - item["started_at"])
+                    if copy_rate and part_tasks:
+                        # The remaining parts are copied by the workers on the table
+                        running_parts = [t for t in part_tasks.values() if t["state"] == "running"]
+                        in_flight = sum(min(t["bytes"], (now - t["started_at"]) * copy_rate) for t in running_parts)
+                        remaining = max(item["bytes"] - entry["completed_bytes"] - in_flight, 0)
+                        entry["eta_seconds"] = round(remaining / (max(len(running_parts), 1) * copy_rate))
+                    elif copy_rate:
+                        entry["eta_seconds"] = max(round(item["bytes"] / copy_rate - entry["elapsed_seconds"]), 0)
+                    tables.append(entry)
+                elif item["state"] == "pending":
+                    if copy_rate:
+                        entry["eta_seconds"] = round(item["bytes"] / copy_rate)
+                    pending.append(entry)
+            pending.sort(key=lambda t: t["bytes"], reverse=True)
+            tables.extend(pending[:MAX_PENDING_TABLES])
+
+            if self.finished_at:
+                completed = [
+                    {"name": name, "bytes": item["bytes"], "seconds": round(item["finished_at"] - item["started_at"], 1)}
+                    for name, item in self.items[COPY].items() if item["state"] == "completed"
+                ]
+                completed.sort(key=lambda t: t["seconds"], reverse=True)
+
+            total_bytes = copy_phase["total_bytes"] + index_phase["total_bytes"]
+            completed_bytes = copy_phase["completed_bytes"] + index_phase["completed_bytes"]
+            progress = {
+                "elapsed_seconds": round(now - self.started_at),
+                "total_bytes": total_bytes,
+                "completed_bytes": completed_bytes,
+                "percent": round(100.0 * completed_bytes / total_bytes, 1) if total_bytes else None,
+                "copy": copy_phase,
+                "index": index_phase,
+                "tables": tables,
+            }
+            if self.finished_at:
+                progress["slowest_tables"] = completed[:MAX_SLOWEST_TABLES]
+
+            # Index builds overlap with the COPY phase, but the indexes of the
+            # last tables can only be built once their data is in
+            if copy_phase["eta_seconds"] is not None:
+                index_rate = self.rates[INDEX].mean
+                unfinished = {i["table"] for i in self.items[INDEX].values() if i["state"] != "completed"}
+                tail = 0
+                if index_rate:
+                    remaining_tables = [n for n, i in self.items[COPY].items() if i["state"] != "completed"]
+                    tail_bytes = max(
+                        (sum(i["bytes"] for i in self.items[INDEX].values() if i["table"] == t)
+                         for t in remaining_tables if t in unfinished),
+                        default=0
+                    )
+                    tail = tail_bytes / index_rate
+                for bound in ("eta_seconds", "eta_low_seconds", "eta_high_seconds"):
+                    progress[bound] = max(round(copy_phase[bound] + tail), index_phase[bound] or 0)
+            else:
+                progress["eta_seconds"] = progress["eta_low_seconds"] = progress["eta_high_seconds"] = None
+
+            return progress
+
+
+def start_progress(job_id: str, tables: List[Dict], indexes: List[Dict],
+                   split_plan: Optional[Dict] = None) -> ProgressTracker:
+    """
+    Start tracking the progress of a job.
+
+    Args:
+        job_id: ID of the job
+        tables: Tables to move, with their size in bytes
+        indexes: Indexes to build, with their size in bytes
+        split_plan: Table splits of the job, if any
+
+    Returns:
+        Progress tracker of the job
+    """
+    tracker = ProgressTracker(tables, indexes, split_plan)
+    trackers[job_id] = tracker
+    return tracker
+
+
+def record_output(job_id: str, line: str) -> None:
+    """
+    Feed a line of job output to the progress tracker of the job, if any.
+
+    Args:
+        job_id: ID of the job
+        line: Output line
+    """
+    tracker = trackers.get(job_id)
+    if tracker:
+        tracker.record_line(line)
+
+
+def get_progress(job_id: str) -> Optional[Dict]:
+    """
+    Get the current progress of a job.
+
+    Args:
+        job_id: ID of the job
+
+    Returns:
+        Progress information or None if the job is not tracked
+    """
+    tracker = trackers.get(job_id)
+    return tracker.summary() if tracker else None
+
+
+def finish_progress(job_id: str) -> Optional[Dict]:
+    """
+    Stop tracking a job and return its final progress.
+
+    Args:
+        job_id: ID of the job
+
+    Returns:
+        Final progress information or None if the job was not tracked
+    """
+    tracker = trackers.pop(job_id, None)
+    if not tracker:
+        return None
+    tracker.finish()
+    return tracker.summary()
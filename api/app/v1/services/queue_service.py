@@ -0,0 +1,419 @@
+import os
+import json
+import time
+import uuid
+import socket
+import logging
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Set
+
+from app.utils.command import get_log_directory
+
+# Configure logging
+logger = logging.getLogger("pgcopydb-api-queue")
+
+# Queue backend: "local" runs jobs on the replica that received them,
+# "shared" places them in a directory on the shared PVC where any replica can claim them
+QUEUE_BACKEND = os.environ.get("JOB_QUEUE_BACKEND", "local")
+
+# Maximum number of jobs a replica runs at the same time before it stops claiming work
+MAX_CONCURRENT_JOBS = int(os.environ.get("MAX_CONCURRENT_JOBS", "2"))
+
+# A claimed job whose lease has not been renewed for this long is considered orphaned
+LEASE_TIMEOUT_SECONDS = int(os.environ.get("JOB_LEASE_TIMEOUT_SECONDS", "90"))
+HEARTBEAT_INTERVAL_SECONDS = int(os.environ.get("JOB_HEARTBEAT_INTERVAL_SECONDS", "15"))
+POLL_INTERVAL_SECONDS = int(os.environ.get("JOB_POLL_INTERVAL_SECONDS", "5"))
+
+WORKER_ID = os.environ.get("POD_NAME", socket.gethostname())
+
+PENDING = "pending"
+CLAIMED = "claimed"
+DONE = "done"
+
+# Jobs currently leased by this replica
+_leased_jobs: Dict[str, str] = {}
+_leased_lock = threading.Lock()
+
+# ID of each lease held by this replica by job ID, and the leases it lost; a job
+# claimed again gets a new lease ID, so the run that lost the old one still knows
+_lease_ids: Dict[str, str] = {}
+_lost_leases: Set[str] = set()
+
+
+def get_queue_directory() -> str:
+    """
+    Get the directory holding the shared job queue.
+
+    Returns:
+        Path to queue directory
+    """
+    base_dir = "/app/pgcopydb_files/queue" if os.path.exists("/app/pgcopydb_files") else "/tmp/queue"
+    for state in (PENDING, CLAIMED, DONE):
+        os.makedirs(os.path.join(base_dir, state), exist_ok=True)
+    return base_dir
+
+
+def _write_json_atomic(path: str, data: Dict) -> None:
+    """
+    Write a JSON document so that readers never observe a partial file.
+
+    Args:
+        path: Destination path
+        data: Document to write
+    """
+    tmp_path = f"{path}.{WORKER_ID}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: str) -> Optional[Dict]:
+    """
+    Read a JSON document, returning None if it vanished or is unreadable.
+
+    Args:
+        path: Path to read
+
+    Returns:
+        Parsed document or None
+    """
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _claimed_path(job_id: str, worker_id: str) -> str:
+    return os.path.join(get_queue_directory(), CLAIMED, f"{job_id}.{worker_id}.json")
+
+
+def _find_claimed(job_id: str) -> Optional[str]:
+    """
+    Find the lease file of a claimed job, whichever replica owns it.
+
+    Args:
+        job_id: ID of the job
+
+    Returns:
+        Path to the lease file or None
+    """
+    claimed_dir = os.path.join(get_queue_directory(), CLAIMED)
+    prefix = f"{job_id}."
+    for name in os.listdir(claimed_dir):
+        if name.startswith(prefix) and name.endswith(".json"):
+            return os.path.join(claimed_dir, name)
+    return None
+
+
+def enqueue_job(job_id: str, cmd: str, metadata: Optional[Dict] = None) -> Dict:
+    """
+    Add a job to the shared queue.
+
+    Args:
+        job_id: Unique identifier for the job
+        cmd: Command to be executed
+        metadata: Additional job information passed to the executor
+
+    Returns:
+        Dictionary with initial job status
+    """
+    record = {
+        "job_id": job_id,
+        "command": cmd,
+        "metadata": metadata or {},
+        "submitted_by": WORKER_ID,
+        "submitted_at": datetime.now().isoformat(),
+    }
+    _write_json_atomic(os.path.join(get_queue_directory(), PENDING, f"{job_id}.json"), record)
+    logger.info(f"Job {job_id} queued by {WORKER_ID}")
+
+    return {
+        "status": "queued",
+        "command": cmd,
+        "finished": False
+    }
+
+
+def _waits_for_schedule(metadata: Dict) -> bool:
+    """
+    Check whether a pending job has to stay pending: its start time has not
+    come, or the job it follows is still pending or running.
+
+    Args:
+        metadata: Job information with the optional "not_before" timestamp and "after_job" ID
+
+    Returns:
+        True if the job must not be claimed yet
+    """
+    if (metadata.get("not_before") or 0) > time.time():
+        return True
+    after_job = metadata.get("after_job")
+    if after_job:
+        pending_path = os.path.join(get_queue_directory(), PENDING, f"{after_job}.json")
+        return os.path.exists(pending_path) or _find_claimed(after_job) is not None
+    return False
+
+
+def claim_next_job() -> Optional[Dict]:
+    """
+    Claim the oldest pending job for this replica.
+
+    The claim is an atomic rename from ``pending/`` to ``claimed/``, so when several
+    replicas race for the same job exactly one of them wins. The lease file name
+    carries the owner and its mtime acts as the heartbeat.
+
+    Returns:
+        Job record or None if there is nothing to claim
+    """
+    pending_dir = os.path.join(get_queue_directory(), PENDING)
+
+    try:
+        entries = [e for e in os.scandir(pending_dir) if e.name.endswith(".json")]
+        entries.sort(key=lambda e: e.stat().st_mtime)
+    except FileNotFoundError:
+        return None
+
+    for entry in entries:
+        job_id = entry.name[:-len(".json")]
+        # Scheduled jobs stay pending, and claimable by any replica, until they are due,
+        # so they do not hold a slot of MAX_CONCURRENT_JOBS while they wait
+        pending = _read_json(entry.path)
+        if pending and _waits_for_schedule(pending.get("metadata", {})):
+            continue
+        claimed_path = _claimed_path(job_id, WORKER_ID)
+        try:
+            # Refresh the mtime first so the lease starts fresh after the rename
+            os.utime(entry.path)
+            os.rename(entry.path, claimed_path)
+        except FileNotFoundError:
+            # Another replica claimed it first
+            continue
+
+        record = _read_json(claimed_path)
+        if record is None:
+            continue
+
+        lease_id = str(uuid.uuid4())
+        with _leased_lock:
+            _leased_jobs[job_id] = claimed_path
+            _lease_ids[job_id] = lease_id
+        record.setdefault("metadata", {})["lease_id"] = lease_id
+        logger.info(f"Job {job_id} claimed by {WORKER_ID}")
+        return record
+
+    return None
+
+
+def renew_leases() -> List[str]:
+    """
+    Renew the leases of all jobs owned by this replica.
+
+    Returns:
+        List of job IDs whose lease was lost (reclaimed by another replica)
+    """
+    lost = []
+    with _leased_lock:
+        for job_id, claimed_path in list(_leased_jobs.items()):
+            try:
+                os.utime(claimed_path)
+            except FileNotFoundError:
+                logger.warning(f"Lease for job {job_id} was lost")
+                lost.append(job_id)
+                del _leased_jobs[job_id]
+                _lost_leases.add(_lease_ids.pop(job_id, None))
+    return lost
+
+
+def is_lease_lost(lease_id: Optional[str]) -> bool:
+    """
+    Check whether this replica lost a lease it held, so that another
+    replica is running the job again.
+
+    Args:
+        lease_id: ID of the lease, as given to the job in its metadata
+
+    Returns:
+        True if the lease was lost, False for jobs not run from the shared queue
+    """
+    with _leased_lock:
+        return lease_id is not None and lease_id in _lost_leases
+
+
+def complete_job(job_id: str, result: Dict, lease_id: Optional[str] = None) -> None:
+    """
+    Record the final result of a claimed job and release its lease.
+
+    Nothing is recorded when the lease was lost: another replica is running
+    the job again and will record its result.
+
+    Args:
+        job_id: ID of the job
+        result: Final job status information
+        lease_id: ID of the lease the job ran under
+    """
+    with _leased_lock:
+        _lost_leases.discard(lease_id)
+        if lease_id is not None and _lease_ids.get(job_id) != lease_id:
+            # Lost, and possibly claimed again by this replica under a new lease
+            claimed_path = None
+        else:
+            claimed_path = _leased_jobs.pop(job_id, None)
+            _lease_ids.pop(job_id, None)
+
+    # The claim file only exists while this replica still owns the job
+    record = _read_json(claimed_path) if claimed_path else None
+    if record is None:
+        logger.warning(f"Not recording the result of job {job_id}, its lease was lost")
+        return
+    record.update({
+        "result": result,
+        "owner": WORKER_ID,
+        "finished_at": datetime.now().isoformat(),
+    })
+    _write_json_atomic(os.path.join(get_queue_directory(), DONE, f"{job_id}.json"), record)
+
+    try:
+        os.remove(claimed_path)
+    except FileNotFoundError:
+        logger.warning(f"Lease file for job {job_id} disappeared before completion")
+
+
+def reclaim_expired_leases() -> List[str]:
+    """
+    Return jobs whose owner stopped heartbeating to the pending queue.
+
+    Returns:
+        List of reclaimed job IDs
+    """
+    claimed_dir = os.path.join(get_queue_directory(), CLAIMED)
+    pending_dir = os.path.join(get_queue_directory(), PENDING)
+    now = time.time()
+    reclaimed = []
+
+    for entry in os.scandir(claimed_dir):
+        if not entry.name.endswith(".json"):
+            continue
+        try:
+            if now - entry.stat().st_mtime < LEASE_TIMEOUT_SECONDS:
+                continue
+            job_id = entry.name.split(".", 1)[0]
+            os.rename(entry.path, os.path.join(pending_dir, f"{job_id}.json"))
+        except FileNotFoundError:
+            continue
+        logger.warning(f"Reclaimed job {job_id} from expired lease {entry.name}")
+        reclaimed.append(job_id)
+
+    return reclaimed
+
+
+def get_queued_job(job_id: str) -> Optional[Dict]:
+    """
+    Get the status of a job from the shared queue.
+
+    Args:
+        job_id: ID of the job
+
+    Returns:
+        Dictionary with job status information or None
+    """
+    queue_dir = get_queue_directory()
+
+    record = _read_json(os.path.join(queue_dir, DONE, f"{job_id}.json"))
+    if record:
+        return {"command": record.get("command", ""), **record.get("result", {})}
+
+    claimed_path = _find_claimed(job_id)
+    if claimed_path:
+        record = _read_json(claimed_path)
+        if record:
+            owner = os.path.basename(claimed_path)[len(job_id) + 1:-len(".json")]
+            return {
+                "status": "running",
+                "command": record["command"],
+                "finished": False,
+                "worker": owner,
+                "log_file": f"{get_log_directory()}/job-{job_id}.log"
+            }
+
+    record = _read_json(os.path.join(queue_dir, PENDING, f"{job_id}.json"))
+    if record:
+        metadata = record.get("metadata", {})
+        return {
+            "status": "scheduled" if metadata.get("not_before") or metadata.get("after_job") else "queued",
+            "command": record["command"],
+            "finished": False
+        }
+
+    return None
+
+
+def queue_worker_loop(execute: Callable[[str, str, Dict], Dict],
+                      terminate: Callable[[str], None],
+                      stop_event: threading.Event) -> None:
+    """
+    Claim and execute jobs from the shared queue until stopped.
+
+    Args:
+        execute: Function running a job and returning its final status
+        terminate: Function stopping a job whose lease was lost
+        stop_event: Event that ends the loop when set
+    """
+    def run(record: Dict) -> None:
+        job_id = record["job_id"]
+        metadata = record.get("metadata", {})
+        try:
+            result = execute(job_id, record["command"], metadata)
+        except Exception as e:
+            logger.exception(f"Exception running queued job {job_id}")
+            result = {"status": "error", "command": record["command"], "error": str(e), "finished": True}
+        complete_job(job_id, result, metadata.get("lease_id"))
+
+    def heartbeat() -> None:
+        while not stop_event.wait(HEARTBEAT_INTERVAL_SECONDS):
+            for job_id in renew_leases():
+                # Another replica owns the job now, do not let it run twice
+                terminate(job_id)
+
+    threading.Thread(target=heartbeat, name="queue-heartbeat", daemon=True).start()
+    logger.info(f"Queue worker {WORKER_ID} started (max {MAX_CONCURRENT_JOBS} concurrent jobs)")
+
+    while not stop_event.is_set():
+        try:
+            reclaim_expired_leases()
+
+            with _leased_lock:
+                busy = len(_leased_jobs) >= MAX_CONCURRENT_JOBS
+
+            record = None if busy else claim_next_job()
+            if record:
+                threading.Thread(target=run, args=(record,), name=f"job-{record['job_id']}", daemon=True).start()
+                # Look for more work straight away while there is capacity
+                continue
+        except Exception:
+            logger.exception("Error in queue worker loop")
+
+        stop_event.wait(POLL_INTERVAL_SECONDS)
+
+
+def start_queue_worker(execute: Callable[[str, str, Dict], Dict],
+                       terminate: Callable[[str], None]) -> threading.Event:
+    """
+    Start the shared queue worker in a background thread.
+
+    Args:
+        execute: Function running a job and returning its final status
+        terminate: Function stopping a job whose lease was lost
+
+    Returns:
+        Event that stops the worker when set
+    """
+    stop_event = threading.Event()
+    threading.Thread(
+        target=queue_worker_loop,
+        args=(execute, terminate, stop_event),
+        name="queue-worker",
+        daemon=True
+    ).start()
+    return stop_event
@@ -0,0 +1,236 @@
+import os
+import sys
+import secrets
+import time
+import logging
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import Client, Listener, Connection
+from typing import Any
+
+# Configure logging
+logger = logging.getLogger("pgcopydb-api-runner")
+
+# Runner mode: "inline" supervises jobs inside the API process,
+# "process" hands them to a separate supervisor process
+RUNNER_MODE = os.environ.get("JOB_RUNNER_MODE", "inline")
+
+# Unix socket used to talk to the supervisor, kept on the pod's local filesystem
+RUNNER_SOCKET = os.environ.get("JOB_RUNNER_SOCKET", "/tmp/pgcopydb-runner.sock")
+
+# Key authenticating the API to the supervisor; without one configured, a random
+# key is generated in a file only the pod's user can read
+RUNNER_AUTHKEY = os.environ.get("JOB_RUNNER_AUTHKEY")
+RUNNER_AUTHKEY_FILE = os.environ.get("JOB_RUNNER_AUTHKEY_FILE", f"{RUNNER_SOCKET}.key")
+
+# Number of jobs the supervisor runs at the same time, further jobs wait in its queue
+RUNNER_POOL_SIZE = int(os.environ.get("JOB_RUNNER_POOL_SIZE", "4"))
+RUNNER_START_TIMEOUT_SECONDS = int(os.environ.get("JOB_RUNNER_START_TIMEOUT_SECONDS", "10"))
+
+# Directory containing runner.py
+API_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", ".."))
+
+_start_lock = threading.Lock()
+
+# Set in the supervisor process itself, which must never delegate to another runner
+_in_runner = False
+
+
+def use_runner() -> bool:
+    """
+    Check whether jobs should be delegated to the supervisor process.
+
+    Returns:
+        True when running in the API with the "process" runner mode
+    """
+    return RUNNER_MODE == "process" and not _in_runner
+
+
+def get_runner_authkey() -> bytes:
+    """
+    Get the key authenticating the API to the supervisor process.
+
+    Returns:
+        JOB_RUNNER_AUTHKEY if configured, otherwise the key in RUNNER_AUTHKEY_FILE,
+        created on first use
+    """
+    if RUNNER_AUTHKEY:
+        return RUNNER_AUTHKEY.encode()
+    if not os.path.exists(RUNNER_AUTHKEY_FILE):
+        tmp_path = f"{RUNNER_AUTHKEY_FILE}.{os.getpid()}"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(secrets.token_hex(32))
+        try:
+            # When the API and the supervisor race, both end up with the first key linked
+            os.link(tmp_path, RUNNER_AUTHKEY_FILE)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+    with open(RUNNER_AUTHKEY_FILE, 'r') as f:
+        return f.read().strip().encode()
+
+
+def _connect() -> Connection:
+    return Client(RUNNER_SOCKET, family="AF_UNIX", authkey=get_runner_authkey())
+
+
+def is_runner_alive() -> bool:
+    """
+    Check whether a supervisor process is accepting connections.
+
+    Returns:
+        True if the supervisor answered
+    """
+    try:
+        with _connect() as conn:
+            conn.send({"op": "ping"})
+            return conn.recv().get("ok", False)
+    except (OSError, EOFError):
+        return False
+
+
+def ensure_runner() -> None:
+    """
+    Start the supervisor process if it is not running.
+
+    The supervisor is started in its own session, so restarting the API
+    process does not take the running jobs down with it.
+    """
+    with _start_lock:
+        if is_runner_alive():
+            return
+
+        logger.info("Starting job runner process")
+        subprocess.Popen(
+            [sys.executable, "runner.py"],
+            cwd=API_ROOT,
+            stdin=subprocess.DEVNULL,
+            start_new_session=True
+        )
+
+        deadline = time.time() + RUNNER_START_TIMEOUT_SECONDS
+        while time.time() < deadline:
+            if is_runner_alive():
+                return
+            time.sleep(0.2)
+
+        raise Exception("Job runner process did not start")
+
+
+def runner_request(op: str, **payload: Any) -> Any:
+    """
+    Send a request to the supervisor process and return its result.
+
+    Args:
+        op: Operation name ("submit", "status", "terminate" or "ping")
+        payload: Operation arguments
+
+    Returns:
+        Result returned by the supervisor
+    """
+    try:
+        conn = _connect()
+    except (FileNotFoundError, ConnectionRefusedError):
+        ensure_runner()
+        conn = _connect()
+
+    try:
+        with conn:
+            conn.send({"op": op, **payload})
+            reply = conn.recv()
+    except (EOFError, ConnectionError) as e:
+        # The supervisor died while answering; the next request starts a new one
+        raise Exception(f"Job runner process is not available: {str(e) or type(e).__name__}")
+
+    if not reply.get("ok"):
+        raise Exception(reply.get("error", "Job runner request failed"))
+    return reply.get("result")
+
+
+def _handle_connection(conn: Connection, executor: ThreadPoolExecutor) -> None:
+    """
+    Answer a single request from the API.
+
+    Args:
+        conn: Accepted connection
+        executor: Pool running the jobs
+    """
+    from app.v1.services.job_service import (
+        init_job, run_command_background, get_job_status, terminate_job, processes,
+        is_scheduled, schedule_job
+    )
+
+    with conn:
+        try:
+            message = conn.recv()
+            op = message.get("op")
+
+            if op == "submit":
+                job_id, cmd, metadata = message["job_id"], message["cmd"], message.get("metadata")
+                if is_scheduled(metadata):
+                    # Scheduled jobs only take a pool worker once they are due
+                    job_status = schedule_job(job_id, cmd, metadata, lambda: executor.submit(
+                        run_command_background, job_id, cmd, metadata
+                    ))
+                else:
+                    job_status = init_job(job_id, cmd, status="queued")
+                    executor.submit(run_command_background, job_id, cmd, metadata)
+                result = dict(job_status)
+            elif op == "status":
+                result = get_job_status(message["job_id"])
+            elif op == "terminate":
+                terminate_job(message["job_id"])
+                result = None
+            elif op == "ping":
+                result = {"pid": os.getpid(), "running": len(processes)}
+            else:
+                raise ValueError(f"Unknown operation {op}")
+
+            conn.send({"ok": True, "result": result})
+        except EOFError:
+            pass
+        except Exception as e:
+            logger.exception("Error handling job runner request")
+            try:
+                conn.send({"ok": False, "error": str(e)})
+            except OSError:
+                pass
+
+
+def serve() -> None:
+    """
+    Run the supervisor: own the pgcopydb child processes and their log fan-out,
+    and answer requests from the API over the runner socket.
+    """
+    from app.v1.services.queue_service import QUEUE_BACKEND, start_queue_worker
+    from app.v1.services.job_service import run_command_background, terminate_job
+
+    global _in_runner
+    _in_runner = True
+
+    if is_runner_alive():
+        logger.info("Job runner already running, exiting")
+        return
+
+    # Remove a socket left behind by a supervisor that died
+    if os.path.exists(RUNNER_SOCKET):
+        os.remove(RUNNER_SOCKET)
+
+    executor = ThreadPoolExecutor(max_workers=RUNNER_POOL_SIZE, thread_name_prefix="job")
+
+    # With the shared queue the supervisor, not the API, claims and heartbeats jobs
+    if QUEUE_BACKEND == "shared":
+        start_queue_worker(run_command_background, terminate_job)
+
+    with Listener(RUNNER_SOCKET, family="AF_UNIX", authkey=get_runner_authkey()) as listener:
+        logger.info(f"Job runner {os.getpid()} listening on {RUNNER_SOCKET} with {RUNNER_POOL_SIZE} workers")
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception:
+                logger.exception("Error accepting job runner connection")
+                continue
+            threading.Thread(target=_handle_connection, args=(conn, executor), daemon=True).start()
@@ -0,0 +1,511 @@
+import os
+import re
+import json
+import time
+import shlex
+import argparse
+import logging
+import threading
+import subprocess
+from collections import deque
+from datetime import datetime
+from math import ceil
+from typing import Dict, List, Optional, Tuple
+
+from app.utils.command import get_log_directory, emit_log_line
+from app.v1.services.pgcopydb_service import (
+    run_query, with_database, get_relation_sizes, build_clone_command, build_copy_roles_command
+)
+from app.v1.services.progress_service import start_progress, record_output, get_progress, finish_progress
+from app.v1.services.planner_service import (
+    PGCOPYDB_DEFAULT_TABLE_JOBS, SPLIT_MIN_PART_BYTES, prepare_table_splits, record_job_throughput,
+    estimate_workdir_bytes
+)
+from app.v1.services.history_service import record_job_history
+from app.v1.services.log_service import StructuredJobLog
+from app.v1.services.job_store_service import JobRecord, save_job_summary
+from app.v1.services.storage_service import get_job_workdir, wait_for_storage, release_storage
+from app.v1.services.runner_service import API_ROOT
+
+# Configure logging
+logger = logging.getLogger("pgcopydb-api-server-clone")
+
+# Defaults of the caps shared by all the databases cloned at the same time
+DEFAULT_MAX_PROCESSES = int(os.environ.get("SERVER_CLONE_MAX_PROCESSES", "32"))
+DEFAULT_MAX_CONNECTIONS = int(os.environ.get("SERVER_CLONE_MAX_CONNECTIONS", "40"))
+
+# Number of CREATE INDEX processes pgcopydb starts when --index-jobs is not given
+PGCOPYDB_DEFAULT_INDEX_JOBS = 4
+
+# Large object workers of each database, passed explicitly so the connection caps can count them
+LARGE_OBJECTS_JOBS = int(os.environ.get("SERVER_CLONE_LARGE_OBJECTS_JOBS", "1"))
+
+# Databases of the managed service itself, never cloned
+SYSTEM_DATABASES = ("azure_maintenance", "azure_sys")
+
+# How often the per-database progress is written while databases are cloned
+PROGRESS_SAVE_SECONDS = int(os.environ.get("SERVER_CLONE_PROGRESS_SAVE_SECONDS", "10"))
+
+PROGRESS_FILE = "databases.json"
+
+DATABASES_QUERY = """
+    SELECT d.datname, pg_database_size(d.oid), pg_get_userbyid(d.datdba)
+      FROM pg_database d
+     WHERE d.datallowconn
+       AND NOT d.datistemplate
+     ORDER BY pg_database_size(d.oid) DESC
+"""
+
+
+def build_server_clone_command(job_id: str, source: str, target: str, work_dir: str,
+                               databases: Optional[List[str]] = None,
+                               exclude_databases: Optional[List[str]] = None,
+                               table_jobs: Optional[int] = None,
+                               index_jobs: Optional[int] = None,
+                               max_processes: Optional[int] = None,
+                               max_connections: Optional[int] = None,
+                               skip_roles: bool = False,
+                               no_role_passwords: bool = False,
+                               split_tables: bool = True,
+                               options: Optional[List[str]] = None) -> str:
+    """
+    Build command string for a server clone job.
+
+    Args:
+        job_id: ID of the job, the databases are cloned as sub-jobs of it
+        source: Connection string of any database of the source server
+        target: Connection string of any database of the target server
+        work_dir: Work directory of the job
+        databases: Only clone these databases
+        exclude_databases: Databases not to clone
+        table_jobs: COPY processes of the largest databases
+        index_jobs: CREATE INDEX processes of the largest databases
+        max_processes: Cap on the pgcopydb processes of all the databases cloned at once
+        max_connections: Cap on the connections to either server of all the databases cloned at once
+        skip_roles: Do not copy the roles
+        no_role_passwords: Copy the roles without their passwords
+        split_tables: Split the largest tables of each database
+        options: Additional options for each pgcopydb clone
+
+    Returns:
+        Formatted command string
+    """
+    cmd = (f'python "{os.path.join(API_ROOT, "serverclone.py")}" --job-id {job_id} '
+           f'--source "{source}" --target "{target}" --work-dir "{work_dir}"')
+    for database in databases or []:
+        cmd += f" --database {shlex.quote(database)}"
+    for database in exclude_databases or []:
+        cmd += f" --exclude-database {shlex.quote(database)}"
+    if table_jobs:
+        cmd += f" --table-jobs {table_jobs}"
+    if index_jobs:
+        cmd += f" --index-jobs {index_jobs}"
+    if max_processes:
+        cmd += f" --max-processes {max_processes}"
+    if max_connections:
+        cmd += f" --max-connections {max_connections}"
+    if skip_roles:
+        cmd += " --skip-roles"
+    if no_role_passwords:
+        cmd += " --no-role-passwords"
+    if not split_tables:
+        cmd += " --no-split-tables"
+    for option in options or []:
+        cmd += f" --option={shlex.quote(option)}"
+    return cmd
+
+
+def get_database_progress(job_id: str) -> Optional[Dict]:
+    """
+    Get the per-database progress written by a running server clone job.
+
+    Args:
+        job_id: ID of the job
+
+    Returns:
+        Progress information or None if the job has none
+    """
+    try:
+        with open(os.path.join(get_job_workdir(job_id), PROGRESS_FILE), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def list_databases(source: str, databases: Optional[List[str]] = None,
+                   exclude_databases: Optional[List[str]] = None) -> List[Dict]:
+    """
+    List the databases of a server, largest first.
+
+    Args:
+        source: Connection string of any database of the server
+        databases: Only include these databases
+        exclude_databases: Databases to leave out, besides the system ones
+
+    Returns:
+        Databases with their size in bytes and owner
+    """
+    excluded = set(SYSTEM_DATABASES) | set(exclude_databases or [])
+    found = [
+        {"name": name, "bytes": int(size), "owner": owner}
+        for name, size, owner in run_query(source, DATABASES_QUERY)
+        if name not in excluded and (not databases or name in databases)
+    ]
+    missing = set(databases or []) - {d["name"] for d in found}
+    if missing:
+        raise Exception(f"Databases not found on the source: {', '.join(sorted(missing))}")
+    return found
+
+
+def database_jobs(size: int, table_jobs: int, index_jobs: int,
+                  max_processes: int, max_connections: int) -> Tuple[int, int]:
+    """
+    Get the COPY and CREATE INDEX processes of one database.
+
+    Small databases get one process per SPLIT_MIN_PART_BYTES of data, so
+    they leave the slots they could not use to the other databases. Every
+    database fits under the caps on its own.
+
+    Returns:
+        Tuple of table jobs and index jobs
+    """
+    workers = max(ceil(size / SPLIT_MIN_PART_BYTES), 1)
+    table_jobs = min(table_jobs, workers)
+    index_jobs = min(index_jobs, workers)
+    while (database_processes(table_jobs, index_jobs) > max_processes or
+           database_connections(table_jobs, index_jobs) > max_connections):
+        if table_jobs == 1 and index_jobs == 1:
+            break
+        if table_jobs >= index_jobs:
+            table_jobs -= 1
+        else:
+            index_jobs -= 1
+    return table_jobs, index_jobs
+
+
+def database_processes(table_jobs: int, index_jobs: int) -> int:
+    """
+    Upper bound of the processes of a pgcopydb clone: one per COPY process
+    and the VACUUM process that follows each of them, one per CREATE INDEX
+    process and large object worker, plus the main process and the
+    supervisor of the workers.
+    """
+    return 2 * table_jobs + index_jobs + LARGE_OBJECTS_JOBS + 2
+
+
+def database_connections(table_jobs: int, index_jobs: int) -> int:
+    """
+    Upper bound of the connections a pgcopydb clone opens to either server:
+    one per COPY process and the VACUUM process that follows each of them,
+    one per CREATE INDEX process and large object worker, plus the snapshot
+    and catalog connections of the main process. The workers do not all
+    run at once, so the actual count usually stays below it.
+    """
+    return 2 * table_jobs + index_jobs + LARGE_OBJECTS_JOBS + 2
+
+
+def _sub_job_id(job_id: str, database: str) -> str:
+    return f"{job_id}-{re.sub(r'[^A-Za-z0-9_.-]', '_', database)}"
+
+
+class ServerClone:
+    """
+    Clone every database of a server: copy the roles once, then clone the
+    databases largest first, as many at a time as the process and
+    connection caps allow.
+    """
+
+    def __init__(self, job_id: str, source: str, target: str, work_dir: str,
+                 databases: Optional[List[str]], exclude_databases: Optional[List[str]],
+                 table_jobs: int, index_jobs: int, max_processes: int, max_connections: int,
+                 skip_roles: bool, no_role_passwords: bool, split_tables: bool, options: List[str]):
+        self.job_id = job_id
+        self.source = source
+        self.target = target
+        self.work_dir = work_dir
+        self.databases = databases
+        self.exclude_databases = exclude_databases
+        self.table_jobs = table_jobs
+        self.index_jobs = index_jobs
+        self.max_processes = max_processes
+        self.max_connections = max_connections
+        self.skip_roles = skip_roles
+        self.no_role_passwords = no_role_passwords
+        self.split_tables = split_tables
+        self.options = options
+        self.condition = threading.Condition()
+        self.items: List[Dict] = []
+        self.processes_in_use = 0
+        self.connections_in_use = 0
+        self.started_at = time.time()
+        self.finished = False
+
+    def save_progress(self) -> None:
+        with self.condition:
+            total_bytes = sum(i["bytes"] for i in self.items)
+            done_bytes = 0
+            databases = []
+            for item in self.items:
+                entry = {k: v for k, v in item.items() if k not in ("owner", "split_plan")}
+                if item["state"] == "running":
+                    progress = get_progress(item["sub_job_id"])
+                    if progress:
+                        entry["percent"] = progress["percent"]
+                        entry["eta_seconds"] = progress.get("eta_seconds")
+                        done_bytes += item["bytes"] * (progress["percent"] or 0) / 100
+                elif item["state"] == "completed":
+                    done_bytes += item["bytes"]
+                databases.append(entry)
+
+            progress = {
+                "elapsed_seconds": round(time.time() - self.started_at),
+                "finished": self.finished,
+                "max_processes": self.max_processes,
+                "max_connections": self.max_connections,
+                "processes_in_use": self.processes_in_use,
+                "connections_in_use": self.connections_in_use,
+                "total": len(self.items),
+                "completed": sum(1 for i in self.items if i["state"] == "completed"),
+                "running": sum(1 for i in self.items if i["state"] == "running"),
+                "failed": sum(1 for i in self.items if i["state"] == "error"),
+                "total_bytes": total_bytes,
+                "percent": round(100.0 * done_bytes / total_bytes, 1) if total_bytes else None,
+                "databases": databases,
+            }
+
+        path = os.path.join(self.work_dir, PROGRESS_FILE)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(progress, f)
+        os.replace(tmp_path, path)
+
+    def _copy_roles(self) -> bool:
+        cmd = build_copy_roles_command(self.source, self.target, self.no_role_passwords)
+        # pgcopydb already logs in the job's format, pass its output through
+        result = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        print(result.stdout, end="", flush=True)
+        return result.returncode == 0
+
+    def _create_databases(self) -> None:
+        """
+        Create the databases missing on the target, owned by the same role as
+        on the source when the target allows it.
+        """
+        existing = {row[0] for row in run_query(self.target, "SELECT datname FROM pg_database")}
+        for item in self.items:
+            if item["name"] in existing:
+                continue
+            name = item["name"].replace('"', '""')
+            owner = item["owner"].replace('"', '""')
+            try:
+                try:
+                    run_query(self.target, f'CREATE DATABASE "{name}" OWNER "{owner}"')
+                except Exception as e:
+                    emit_log_line(os.getpid(), "WARN", f"Creating database {item['name']} owned by {item['owner']} "
+                                  f"failed, creating it owned by the target user: {str(e).strip()}")
+                    run_query(self.target, f'CREATE DATABASE "{name}"')
+                emit_log_line(os.getpid(), "INFO", f"Created database {item['name']} on the target")
+            except Exception as e:
+                item.update({"state": "error", "error": str(e).strip()})
+                emit_log_line(os.getpid(), "ERROR", f"Could not create database {item['name']}: {str(e).strip()}")
+
+    def _clone(self, item: Dict) -> None:
+        sub_job_id = item["sub_job_id"]
+        source = with_database(self.source, item["name"])
+        target = with_database(self.target, item["name"])
+        options = self.options + [
+            "--table-jobs", str(item["table_jobs"]), "--index-jobs", str(item["index_jobs"]),
+            "--large-objects-jobs", str(LARGE_OBJECTS_JOBS)
+        ]
+        work_dir = os.path.join(self.work_dir, os.path.basename(sub_job_id))
+        log_file = f"{get_log_directory()}/job-{sub_job_id}.log"
+        started_at = time.time()
+        progress = None
+        returncode = None
+        reserved = False
+        tail = deque(maxlen=20)
+
+        try:
+            sizes = None
+            try:
+                sizes = get_relation_sizes(source)
+            except Exception as e:
+                logger.warning(f"Could not get relation sizes of database {item['name']}: {str(e)}")
+
+            # Each database reserves the work directory space of its own objects
+            object_count = len(sizes["tables"]) + len(sizes["indexes"]) if sizes else 0
+            wait_for_storage(
+                sub_job_id, estimate_workdir_bytes(object_count), [work_dir], "clone",
+                on_wait=lambda: emit_log_line(os.getpid(), "INFO", f"Database {item['name']} is waiting for storage")
+            )
+            reserved = True
+
+            split_plan = prepare_table_splits(source, options, sizes=sizes) if self.split_tables else None
+            if split_plan:
+                options += split_plan["options"]
+                item["split_plan"] = split_plan
+            if sizes:
+                start_progress(sub_job_id, sizes["tables"], sizes["indexes"], split_plan)
+
+            cmd = build_clone_command(source, target, options, work_dir=work_dir)
+            structured_log = StructuredJobLog(sub_job_id)
+            try:
+                with open(log_file, 'w') as f:
+                    process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                               text=True, bufsize=1)
+                    emit_log_line(process.pid, "INFO", f"Cloning database {item['name']} as job {sub_job_id} with "
+                                  f"{item['table_jobs']} table jobs and {item['index_jobs']} index jobs")
+                    for line in process.stdout:
+                        f.write(line)
+                        structured_log.write(line)
+                        record_output(sub_job_id, line)
+                        tail.append(line)
+                    process.wait()
+                    returncode = process.returncode
+            finally:
+                structured_log.close()
+            error = None if returncode == 0 else "".join(tail)
+        except Exception as e:
+            logger.exception(f"Exception cloning database {item['name']}")
+            error = str(e)
+
+        progress = finish_progress(sub_job_id)
+        status = "completed" if not error else "error"
+        duration = time.time() - started_at
+        if reserved:
+            # A failed database's directory is kept with the job's own work directory
+            release_storage(sub_job_id, status == "completed")
+
+        save_job_summary(sub_job_id, JobRecord({
+            "status": status,
+            "command": f"pgcopydb clone of database {item['name']} in server clone {self.job_id}",
+            "error": error,
+            "finished": True,
+            "log_file": log_file,
+            "progress": progress,
+            "split_plan": item.get("split_plan"),
+        }))
+        record_job_history(sub_job_id, {
+            "job_type": "clone", "source": source, "target": target, "options": options
+        }, status, returncode, duration, progress)
+        if status == "completed":
+            record_job_throughput(target, progress)
+            emit_log_line(os.getpid(), "INFO", f"Cloned database {item['name']} in {round(duration)}s")
+        else:
+            emit_log_line(os.getpid(), "ERROR", f"Cloning database {item['name']} failed, see job {sub_job_id}")
+
+        with self.condition:
+            item.update({
+                "state": status,
+                "finished_at": datetime.now().isoformat(),
+                "duration_seconds": round(duration, 1),
+                "percent": 100.0 if status == "completed" else (progress or {}).get("percent"),
+                "eta_seconds": None,
+            })
+            if error:
+                item["error"] = error.strip().splitlines()[-1] if error.strip() else error
+            self.processes_in_use -= database_processes(item["table_jobs"], item["index_jobs"])
+            self.connections_in_use -= database_connections(item["table_jobs"], item["index_jobs"])
+            self.condition.notify_all()
+
+    def _fits(self, item: Dict) -> bool:
+        processes = database_processes(item["table_jobs"], item["index_jobs"])
+        connections = database_connections(item["table_jobs"], item["index_jobs"])
+        return (self.processes_in_use + processes <= self.max_processes and
+                self.connections_in_use + connections <= self.max_connections)
+
+    def _clone_all(self) -> None:
+        """
+        Start the largest pending database that fits under the caps whenever
+        a clone finishes, filling the remaining slots with smaller ones.
+        """
+        pending = [i for i in self.items if i["state"] == "pending"]
+        threads = []
+        with self.condition:
+            while pending or any(i["state"] == "running" for i in self.items):
+                for item in list(pending):
+                    if not self._fits(item) and any(i["state"] == "running" for i in self.items):
+                        continue
+                    pending.remove(item)
+                    item.update({"state": "running", "started_at": datetime.now().isoformat()})
+                    self.processes_in_use += database_processes(item["table_jobs"], item["index_jobs"])
+                    self.connections_in_use += database_connections(item["table_jobs"], item["index_jobs"])
+                    thread = threading.Thread(target=self._clone, args=(item,), name=f"clone-{item['name']}")
+                    thread.start()
+                    threads.append(thread)
+                self.condition.wait(PROGRESS_SAVE_SECONDS)
+                self.save_progress()
+        for thread in threads:
+            thread.join()
+
+    def run(self) -> int:
+        """
+        Clone the server.
+
+        Returns:
+            Exit code: 0 when every database was cloned
+        """
+        os.makedirs(self.work_dir, exist_ok=True)
+
+        emit_log_line(os.getpid(), "INFO", "STEP 1: fetch the databases of the source server")
+        for database in list_databases(self.source, self.databases, self.exclude_databases):
+            table_jobs, index_jobs = database_jobs(
+                database["bytes"], self.table_jobs, self.index_jobs, self.max_processes, self.max_connections
+            )
+            self.items.append({
+                **database,
+                "sub_job_id": _sub_job_id(self.job_id, database["name"]),
+                "state": "pending",
+                "table_jobs": table_jobs,
+                "index_jobs": index_jobs,
+            })
+        self.save_progress()
+
+        try:
+            if not self.skip_roles:
+                emit_log_line(os.getpid(), "INFO", "STEP 2: copy the roles")
+                if not self._copy_roles():
+                    emit_log_line(os.getpid(), "ERROR", "Copying the roles failed, no database was cloned")
+                    return 1
+
+            emit_log_line(os.getpid(), "INFO", "STEP 3: create the databases missing on the target")
+            self._create_databases()
+
+            emit_log_line(os.getpid(), "INFO", f"STEP 4: clone {len(self.items)} databases largest first, with at most "
+                          f"{self.max_processes} processes and {self.max_connections} connections")
+            self._clone_all()
+        finally:
+            self.finished = True
+            self.save_progress()
+
+        failed = [i["name"] for i in self.items if i["state"] != "completed"]
+        if failed:
+            emit_log_line(os.getpid(), "ERROR", f"{len(failed)} of {len(self.items)} databases failed: {', '.join(failed)}")
+            return 1
+        emit_log_line(os.getpid(), "INFO", f"Cloned {len(self.items)} databases")
+        return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Clone every database of a PostgreSQL server with pgcopydb")
+    parser.add_argument("--job-id", required=True)
+    parser.add_argument("--source", required=True)
+    parser.add_argument("--target", required=True)
+    parser.add_argument("--work-dir", required=True)
+    parser.add_argument("--database", dest="databases", action="append")
+    parser.add_argument("--exclude-database", dest="exclude_databases", action="append")
+    parser.add_argument("--table-jobs", type=int, default=PGCOPYDB_DEFAULT_TABLE_JOBS)
+    parser.add_argument("--index-jobs", type=int, default=PGCOPYDB_DEFAULT_INDEX_JOBS)
+    parser.add_argument("--max-processes", type=int, default=DEFAULT_MAX_PROCESSES)
+    parser.add_argument("--max-connections", type=int, default=DEFAULT_MAX_CONNECTIONS)
+    parser.add_argument("--skip-roles", action="store_true")
+    parser.add_argument("--no-role-passwords", action="store_true")
+    parser.add_argument("--no-split-tables", dest="split_tables", action="store_false")
+    parser.add_argument("--option", dest="options", action="append", default=[])
+    args = parser.parse_args()
+
+    return ServerClone(
+        args.job_id, args.source, args.target, args.work_dir, args.databases, args.exclude_databases,
+        args.table_jobs, args.index_jobs, args.max_processes, args.max_connections,
+        args.skip_roles, args.no_role_passwords, args.split_tables, args.options
+    ).run()
@@ -0,0 +1,347 @@
+import os
+import json
+import time
+import fcntl
+import shutil
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Optional
+
+# Configure logging
+logger = logging.getLogger("pgcopydb-api-storage")
+
+# Space kept free on the volume on top of the reservations, as a fraction of its size
+STORAGE_HEADROOM_FRACTION = float(os.environ.get("STORAGE_HEADROOM_FRACTION", "0.05"))
+
+# Optional cap on the total space reserved by jobs, in bytes (0 means no cap)
+STORAGE_QUOTA_BYTES = int(os.environ.get("STORAGE_QUOTA_BYTES", "0"))
+
+# How long a job waits for space before failing
+STORAGE_WAIT_TIMEOUT_SECONDS = int(os.environ.get("STORAGE_WAIT_TIMEOUT_SECONDS", "3600"))
+STORAGE_POLL_INTERVAL_SECONDS = int(os.environ.get("STORAGE_POLL_INTERVAL_SECONDS", "30"))
+
+# Work directories of failed jobs are kept this long for inspection and --resume
+WORKDIR_RETENTION_HOURS = int(os.environ.get("WORKDIR_RETENTION_HOURS", "24"))
+STORAGE_CLEANUP_INTERVAL_SECONDS = int(os.environ.get("STORAGE_CLEANUP_INTERVAL_SECONDS", "600"))
+
+
+def get_storage_directory() -> str:
+    """
+    Get the base directory of the volume holding work directories and dumps.
+
+    Returns:
+        Path to storage directory
+    """
+    storage_dir = "/app/pgcopydb_files" if os.path.exists("/app/pgcopydb_files") else "/tmp/pgcopydb_files"
+    os.makedirs(storage_dir, exist_ok=True)
+    return storage_dir
+
+
+def get_job_workdir(job_id: str) -> str:
+    """
+    Get the pgcopydb work directory of a job.
+
+    Args:
+        job_id: ID of the job
+
+    Returns:
+        Path to the job's work directory
+    """
+    return os.path.join(get_storage_directory(), "temp_storage", job_id)
+
+
+def _registry_file() -> str:
+    return os.path.join(get_storage_directory(), "storage-reservations.json")
+
+
+@contextmanager
+def _registry() -> Iterator[Dict[str, Dict]]:
+    """
+    Open the reservation registry for update, locked against other replicas
+    and the runner process.
+
+    Yields:
+        Dictionary of storage entries by job ID, written back on exit
+    """
+    path = _registry_file()
+    with open(f"{path}.lock", 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            with open(path, 'r') as f:
+                entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            entries = {}
+
+        yield entries
+
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f, indent=2)
+        os.replace(tmp_path, path)
+
+
+def _path_size(path: str) -> int:
+    """
+    Get the space used by a file or directory tree.
+
+    Args:
+        path: Path to measure
+
+    Returns:
+        Size in bytes, 0 if the path does not exist
+    """
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                continue
+    return total
+
+
+def _is_managed(path: str) -> bool:
+    """
+    Check whether a path lies on the storage volume, the only place where
+    the service deletes files.
+    """
+    base = os.path.realpath(get_storage_directory())
+    return os.path.realpath(path).startswith(base + os.sep)
+
+
+def _outstanding_bytes(entries: Dict[str, Dict]) -> int:
+    """
+    Get the space reserved by running jobs that they have not written yet.
+    """
+    return sum(
+        max(entry["reserved_bytes"] - sum(_path_size(p) for p in entry["paths"]), 0)
+        for entry in entries.values()
+        if entry["status"] == "reserved"
+    )
+
+
+def reserve_storage(job_id: str, required_bytes: int, paths: List[str], job_type: Optional[str]) -> bool:
+    """
+    Reserve space on the storage volume for a job if it fits.
+
+    Args:
+        job_id: ID of the job
+        required_bytes: Estimated space the job needs
+        paths: Directories the job writes to
+        job_type: Type of job
+
+    Returns:
+        True if the reservation was made
+    """
+    usage = shutil.disk_usage(get_storage_directory())
+
+    with _registry() as entries:
+        reserved = sum(e["reserved_bytes"] for e in entries.values() if e["status"] == "reserved")
+        available = usage.free - _outstanding_bytes(entries) - usage.total * STORAGE_HEADROOM_FRACTION
+
+        if required_bytes > available:
+            return False
+        if STORAGE_QUOTA_BYTES and reserved + required_bytes > STORAGE_QUOTA_BYTES:
+            return False
+
+        entries[job_id] = {
+            "job_type": job_type,
+            "status": "reserved",
+            "reserved_bytes": required_bytes,
+            "paths": paths,
+            "created_at": datetime.now().isoformat(),
+            "expires_at": None,
+        }
+        return True
+
+
+def wait_for_storage(job_id: str, required_bytes: int, paths: List[str], job_type: Optional[str],
+                     on_wait: Optional[Callable[[], None]] = None) -> None:
+    """
+    Wait until a job's space reservation can be made.
+
+    Args:
+        job_id: ID of the job
+        required_bytes: Estimated space the job needs
+        paths: Directories the job writes to
+        job_type: Type of job
+        on_wait: Called once if the job has to wait
+    """
+    deadline = time.time() + STORAGE_WAIT_TIMEOUT_SECONDS
+    waiting = False
+
+    while not reserve_storage(job_id, required_bytes, paths, job_type):
+        if time.time() >= deadline:
+            raise Exception(f"Insufficient storage: {required_bytes} bytes could not be reserved "
+                            f"within {STORAGE_WAIT_TIMEOUT_SECONDS} seconds")
+        if not waiting:
+            logger.info(f"Job {job_id} waiting for {required_bytes} bytes of storage")
+            waiting = True
+            if on_wait:
+                on_wait()
+        time.sleep(STORAGE_POLL_INTERVAL_SECONDS)
+
+
+def _remove_paths(paths: List[str]) -> None:
+    for path in paths:
+        if not _is_managed(path):
+            logger.warning(f"Not removing {path}: outside the storage volume")
+            continue
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.exists(path):
+            os.remove(path)
+
+
+def release_storage(job_id: str, success: bool, keep_paths: bool = False,
+                    retention_hours: Optional[int] = None) -> None:
+    """
+    Release the reservation of a finished job and clean up after it.
+
+    Work directories of successful jobs are removed right away; those of
+    failed jobs are kept for WORKDIR_RETENTION_HOURS. Kept artifacts such as
+    dumps stay until their retention expires, or indefinitely without one.
+    Directories chosen by the caller, outside the job's own work directory,
+    only ever expire with a retention; when a job without one fails they are
+    left in place and no longer tracked.
+
+    Args:
+        job_id: ID of the job
+        success: Whether the job succeeded
+        keep_paths: Whether the job's paths are artifacts to keep, like a dump
+        retention_hours: Retention of kept artifacts
+    """
+    with _registry() as entries:
+        entry = entries.get(job_id)
+        if not entry:
+            return
+
+        if success and not keep_paths:
+            _remove_paths(entry["paths"])
+            del entries[job_id]
+            return
+
+        if success:
+            entry["status"] = "retained"
+            hours = retention_hours
+        else:
+            entry["status"] = "failed"
+            hours = WORKDIR_RETENTION_HOURS
+            if retention_hours:
+                hours = max(hours, retention_hours)
+            else:
+                workdir = os.path.realpath(get_job_workdir(job_id))
+                own_paths = [
+                    p for p in entry["paths"]
+                    if os.path.realpath(p) == workdir or os.path.realpath(p).startswith(workdir + os.sep)
+                ]
+                for path in set(entry["paths"]) - set(own_paths):
+                    logger.info(f"Keeping {path} of failed job {job_id}, it is not a work directory of the job")
+                entry["paths"] = own_paths
+                if not own_paths:
+                    del entries[job_id]
+                    return
+        entry["reserved_bytes"] = 0
+        entry["used_bytes"] = sum(_path_size(p) for p in entry["paths"])
+        if hours:
+            entry["expires_at"] = (datetime.now() + timedelta(hours=hours)).isoformat()
+
+
+def delete_job_storage(job_id: str) -> bool:
+    """
+    Remove the files of a finished job and forget it.
+
+    Args:
+        job_id: ID of the job
+
+    Returns:
+        True if the job had storage tracked
+    """
+    with _registry() as entries:
+        entry = entries.get(job_id)
+        if not entry:
+            return False
+        if entry["status"] == "reserved":
+            raise ValueError(f"Job {job_id} is still running")
+        _remove_paths(entry["paths"])
+        del entries[job_id]
+        return True
+
+
+def cleanup_expired_storage() -> List[str]:
+    """
+    Remove the files of jobs whose retention has expired.
+
+    Returns:
+        List of job IDs cleaned up
+    """
+    now = datetime.now().isoformat()
+    removed = []
+
+    with _registry() as entries:
+        for job_id, entry in list(entries.items()):
+            if entry["status"] != "reserved" and entry.get("expires_at") and entry["expires_at"] <= now:
+                _remove_paths(entry["paths"])
+                del entries[job_id]
+                removed.append(job_id)
+
+    if removed:
+        logger.info(f"Removed expired storage of jobs: {', '.join(removed)}")
+    return removed
+
+
+def start_storage_cleanup() -> None:
+    """
+    Periodically remove expired work directories and artifacts in a background thread.
+    """
+    def loop() -> None:
+        while True:
+            try:
+                cleanup_expired_storage()
+            except Exception:
+                logger.exception("Error cleaning up expired storage")
+            time.sleep(STORAGE_CLEANUP_INTERVAL_SECONDS)
+
+    threading.Thread(target=loop, name="storage-cleanup", daemon=True).start()
+
+
+def get_storage_usage() -> Dict:
+    """
+    Get the state of the storage volume and the space used by every job.
+
+    Returns:
+        Dictionary with volume totals and per-job usage
+    """
+    storage_dir = get_storage_directory()
+    usage = shutil.disk_usage(storage_dir)
+
+    with _registry() as entries:
+        jobs = [
+            {
+                "job_id": job_id,
+                "job_type": entry["job_type"],
+                "status": entry["status"],
+                "reserved_bytes": entry["reserved_bytes"],
+                "used_bytes": sum(_path_size(p) for p in entry["paths"]),
+                "paths": entry["paths"],
+                "created_at": entry["created_at"],
+                "expires_at": entry.get("expires_at"),
+            }
+            for job_id, entry in entries.items()
+        ]
+        outstanding = _outstanding_bytes(entries)
+
+    return {
+        "path": storage_dir,
+        "total_bytes": usage.total,
+        "used_bytes": usage.used,
+        "free_bytes": usage.free,
+        "reserved_bytes": sum(j["reserved_bytes"] for j in jobs if j["status"] == "reserved"),
+        "available_bytes": max(int(usage.free - outstanding - usage.total * STORAGE_HEADROOM_FRACTION), 0),
+        "quota_bytes": STORAGE_QUOTA_BYTES or None,
+        "jobs": jobs,
+    }
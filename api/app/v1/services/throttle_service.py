@@ -0,0 +1,284 @@
+import os
+import signal
+import logging
+import threading
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from app.v1.services.pgcopydb_service import run_query
+
+# Configure logging
+logger = logging.getLogger("pgcopydb-api-throttle")
+
+# Signals are considered healthy below this fraction of their limit
+RECOVERY_FRACTION = 0.8
+
+# Prefix of the application_name of the job's own sessions: pgcopydb names
+# its connections after itself, and jobs run with PGAPPNAME set to it
+JOB_APPLICATION_NAME = "pgcopydb"
+
+# Load signals of the source database, sampled by the controller. The job's own
+# sessions are left out, paused workers included, or the controller would
+# measure the load it causes and back off to its minimum.
+LOAD_QUERY = """
+    SELECT
+        (SELECT count(*) FROM pg_stat_activity
+          WHERE state = 'active' AND {sessions}),
+        (SELECT count(*) FROM pg_stat_activity
+          WHERE state = 'active' AND wait_event_type IN ('IO', 'Lock', 'LWLock')
+            AND {sessions}),
+        CASE WHEN pg_is_in_recovery() THEN 0
+             ELSE (SELECT coalesce(max(pg_wal_lsn_diff(pg_current_wal_lsn(), restart_lsn)), 0)::bigint
+                     FROM pg_replication_slots)
+        END
+"""
+
+# Throttle state by job ID
+throttles: Dict[str, Dict] = {}
+
+# Events stopping the controller of each throttled job
+_stop_events: Dict[str, threading.Event] = {}
+
+
+def _other_sessions(source: str, target: Optional[str]) -> str:
+    """
+    Build the condition selecting the sessions that are not part of the job:
+    not the probe itself, not pgcopydb's, and not those on the target
+    database when it lives on the same server as the source.
+    """
+    condition = f"pid <> pg_backend_pid() AND coalesce(application_name, '') NOT LIKE '{JOB_APPLICATION_NAME}%'"
+    if target:
+        source_url, target_url = urlparse(source), urlparse(target)
+        target_db = target_url.path.lstrip("/")
+        same_server = (source_url.hostname, source_url.port or 5432) == (target_url.hostname, target_url.port or 5432)
+        if same_server and target_db and target_db != source_url.path.lstrip("/"):
+            condition += " AND datname IS DISTINCT FROM '{}'".format(target_db.replace("'", "''"))
+    return condition
+
+
+def sample_source_load(connection_string: str, target: Optional[str] = None) -> Dict[str, int]:
+    """
+    Sample the load signals of the source database, leaving out the job's
+    own sessions.
+
+    Args:
+        connection_string: Source database connection string
+        target: Target database connection string of the job
+
+    Returns:
+        Dictionary with active sessions, waiting sessions and replication slot lag in bytes
+    """
+    query = LOAD_QUERY.format(sessions=_other_sessions(connection_string, target))
+    active, waiting, lag = run_query(connection_string, query)[0]
+    return {
+        "active_connections": int(active),
+        "waiting_sessions": int(waiting),
+        "replication_lag_bytes": int(lag or 0),
+    }
+
+
+def _process_tree(root_pid: int) -> List[int]:
+    """
+    Find the leaf processes below a process: the pgcopydb workers doing the
+    actual COPY, CREATE INDEX and VACUUM work.
+
+    Args:
+        root_pid: PID of the job's process group leader
+
+    Returns:
+        Sorted list of leaf process IDs
+    """
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", 'r') as f:
+                # The command name may contain spaces, the parent PID follows it
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    leaves = []
+    stack = list(children.get(root_pid, []))
+    while stack:
+        pid = stack.pop()
+        if pid in children:
+            stack.extend(children[pid])
+        else:
+            leaves.append(pid)
+    return sorted(leaves)
+
+
+def _signal(pids: List[int], sig: int) -> None:
+    for pid in pids:
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+
+def _breach_level(sample: Dict[str, int], settings: Dict) -> float:
+    """
+    Get the highest ratio between a load signal and its limit.
+
+    Args:
+        sample: Sampled load signals
+        settings: Throttle settings with the limits
+
+    Returns:
+        Highest signal to limit ratio, 0 when no limit is set
+    """
+    ratios = [0.0]
+    for signal_name, limit_name in (
+        ("active_connections", "max_active_connections"),
+        ("waiting_sessions", "max_waiting_sessions"),
+        ("replication_lag_bytes", "max_replication_lag_bytes"),
+    ):
+        limit = settings.get(limit_name)
+        if limit:
+            ratios.append(sample[signal_name] / limit)
+    return max(ratios)
+
+
+def _control_loop(job_id: str, root_pid: int, source: str, target: Optional[str], settings: Dict,
+                  stop_event: threading.Event) -> None:
+    """
+    Adjust the effective concurrency and I/O rate of a job to the source load.
+
+    Concurrency is reduced by pausing (SIGSTOP) pgcopydb worker processes and
+    grown by resuming them; once only the minimum number of workers is left,
+    the remaining workers are additionally paused for part of each interval.
+    Decreases are multiplicative and increases additive, so the job backs off
+    quickly and recovers gradually.
+
+    Args:
+        job_id: ID of the job
+        root_pid: PID of the job's process group leader
+        source: Source database connection string
+        target: Target database connection string
+        settings: Throttle settings
+        stop_event: Event that ends the loop when set
+    """
+    state = throttles[job_id]
+    interval = settings.get("sample_interval_seconds") or 10
+    min_workers = settings.get("min_workers") or 1
+    min_duty_cycle = settings.get("min_duty_cycle") or 0.25
+    paused: List[int] = []
+
+    try:
+        while not stop_event.is_set():
+            workers = _process_tree(root_pid)
+            max_workers = min(settings.get("max_workers") or len(workers), len(workers)) or min_workers
+
+            try:
+                sample = sample_source_load(source, target)
+                level = _breach_level(sample, settings)
+            except Exception as e:
+                logger.warning(f"Could not sample source load for job {job_id}: {str(e)}")
+                sample, level = None, 0.0
+
+            effective = state["effective_workers"] or max_workers
+            duty_cycle = state["duty_cycle"]
+            if level > 1.0:
+                if effective > min_workers:
+                    effective = max(min_workers, effective // 2)
+                else:
+                    duty_cycle = max(min_duty_cycle, duty_cycle / 2)
+            elif level < RECOVERY_FRACTION:
+                if duty_cycle < 1.0:
+                    duty_cycle = min(1.0, duty_cycle + 0.25)
+                else:
+                    effective = min(max_workers, effective + 1)
+            effective = max(min(effective, max_workers), min(min_workers, max_workers))
+
+            if (effective, duty_cycle) != (state["effective_workers"], state["duty_cycle"]):
+                state["adjustments"] += 1
+                logger.info(f"Throttling job {job_id}: {effective}/{len(workers)} workers, duty cycle {duty_cycle:.2f}")
+            state.update({
+                "workers": len(workers),
+                "effective_workers": effective,
+                "duty_cycle": duty_cycle,
+                "last_sample": sample,
+                "load_ratio": round(level, 2),
+            })
+
+            # Keep the oldest workers running, pause the ones above the effective concurrency
+            running, to_pause = workers[:effective], workers[effective:]
+            _signal([pid for pid in paused if pid not in to_pause], signal.SIGCONT)
+            _signal(to_pause, signal.SIGSTOP)
+            paused = to_pause
+
+            if duty_cycle < 1.0:
+                if stop_event.wait(interval * duty_cycle):
+                    break
+                _signal(running, signal.SIGSTOP)
+                stop_event.wait(interval * (1 - duty_cycle))
+                _signal(running, signal.SIGCONT)
+            else:
+                stop_event.wait(interval)
+    except Exception:
+        logger.exception(f"Error throttling job {job_id}")
+    finally:
+        # Never leave workers stopped behind
+        _signal(_process_tree(root_pid), signal.SIGCONT)
+
+
+def start_throttle(job_id: str, root_pid: int, source: str, settings: Dict, target: Optional[str] = None) -> None:
+    """
+    Start the adaptive throttle controller of a job.
+
+    Args:
+        job_id: ID of the job
+        root_pid: PID of the job's process group leader
+        source: Source database connection string
+        settings: Throttle settings with the load limits and bounds
+        target: Target database connection string, whose sessions are not source load
+    """
+    throttles[job_id] = {
+        "workers": 0,
+        "effective_workers": None,
+        "duty_cycle": 1.0,
+        "last_sample": None,
+        "load_ratio": None,
+        "adjustments": 0,
+        "settings": settings,
+    }
+    stop_event = threading.Event()
+    _stop_events[job_id] = stop_event
+    threading.Thread(
+        target=_control_loop,
+        args=(job_id, root_pid, source, target, settings, stop_event),
+        name=f"throttle-{job_id}",
+        daemon=True
+    ).start()
+
+
+def get_throttle(job_id: str) -> Optional[Dict]:
+    """
+    Get the current throttle state of a job.
+
+    Args:
+        job_id: ID of the job
+
+    Returns:
+        Throttle state or None if the job is not throttled
+    """
+    return throttles.get(job_id)
+
+
+def stop_throttle(job_id: str) -> Optional[Dict]:
+    """
+    Stop the throttle controller of a job and return its final state.
+
+    Args:
+        job_id: ID of the job
+
+    Returns:
+        Final throttle state or None if the job was not throttled
+    """
+    stop_event = _stop_events.pop(job_id, None)
+    if stop_event:
+        stop_event.set()
+    return throttles.pop(job_id, None)
@@ -0,0 +1,403 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import urllib.request
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from app.utils.command import get_log_directory
+from app.v1.services.progress_service import (
+    LOG_LINE_RE, COPY_RE, CREATE_INDEX_RE, VACUUM_RE, normalize_name
+)
+from app.v1.services.log_service import ALTER_TABLE_RE, STEP_RE, detect_phase
+
+# Configure logging
+logger = logging.getLogger("pgcopydb-api-trace")
+
+# OTLP/HTTP collector traces are exported to, e.g. http://localhost:4318 (unset disables the export)
+OTLP_ENDPOINT = os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT")
+OTEL_SERVICE_NAME = os.environ.get("OTEL_SERVICE_NAME", "pgcopydb-api")
+
+# Running jobs save their trace this often, so replicas can show the timeline
+TRACE_FLUSH_SECONDS = int(os.environ.get("TRACE_FLUSH_SECONDS", "30"))
+
+# Number of slowest table spans reported in the timeline
+MAX_SLOWEST_SPANS = 20
+
+# Lines starting a task of a pgcopydb worker process, by phase
+TASK_RES = (
+    ("copy", COPY_RE),
+    ("index", CREATE_INDEX_RE),
+    ("vacuum", VACUUM_RE),
+    ("constraints", ALTER_TABLE_RE),
+)
+
+JOB = "job"
+PHASE = "phase"
+TABLE = "table"
+
+# Active tracers by job ID
+tracers: Dict[str, "JobTracer"] = {}
+
+
+def _span_id() -> str:
+    return os.urandom(8).hex()
+
+
+def _trace_id(job_id: str) -> str:
+    """
+    Use the job's UUID as its trace ID, so traces can be found by job.
+    """
+    hex_id = job_id.replace("-", "")
+    if len(hex_id) == 32 and all(c in "0123456789abcdef" for c in hex_id.lower()):
+        return hex_id.lower()
+    return hashlib.md5(job_id.encode()).hexdigest()
+
+
+def get_trace_file(job_id: str) -> str:
+    return f"{get_log_directory()}/job-{job_id}.trace.json"
+
+
+class JobTracer:
+    """
+    Derive trace spans from the pgcopydb output stream of a job: one root
+    span for the job, one per phase and one per table task.
+
+    A task span runs from the line where a worker process starts working on
+    a table until the same process starts its next task or the job ends.
+    Phases announced as pgcopydb steps last until the next step is
+    announced; phases with concurrent workers, such as COPY and index
+    builds, cover all their task spans.
+    """
+
+    def __init__(self, job_id: str, job_type: Optional[str]):
+        self.lock = threading.Lock()
+        self.job_id = job_id
+        self.trace_id = _trace_id(job_id)
+        self.root = self._new_span(f"{job_type or 'job'} {job_id}", JOB, time.time())
+        self.root["attributes"]["job.type"] = job_type
+        self.status = "running"
+        self.phases: Dict[str, Dict] = {}
+        self.step_phase: Optional[str] = None
+        # Open task span of each pgcopydb worker process
+        self.tasks: Dict[str, Dict] = {}
+        self.spans: List[Dict] = []
+        self.saved_at = time.time()
+
+    def _new_span(self, name: str, kind: str, start: float, parent: Optional[Dict] = None) -> Dict:
+        return {
+            "span_id": _span_id(),
+            "parent_span_id": parent["span_id"] if parent else None,
+            "name": name,
+            "kind": kind,
+            "start_time": start,
+            "end_time": None,
+            "status": "ok",
+            "attributes": {},
+        }
+
+    def _phase(self, name: str, now: float) -> Dict:
+        span = self.phases.get(name)
+        if not span:
+            span = self._new_span(name, PHASE, now, self.root)
+            span["attributes"]["phase"] = name
+            self.phases[name] = span
+        span["end_time"] = max(span["end_time"] or now, now)
+        return span
+
+    def _close_task(self, pid: str, now: float) -> None:
+        span = self.tasks.pop(pid, None)
+        if span:
+            span["end_time"] = now
+            phase = self.phases[span["attributes"]["phase"]]
+            phase["end_time"] = max(phase["end_time"], now)
+
+    def record_line(self, line: str) -> None:
+        """
+        Update the spans from one line of pgcopydb output.
+
+        Args:
+            line: Output line
+        """
+        match = LOG_LINE_RE.match(line)
+        if not match:
+            return
+
+        pid = match.group("pid")
+        level = match.group("level")
+        message = match.group("message").strip()
+        now = time.time()
+
+        with self.lock:
+            phase = detect_phase(message, self.step_phase)
+            if STEP_RE.match(message) and phase:
+                # The previous step ends when the next one is announced
+                if self.step_phase:
+                    self._phase(self.step_phase, now)
+                self.step_phase = phase
+            if phase:
+                self._phase(phase, now)
+
+            for task_phase, regex in TASK_RES:
+                task_match = regex.match(message)
+                if not task_match:
+                    continue
+                self._close_task(pid, now)
+                table = normalize_name(task_match.group("table"))
+                if task_phase != "copy":
+                    # Index builds and vacuum of a table only start once its data is copied
+                    for copy_pid, task in list(self.tasks.items()):
+                        if task["attributes"]["phase"] == "copy" and task["attributes"]["table"] == table:
+                            self._close_task(copy_pid, now)
+                span = self._new_span(f"{task_phase} {table}", TABLE, now, self._phase(task_phase, now))
+                span["attributes"].update({"phase": task_phase, "table": table, "pid": int(pid)})
+                if task_phase == "index":
+                    span["attributes"]["index"] = normalize_name(task_match.group("index"))
+                self.tasks[pid] = span
+                self.spans.append(span)
+                break
+
+            if level in ("ERROR", "FATAL", "PANIC"):
+                task = self.tasks.get(pid)
+                if task:
+                    task["status"] = "error"
+                    task["attributes"]["error"] = message
+                if phase:
+                    self.phases[phase]["status"] = "error"
+
+    def add_phase(self, name: str, start: float, end: float) -> None:
+        """
+        Record a phase run by the service itself, such as waiting for
+        storage or compressing a dump.
+        """
+        with self.lock:
+            span = self._new_span(name, PHASE, start, self.root)
+            span["end_time"] = end
+            span["attributes"]["phase"] = name
+            self.phases[name] = span
+
+    def finish(self, status: str) -> None:
+        now = time.time()
+        with self.lock:
+            for pid in list(self.tasks):
+                self._close_task(pid, now)
+            if self.step_phase:
+                self._phase(self.step_phase, now)
+            self.root["end_time"] = now
+            self.status = status
+            if status != "completed":
+                self.root["status"] = "error"
+
+    def snapshot(self) -> Dict:
+        with self.lock:
+            return {
+                "job_id": self.job_id,
+                "trace_id": self.trace_id,
+                "status": self.status,
+                "spans": [dict(s) for s in [self.root, *self.phases.values(), *self.spans]],
+            }
+
+    def save(self) -> None:
+        self.saved_at = time.time()
+        path = get_trace_file(self.job_id)
+        try:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.exception(f"Error saving trace of job {self.job_id}: {str(e)}")
+
+
+def start_trace(job_id: str, job_type: Optional[str]) -> None:
+    tracers[job_id] = JobTracer(job_id, job_type)
+
+
+def record_trace(job_id: str, line: str) -> None:
+    tracer = tracers.get(job_id)
+    if tracer:
+        tracer.record_line(line)
+        if time.time() - tracer.saved_at >= TRACE_FLUSH_SECONDS:
+            tracer.save()
+
+
+def trace_phase(job_id: str, name: str, start: float, end: Optional[float] = None) -> None:
+    tracer = tracers.get(job_id)
+    if tracer:
+        tracer.add_phase(name, start, end or time.time())
+
+
+def finish_trace(job_id: str, status: str) -> None:
+    """
+    Close the spans of a finished job, save its trace and export it to the
+    OTLP collector when one is configured.
+
+    Args:
+        job_id: ID of the job
+        status: Final status of the job
+    """
+    tracer = tracers.pop(job_id, None)
+    if not tracer:
+        return
+    tracer.finish(status)
+    tracer.save()
+    if OTLP_ENDPOINT:
+        try:
+            export_trace(tracer.snapshot())
+        except Exception as e:
+            logger.warning(f"Could not export trace of job {job_id} to {OTLP_ENDPOINT}: {str(e)}")
+
+
+def get_trace(job_id: str) -> Optional[Dict]:
+    """
+    Get the spans of a job, live while it runs on this process and from its
+    saved trace otherwise.
+
+    Args:
+        job_id: ID of the job
+
+    Returns:
+        Trace snapshot or None if the job has no trace
+    """
+    tracer = tracers.get(job_id)
+    if tracer:
+        return tracer.snapshot()
+    try:
+        with open(get_trace_file(job_id), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _duration(span: Dict, now: float) -> float:
+    return round((span["end_time"] or now) - span["start_time"], 3)
+
+
+def build_timeline(trace: Dict) -> Dict:
+    """
+    Turn a trace into a timeline: phases in start order, every span, the
+    slowest table tasks, and where the time went.
+
+    Args:
+        trace: Trace snapshot
+
+    Returns:
+        Timeline dictionary
+    """
+    now = time.time()
+    spans = trace["spans"]
+    root = next(s for s in spans if s["kind"] == JOB)
+    phases = sorted((s for s in spans if s["kind"] == PHASE), key=lambda s: s["start_time"])
+    tasks = [s for s in spans if s["kind"] == TABLE]
+    slowest = sorted(tasks, key=lambda s: _duration(s, now), reverse=True)[:MAX_SLOWEST_SPANS]
+
+    def entry(span: Dict) -> Dict:
+        return {
+            "span_id": span["span_id"],
+            "parent_span_id": span["parent_span_id"],
+            "name": span["name"],
+            "kind": span["kind"],
+            "start_time": datetime.fromtimestamp(span["start_time"]).isoformat(),
+            "end_time": datetime.fromtimestamp(span["end_time"]).isoformat() if span["end_time"] else None,
+            "offset_seconds": round(span["start_time"] - root["start_time"], 3),
+            "duration_seconds": _duration(span, now),
+            "status": span["status"],
+            "attributes": span["attributes"],
+        }
+
+    longest_phase = max(phases, key=lambda s: _duration(s, now), default=None)
+    job_seconds = _duration(root, now)
+
+    return {
+        "job_id": trace["job_id"],
+        "trace_id": trace["trace_id"],
+        "status": trace["status"],
+        "duration_seconds": job_seconds,
+        "phases": [
+            {**entry(s), "tasks": sum(1 for t in tasks if t["parent_span_id"] == s["span_id"])}
+            for s in phases
+        ],
+        "slowest_tables": [entry(s) for s in slowest],
+        "bottleneck": {
+            "phase": longest_phase["name"] if longest_phase else None,
+            "phase_seconds": _duration(longest_phase, now) if longest_phase else None,
+            "table": slowest[0]["attributes"]["table"] if slowest else None,
+            "table_phase": slowest[0]["attributes"]["phase"] if slowest else None,
+            "table_seconds": _duration(slowest[0], now) if slowest else None,
+            "table_share": round(_duration(slowest[0], now) / job_seconds, 3) if slowest and job_seconds else None,
+        },
+        "spans": [entry(s) for s in spans],
+    }
+
+
+def _otlp_value(value) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(trace: Dict) -> Dict:
+    """
+    Convert a trace to the OTLP/HTTP JSON encoding.
+
+    Args:
+        trace: Trace snapshot
+
+    Returns:
+        ExportTraceServiceRequest document
+    """
+    now = time.time()
+    spans = []
+    for span in trace["spans"]:
+        attributes = {"job.id": trace["job_id"], "span.kind": span["kind"], **span["attributes"]}
+        otlp_span = {
+            "traceId": trace["trace_id"],
+            "spanId": span["span_id"],
+            "name": span["name"],
+            # SPAN_KIND_INTERNAL
+            "kind": 1,
+            "startTimeUnixNano": str(int(span["start_time"] * 1e9)),
+            "endTimeUnixNano": str(int((span["end_time"] or now) * 1e9)),
+            "attributes": [
+                {"key": key, "value": _otlp_value(value)}
+                for key, value in attributes.items() if value is not None
+            ],
+            # STATUS_CODE_OK or STATUS_CODE_ERROR
+            "status": {"code": 2 if span["status"] == "error" else 1},
+        }
+        if span["parent_span_id"]:
+            otlp_span["parentSpanId"] = span["parent_span_id"]
+        spans.append(otlp_span)
+
+    return {
+        "resourceSpans": [{
+            "resource": {
+                "attributes": [{"key": "service.name", "value": {"stringValue": OTEL_SERVICE_NAME}}]
+            },
+            "scopeSpans": [{"scope": {"name": "pgcopydb-api"}, "spans": spans}],
+        }]
+    }
+
+
+def export_trace(trace: Dict) -> None:
+    """
+    Send a trace to the OTLP/HTTP collector.
+
+    Args:
+        trace: Trace snapshot
+    """
+    request = urllib.request.Request(
+        f"{OTLP_ENDPOINT.rstrip('/')}/v1/traces",
+        data=json.dumps(to_otlp(trace)).encode(),
+        headers={"Content-Type": "application/json"},
+        method="POST"
+    )
+    with urllib.request.urlopen(request, timeout=10) as response:
+        response.read()
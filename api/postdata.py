@@ -0,0 +1,13 @@
+import sys
+import logging
+from app.v1.services.postdata_service import main
+
+# Setup logging configuration
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+
+if __name__ == "__main__":
+    # Run a post-data job: index and constraint builds of a restored dump
+    sys.exit(main())
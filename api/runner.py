@@ -0,0 +1,12 @@
+import logging
+from app.v1.services.runner_service import serve
+
+# Setup logging configuration
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+
+if __name__ == "__main__":
+    # Run the job supervisor that owns the pgcopydb processes
+    serve()
@@ -0,0 +1,13 @@
+import sys
+import logging
+from app.v1.services.server_clone_service import main
+
+# Setup logging configuration
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+)
+
+if __name__ == "__main__":
+    # Run a server clone job: roles once, then every database as a sub-job
+    sys.exit(main())